@@ -4,10 +4,11 @@
 
 from dotenv import load_dotenv
 import os
+import re
 import requests
 import json
+import time
 import pandas as pd
-import glob
 import certifi
 import urllib3
 
@@ -37,6 +38,129 @@ def _requests_verify_kwargs():
     # Disable SSL verification for development/testing
     return {"verify": False}
 
+# BrightData API endpoint (can point to fake_brightdata.py, a local stand-in server for testing)
+BRIGHTDATA_API_URL = os.getenv("BRIGHTDATA_API_URL", "https://api.brightdata.com/datasets/v3")
+
+# seconds to connect, and to wait for each response and each chunk of the download, before a request fails;
+# a stalled download is then retried like any other interrupted one
+BRIGHTDATA_TIMEOUT = (10, float(os.getenv("BRIGHTDATA_TIMEOUT", "60")))
+
+# poll the snapshot progress until it is ready, for at most this many seconds (0 checks once)
+SNAPSHOT_POLL_TIMEOUT = float(os.getenv("SNAPSHOT_POLL_TIMEOUT", "0"))
+SNAPSHOT_POLL_INTERVAL = float(os.getenv("SNAPSHOT_POLL_INTERVAL", "10"))
+SNAPSHOT_POLL_MAX_INTERVAL = float(os.getenv("SNAPSHOT_POLL_MAX_INTERVAL", "300"))
+
+# attempts to download the snapshot, each one resuming where the previous one stopped
+SNAPSHOT_DOWNLOAD_RETRIES = int(os.getenv("SNAPSHOT_DOWNLOAD_RETRIES", "5"))
+
+# bytes written to disk at a time while downloading the snapshot
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def wait_for_snapshot(session, snapshot_id):
+    """Check the snapshot progress, polling with exponential backoff until it is ready or failed or the timeout is reached.
+
+    Returns the last status: "ready", "failed", the status of a snapshot that is still being built, or
+    "unreachable" when the last check timed out or couldn't connect (those checks are retried like the others).
+    """
+    deadline = time.monotonic() + SNAPSHOT_POLL_TIMEOUT
+    interval = SNAPSHOT_POLL_INTERVAL
+
+    while True:
+        try:
+            response = session.get(
+                BRIGHTDATA_API_URL + '/progress/' + snapshot_id,
+                headers=headers_status,
+                timeout=BRIGHTDATA_TIMEOUT,
+                **_requests_verify_kwargs()
+            )
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            print(f"Checking the snapshot progress failed: {e}")
+            status = "unreachable"
+        else:
+            response.raise_for_status()
+            status = response.json()['status']
+            print(f"status: {status}")
+
+        if status in ("ready", "failed"):
+            return status
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return status
+
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, SNAPSHOT_POLL_MAX_INTERVAL)
+
+
+def download_snapshot(session, snapshot_id, file_path):
+    """Stream the snapshot to disk in chunks, resuming an interrupted download, and move it into place atomically.
+
+    The partial file is named after the snapshot ID, so only a download of the same snapshot is resumed;
+    partial files of other snapshots are deleted. Connection errors and 5xx responses are retried, other
+    errors (e.g. 401 or 404) are raised right away.
+    """
+    part_prefix = file_path + "."
+    part_path = f"{part_prefix}{re.sub(r'[^A-Za-z0-9_-]', '_', snapshot_id)}.part"
+
+    # a partial file of an older snapshot must never be resumed with the bytes of this one
+    folder = os.path.dirname(file_path) or "."
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if path.startswith(part_prefix) and path.endswith(".part") and path != part_path:
+            os.remove(path)
+
+    for attempt in range(SNAPSHOT_DOWNLOAD_RETRIES):
+        downloaded = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        request_headers = dict(headers)
+        if downloaded:
+            request_headers["Range"] = f"bytes={downloaded}-"
+
+        try:
+            with session.get(
+                BRIGHTDATA_API_URL + '/snapshot/' + snapshot_id,
+                headers=request_headers,
+                stream=True,
+                timeout=BRIGHTDATA_TIMEOUT,
+                **_requests_verify_kwargs()
+            ) as response:
+
+                if response.status_code == 416:
+                    # the range starts at or past the end: complete only if the partial file has exactly the snapshot's size
+                    total_size = response.headers.get("Content-Range", "").rpartition("/")[2]
+                    if total_size.isdigit() and int(total_size) == downloaded:
+                        break
+                    os.remove(part_path)
+                    raise requests.exceptions.ConnectionError("Partial download doesn't match the snapshot, restarting download")
+                response.raise_for_status()
+
+                # 206 means the server resumes where we stopped, otherwise it sends the whole snapshot again
+                resumed = downloaded and response.status_code == 206
+                if downloaded:
+                    print(f"Resuming download at {downloaded} bytes" if resumed else "Server can't resume, restarting download")
+                expected_size = int(response.headers["Content-Length"]) + (downloaded if resumed else 0) if "Content-Length" in response.headers else None
+
+                with open(part_path, "ab" if resumed else "wb") as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+
+            if expected_size is not None and os.path.getsize(part_path) < expected_size:
+                raise requests.exceptions.ConnectionError("Download ended before the whole snapshot was received")
+            break
+
+        except requests.exceptions.RequestException as e:
+            # client errors (bad API key, unknown snapshot, ...) won't go away by retrying
+            status_code = e.response.status_code if e.response is not None else None
+            if attempt == SNAPSHOT_DOWNLOAD_RETRIES - 1 or (status_code is not None and status_code < 500):
+                raise
+            delay = 2 ** attempt
+            print(f"Download interrupted ({e}), retrying in {delay}s")
+            time.sleep(delay)
+
+    # replace data.txt only once the snapshot is complete
+    os.replace(part_path, file_path)
+    return os.path.getsize(file_path)
+
 #################################################################################################################################################################
 ###############################   2.  IF SnapshotID IS NOT SET IN .XLSX FILE, TRIGGER CREATION OF THE SNAPSHOT   ################################################
 #################################################################################################################################################################
@@ -60,10 +184,11 @@ if not file_exists:
         json_data.append({"keyword":keywords.loc[ind, "Keyword"],"pages_load":str(keywords.loc[ind, "Pages"])})
 
     response = requests.post(
-        'https://api.brightdata.com/datasets/v3/trigger',
+        BRIGHTDATA_API_URL + '/trigger',
         params=params,
         headers=headers,
         json=json_data,
+        timeout=BRIGHTDATA_TIMEOUT,
         **_requests_verify_kwargs()
     )
 
@@ -95,33 +220,23 @@ else:
 
 ###############################   CHECK WHETHER ALL WEBSITES ARE CRAWLED   #######################################################################################
 
-    files = glob.glob(os.getenv("DATASET_STORAGE_FOLDER")+"*")	
-
-    for f in files:
-        os.remove(f)
-
-
+    # the dataset folder is not wiped: data.txt is only replaced once a ready snapshot has been downloaded
 
     f = open(os.getenv("SNAPSHOT_STORAGE_FILE"),"r")
     snapshot_id = f.read()
 
-    response = requests.get(
-        'https://api.brightdata.com/datasets/v3/progress/' + snapshot_id,
-        headers=headers_status,
-        **_requests_verify_kwargs()
-    )
-    
-    status = response.json()['status']
-
-    print("status")
-    print(status)
-
+    # one session, so polling and downloading reuse the same connection
+    session = requests.Session()
 
-    snapshot_ready = False
+    snapshot_status = wait_for_snapshot(session, snapshot_id)
+    snapshot_ready = snapshot_status == "ready"
 
-    if(status == "ready"):
+    if snapshot_ready:
         print("Snapshot is ready")
-        snapshot_ready = True
+    elif snapshot_status == "failed":
+        print("Snapshot FAILED")
+    elif snapshot_status == "unreachable":
+        print("Snapshot progress UNKNOWN, BrightData did not answer")
     else:
         print("Snapshot is NOT READY YET")
 
@@ -133,18 +248,17 @@ else:
     if snapshot_ready:
         print("== > All articles are ready - start writing data to datasets directory")
 
-
-        response = requests.get(
-            'https://api.brightdata.com/datasets/v3/snapshot/' + snapshot_id,
-            headers=headers,
-            **_requests_verify_kwargs()
-        )
-
         if not os.path.exists(os.getenv("DATASET_STORAGE_FOLDER")):
              os.makedirs(os.getenv("DATASET_STORAGE_FOLDER"))
 
-        with open(os.getenv("DATASET_STORAGE_FOLDER")+"data.txt", "wb") as f:
-            f.write(response.content)
+        # the snapshot is streamed to disk, so it never has to fit in memory
+        size = download_snapshot(session, snapshot_id, os.getenv("DATASET_STORAGE_FOLDER")+"data.txt")
+        print(f"Downloaded {size} bytes")
+
+    elif snapshot_status == "failed":
+        # it will never become ready; a new snapshot is only triggered once the stored ID is gone
+        print(f"== > BrightData could not build snapshot {snapshot_id} - delete {os.getenv('SNAPSHOT_STORAGE_FILE')} and run the script again to trigger a new one")
+        exit(1)
 
     else:
-         print("== > Not all articles are scraped yet - try again in a few minutes")
+         print("== > Not all articles are scraped yet - try again in a few minutes (or set SNAPSHOT_POLL_TIMEOUT to keep polling)")
@@ -4,24 +4,27 @@
 
 from dotenv import load_dotenv
 import os
-import requests
+import asyncio
 import json
+import time
 import pandas as pd
-import glob
 import urllib3
+from dataset_format import PARQUET_DATASET, write_parquet_dataset
+from scrape_cache import ScrapeCache
+from wikipedia_client import WIKIPEDIA_API_URL, WikipediaClient
 
 # Suppress SSL warnings for development/testing
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 load_dotenv()
 
-# Wikipedia API endpoint
-WIKIPEDIA_API_URL = "https://en.wikipedia.org/w/api.php"
+# concurrent requests, requests per second and retries on 429/5xx; WIKIPEDIA_API_URL can point to a local stand-in server
+SCRAPE_CONCURRENCY = int(os.getenv("SCRAPE_CONCURRENCY", "4"))
+SCRAPE_RATE_LIMIT = float(os.getenv("SCRAPE_RATE_LIMIT", "5"))
+SCRAPE_MAX_RETRIES = int(os.getenv("SCRAPE_MAX_RETRIES", "5"))
 
-# Wikipedia requires a User-Agent header
-WIKIPEDIA_HEADERS = {
-    "User-Agent": "LocalRAGBot/1.0 (https://github.com; educational_purpose@example.com)"
-}
+# "parquet" writes one zstd-compressed Parquet dataset partitioned by keyword, "text" the older data.json and data.txt
+DATASET_FORMAT = os.getenv("DATASET_FORMAT", "parquet")
 
 keywords = pd.read_excel("keywords.xlsx")
 
@@ -29,105 +32,130 @@ keywords = pd.read_excel("keywords.xlsx")
 ###############################   2.  SCRAPE WIKIPEDIA USING FREE WIKIPEDIA API   ##############################################################################
 #################################################################################################################################################################
 
-def scrape_wikipedia(keyword, pages=1):
+async def scrape_all_keywords(keywords, cache):
     """
-    Scrape Wikipedia articles using the free Wikipedia MediaWiki API
+    Scrape Wikipedia articles for all keywords concurrently, using the free Wikipedia MediaWiki API.
+
+    Only the current revision IDs of the search results are requested for every keyword; full extracts
+    are downloaded only for pages that are not in the cache or whose revision changed.
     """
-    print(f"Scraping Wikipedia for keyword: {keyword}")
-    
-    # Search for articles matching the keyword
-    search_params = {
-        "action": "query",
-        "list": "search",
-        "srsearch": keyword,
-        "format": "json",
-        "srlimit": pages * 5  # Get more results to filter
-    }
-    search_response = requests.get(WIKIPEDIA_API_URL, params=search_params, headers=WIKIPEDIA_HEADERS, verify=False)
-    
-    print(f"Status Code: {search_response.status_code}")
-    print(f"Response: {search_response.text[:500]}")
-    
-    if search_response.status_code != 200:
-        print(f"Error: Wikipedia API returned status {search_response.status_code}")
-        return []
-    
-    search_data = search_response.json()
-    
-    articles = []
-    
-    if "query" in search_data and "search" in search_data["query"]:
-        for result in search_data["query"]["search"][:pages]:
-            title = result["title"]
-            
-            # Get full article content
-            content_params = {
-                "action": "query",
-                "prop": "extracts",
-                "explaintext": True,
-                "exintro": False,
-                "titles": title,
-                "format": "json"
-            }
-            
-            content_response = requests.get(WIKIPEDIA_API_URL, params=content_params, headers=WIKIPEDIA_HEADERS, verify=False)
-            content_data = content_response.json()
-            
-            # Extract the page content
-            pages_data = content_data["query"]["pages"]
-            for page_id, page_data in pages_data.items():
-                if "extract" in page_data:
-                    articles.append({
-                        "keyword": keyword,
-                        "title": page_data["title"],
-                        "content": page_data["extract"],
-                        "url": f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}"
-                    })
-    
-    return articles
+    async with WikipediaClient(
+        api_url=os.getenv("WIKIPEDIA_API_URL", WIKIPEDIA_API_URL),
+        concurrency=SCRAPE_CONCURRENCY,
+        requests_per_second=SCRAPE_RATE_LIMIT,
+        max_retries=SCRAPE_MAX_RETRIES,
+        verify=False,
+    ) as client:
+
+        async def search_keyword(keyword, pages):
+            print(f"Scraping Wikipedia for keyword: {keyword}")
+            try:
+                results = await client.search_revisions(keyword, pages)
+            except Exception as e:
+                print(f"Error: searching '{keyword}' failed: {e}")
+                return None
+            print(f"Found {len(results)} articles for '{keyword}'")
+            return results
+
+        keyword_list = [(keywords.loc[ind, "Keyword"], keywords.loc[ind, "Pages"]) for ind in keywords.index]
+        search_results = await asyncio.gather(*(search_keyword(keyword, pages) for keyword, pages in keyword_list))
+
+        # compare the current revisions with the cached ones
+        current_revisions = {result["title"]: result["revid"] for results in search_results if results for result in results}
+        cached_revisions = cache.revisions()
+        outdated_titles = [title for title, revid in current_revisions.items() if cached_revisions.get(title) != revid]
+
+        print(f"Downloading {len(outdated_titles)} new or changed articles ({len(current_revisions) - len(outdated_titles)} unchanged)")
+        # a page that can't be downloaded keeps its cached revision, so it is still outdated on the next run
+        fetch_errors = {}
+        extracts = await client.fetch_extracts(outdated_titles, errors=fetch_errors)
+        for title, error in fetch_errors.items():
+            print(f"Error: downloading '{title}' failed: {error}")
+
+        print(f"{client.requests_made} requests to the Wikipedia API ({client.retries} retries)")
+
+    changes = {"added": [], "changed": [], "removed": [], "failed": sorted(fetch_errors)}
+
+    for title, page in extracts.items():
+        changes["changed" if title in cached_revisions else "added"].append(title)
+        cache.put(title, f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}", page["revid"], page["extract"])
+
+    # pages no longer found for any keyword are dropped, unless a search failed and we can't be sure
+    if all(results is not None for results in search_results):
+        changes["removed"] = [title for title in cached_revisions if title not in current_revisions]
+        cache.remove(changes["removed"])
+
+    cache.commit()
+
+    # build the dataset from the cache, in the order of the keywords file and the search ranking
+    all_articles = []
+    for (keyword, _), results in zip(keyword_list, search_results):
+        for result in results or []:
+            page = cache.get(result["title"])
+            if page is not None:
+                all_articles.append({
+                    "keyword": keyword,
+                    "title": page["title"],
+                    "content": page["extract"],
+                    "url": page["url"],
+                    "revision": page["revid"],
+                })
+
+    return all_articles, changes
 
 #################################################################################################################################################################
 ###############################   3.  MAIN EXECUTION   ###########################################################################################
 #################################################################################################################################################################
 
-# Clear existing datasets
+# The dataset folder is not wiped anymore: scraped pages are kept in a cache with their revision ID,
+# so a refresh only downloads articles that changed on Wikipedia
 dataset_folder = os.getenv("DATASET_STORAGE_FOLDER", "datasets/")
-if os.path.exists(dataset_folder):
-    files = glob.glob(dataset_folder + "*")
-    for f in files:
-        if os.path.isfile(f):
-            os.remove(f)
 
 # Create datasets folder if it doesn't exist
 if not os.path.exists(dataset_folder):
     os.makedirs(dataset_folder)
 
+scrape_cache = ScrapeCache(os.getenv("SCRAPE_CACHE_LOCATION", os.path.join(dataset_folder, "scrape_cache.sqlite3")))
+
 # Scrape all keywords
-all_articles = []
-
-for ind in keywords.index:
-    keyword = keywords.loc[ind, "Keyword"]
-    pages = keywords.loc[ind, "Pages"]
-    
-    articles = scrape_wikipedia(keyword, pages)
-    all_articles.extend(articles)
-    print(f"Found {len(articles)} articles for '{keyword}'")
-
-# Save all articles to a JSON file
-output_file = os.path.join(dataset_folder, "data.json")
-with open(output_file, "w", encoding="utf-8") as f:
-    json.dump(all_articles, f, ensure_ascii=False, indent=2)
-
-# Also save as text file for compatibility with the original script
-text_file = os.path.join(dataset_folder, "data.txt")
-with open(text_file, "w", encoding="utf-8") as f:
-    for article in all_articles:
-        f.write(f"=== {article['title']} ===\n")
-        f.write(f"Keyword: {article['keyword']}\n")
-        f.write(f"URL: {article['url']}\n")
-        f.write(f"\n{article['content']}\n")
-        f.write("\n" + "="*80 + "\n\n")
+started_at = time.perf_counter()
+all_articles, changes = asyncio.run(scrape_all_keywords(keywords, scrape_cache))
+scrape_cache.close()
+print(f"Scraped {len(keywords.index)} keywords in {time.perf_counter() - started_at:.1f}s")
+
+# Save which articles were added, changed or removed, so downstream ingestion can stay incremental
+changes_file = os.path.join(dataset_folder, "changes.json")
+with open(changes_file, "w", encoding="utf-8") as f:
+    json.dump(changes, f, ensure_ascii=False, indent=2)
+
+for change in ("added", "changed", "removed", "failed"):
+    print(f"{change.capitalize()}: {len(changes[change])} articles")
+    for title in changes[change]:
+        print(f"  - {title}")
+
+if DATASET_FORMAT == "parquet":
+    # Save all articles once, compressed and partitioned by keyword; the ingestion reads it in batches
+    output_file = os.path.join(dataset_folder, PARQUET_DATASET)
+    write_parquet_dataset(all_articles, output_file)
+    output_files = [output_file]
+else:
+    # Save all articles to a JSON file
+    output_file = os.path.join(dataset_folder, "data.json")
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(all_articles, f, ensure_ascii=False, indent=2)
+
+    # Also save as text file for compatibility with the original script
+    text_file = os.path.join(dataset_folder, "data.txt")
+    with open(text_file, "w", encoding="utf-8") as f:
+        for article in all_articles:
+            f.write(f"=== {article['title']} ===\n")
+            f.write(f"Keyword: {article['keyword']}\n")
+            f.write(f"URL: {article['url']}\n")
+            f.write(f"\n{article['content']}\n")
+            f.write("\n" + "="*80 + "\n\n")
+    output_files = [output_file, text_file]
 
 print(f"\n✅ Successfully scraped {len(all_articles)} articles")
-print(f"📁 Data saved to: {output_file}")
-print(f"📁 Data saved to: {text_file}")
\ No newline at end of file
+for output_file in output_files:
+    print(f"📁 Data saved to: {output_file}")
+print(f"📁 Changes saved to: {changes_file}")
\ No newline at end of file
@@ -4,16 +4,22 @@
 
 from dotenv import load_dotenv
 import os
-import json
 import pandas as pd
 from langchain_chroma import Chroma
 from langchain_ollama import OllamaEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from uuid import uuid4
 import shutil
 import time
-import re
 import sys
+from bm25_index import build_collection_index
+from chunking import OffsetTextSplitter
+from collection_state import bump_collection_version
+from dataset_format import article_keywords, detect_dataset_format, find_dataset, iter_articles
+from embedding_cache import ChunkEmbeddingStore
+from ingestion import IngestionEngine, IngestManifest, article_hash, chunk_ids
+from telemetry import setup_telemetry, shutdown_telemetry, stage, timed_iter
+from topics import TOPIC_FIELD, TOPIC_FLAG_PREFIX, build_collection_router, build_topic_shards, topic_metadata
+from vector_index import build_collection_vector_index, recall_against_chroma
 
 # Set UTF-8 encoding for Windows console
 if sys.platform == 'win32':
@@ -23,6 +29,9 @@ if sys.platform == 'win32':
 
 load_dotenv()
 
+# export spans and histograms of the parse, split, embed and write stages (TELEMETRY_EXPORTER)
+setup_telemetry("rag-ingestion")
+
 ###############################   INITIALIZE EMBEDDINGS MODEL  #################################################################################################
 
 embeddings = OllamaEmbeddings(
@@ -37,6 +46,39 @@ vector_store = Chroma(
     persist_directory=os.getenv("DATABASE_LOCATION"),
 )
 
+###############################   INITIALIZE INGESTION ENGINE   ################################################################################################
+
+# chunks per embedding request, concurrent embedding requests and chunks per Chroma write
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+INGEST_WRITE_BATCH_SIZE = int(os.getenv("INGEST_WRITE_BATCH_SIZE", "1024"))
+
+# reuse embeddings of byte-identical chunks from earlier runs instead of calling the embedding model
+CHUNK_EMBEDDING_CACHE = os.getenv("CHUNK_EMBEDDING_CACHE", "true").lower() == "true"
+
+# build a BM25 index over the chunks for hybrid lexical + vector retrieval in the chatbot
+BM25_INDEX = os.getenv("BM25_INDEX", "true").lower() == "true"
+bm25_index_path = os.path.join(os.getenv("DATABASE_LOCATION"), f"{os.getenv('COLLECTION_NAME')}.bm25")
+
+# with VECTOR_BACKEND = "numpy", also write the chunks to a memory-mapped NumPy index the chatbot searches instead of Chroma
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", "float32")
+vector_index_path = os.path.join(os.getenv("DATABASE_LOCATION"), f"{os.getenv('COLLECTION_NAME')}.vectors")
+
+# topic centroids of the chunks (by the keyword they were scraped for), used by the chatbot to route questions to topics;
+# with TOPIC_SHARDS, the chunks of every topic are also copied into a Chroma collection of their own
+topic_router_path = os.path.join(os.getenv("DATABASE_LOCATION"), f"{os.getenv('COLLECTION_NAME')}.topics")
+TOPIC_SHARDS = os.getenv("TOPIC_SHARDS", "false").lower() == "true"
+
+# number of stored chunk embeddings used as queries to check the NumPy index returns the same chunks as Chroma
+VECTOR_INDEX_RECALL_QUERIES = 50
+
+# "incremental" only re-embeds changed articles, "full" rebuilds the collection from scratch
+INGEST_MODE = os.getenv("INGEST_MODE", "incremental")
+
+# per-article hashes and chunk IDs of the collection, stored next to the Chroma data
+manifest = IngestManifest(os.path.join(os.getenv("DATABASE_LOCATION"), f"{os.getenv('COLLECTION_NAME')}.manifest.json"))
+
 ###############################   INITIALIZE TEXT SPLITTER   ###################################################################################################
 
 text_splitter = RecursiveCharacterTextSplitter(
@@ -44,115 +86,187 @@ text_splitter = RecursiveCharacterTextSplitter(
     chunk_overlap=200,
     length_function=len,
     is_separator_regex=False,
+    # store each chunk's offset in its article as "start_index", so the chatbot can merge overlapping chunks
+    add_start_index=True,
 )
 
+# "offsets" splits articles into chunks stored as offsets into the article, with the same boundaries as text_splitter;
+# the chunk texts are only sliced out when they are embedded and written. "langchain" uses text_splitter itself.
+TEXT_SPLITTER = os.getenv("TEXT_SPLITTER", "offsets")
+offset_splitter = OffsetTextSplitter.from_splitter(text_splitter)
+
 #################################################################################################################################################################
 ###############################   2.  PROCESSING THE DATA FILE   ###############################################################################################
 #################################################################################################################################################################
 
-def parse_custom_format(file_path):
-    """Parse the custom text format from the alternative scraping script."""
-    articles = []
-    
-    with open(file_path, encoding="utf-8") as f:
-        content = f.read()
-    
-    # Split by the separator
-    sections = content.split("=" * 80)
-    
-    for section in sections:
-        section = section.strip()
-        if not section:
-            continue
-        
-        # Extract title
-        title_match = re.search(r'===\s*(.+?)\s*===', section)
-        if not title_match:
-            continue
-        
-        title = title_match.group(1)
-        
-        # Extract keyword
-        keyword_match = re.search(r'Keyword:\s*(.+)', section)
-        keyword = keyword_match.group(1).strip() if keyword_match else ""
-        
-        # Extract URL
-        url_match = re.search(r'URL:\s*(.+)', section)
-        url = url_match.group(1).strip() if url_match else ""
-        
-        # Extract content (everything after URL until the end)
-        content_start = section.find("URL:")
-        if content_start != -1:
-            # Find the end of the URL line
-            url_end = section.find("\n", content_start)
-            if url_end != -1:
-                raw_text = section[url_end + 1:].strip()
-            else:
-                raw_text = ""
-        else:
-            raw_text = ""
-        
-        if raw_text:
-            articles.append({
-                "url": url,
-                "raw_text": raw_text,
-                "title": title
-            })
-    
-    return articles
-
-def parse_json_format(file_path):
-    """Parse JSON lines format from the original scraping script."""
-    articles = []
-    
-    with open(file_path, encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            obj = json.loads(line)
-            articles.append(obj)
-    
-    return articles
-
-# Try to parse the data file
-data_file = os.getenv("DATASET_STORAGE_FOLDER") + "data.txt"
+# The data file is streamed one article at a time, so memory use is bounded by the largest article
+# instead of the whole dataset. The format (custom text, JSON lines or JSON array) is detected from the file header.
+# A Parquet dataset written by the alternative scraper is used instead of data.txt when it is the newer of the two,
+# and read in record batches of only the columns the chunks need.
+# Records that can't be parsed (a malformed JSON line, a record that isn't an object or lacks a field the chunks need)
+# are skipped and reported at the end of the run.
+data_file = find_dataset(os.getenv("DATASET_STORAGE_FOLDER"))
+skipped_records = []
 
 try:
-    # First try custom format (since that's what the alternative scraper produces)
-    file_content = parse_custom_format(data_file)
-    print(f"Parsed {len(file_content)} articles from custom format")
-except Exception as e:
-    try:
-        # Fall back to JSON format
-        file_content = parse_json_format(data_file)
-        print(f"Parsed {len(file_content)} articles from JSON format")
-    except Exception as e2:
-        print(f"Error parsing data file: {e}")
-        file_content = []
+    print(f"Reading {detect_dataset_format(data_file)} dataset from {data_file}")
+    # an article scraped for several keywords is in the dataset once per keyword; collect all of them up front,
+    # so the copy that is ingested carries every topic. This reads the whole file, so a file that can't be read or
+    # breaks off in the middle (e.g. a truncated JSON array) is reported here, before anything is ingested.
+    keywords_by_url = article_keywords(data_file)
+    articles = iter_articles(data_file, skipped=skipped_records)
+except (OSError, ValueError) as e:
+    print(f"Error parsing data file: {e}")
+    articles = None
 
 #################################################################################################################################################################
 ###############################   3.  CHUNKING, EMBEDDING AND INGESTION   #######################################################################################
 ##################################################################################################################################################################
 
-if file_content:
-    for line in file_content:
+if articles is not None:
+    ingestion_engine = IngestionEngine(
+        embeddings,
+        vector_store,
+        batch_size=INGEST_BATCH_SIZE,
+        workers=INGEST_WORKERS,
+        write_batch_size=INGEST_WRITE_BATCH_SIZE,
+        embedding_store=ChunkEmbeddingStore(
+            os.path.join(os.getenv("EMBEDDING_CACHE_LOCATION", "embedding_cache"), "chunks"),
+            model=os.getenv("EMBEDDING_MODEL"),
+            dtype=os.getenv("EMBEDDING_CACHE_DTYPE", "float32"),
+        ) if CHUNK_EMBEDDING_CACHE else None,
+    )
+
+    # chunks depend on the splitter settings and vectors on the model, so a change in either means a full rebuild
+    ingest_settings = {
+        "embedding_model": os.getenv("EMBEDDING_MODEL"),
+        "chunk_size": text_splitter._chunk_size,
+        "chunk_overlap": text_splitter._chunk_overlap,
+        "start_index": text_splitter._add_start_index,
+        "topic_field": TOPIC_FIELD,
+        "topic_flag_prefix": TOPIC_FLAG_PREFIX,
+    }
+    if INGEST_MODE == "full" or manifest.settings != ingest_settings:
+        print("Rebuilding the whole collection")
+        vector_store.reset_collection()
+        manifest.clear(ingest_settings)
+
+    seen_sources = set()
+    added, changed, unchanged = 0, 0, 0
+    # seconds spent parsing the data file and splitting articles; embedding and writing are timed by the engine
+    stage_timings = {}
+
+    for line in timed_iter(articles, "parse", stage_timings, pipeline="ingestion"):
+
+        missing_fields = [field for field in ("url", "title", "raw_text") if not isinstance(line.get(field), str)]
+        if missing_fields:
+            skipped_records.append(f"{line.get('url') or line.get('title') or 'article'}: no {', '.join(missing_fields)}")
+            continue
+
+        # the same article can be scraped for several keywords, ingest it once with all of them
+        if line['url'] in seen_sources:
+            continue
+        seen_sources.add(line['url'])
+        line['keywords'] = keywords_by_url.get(line['url']) or ([line['keyword']] if line.get('keyword') else [])
+
+        content_hash = article_hash(line)
+        if manifest.is_unchanged(line['url'], content_hash):
+            unchanged += 1
+            continue
         
         print(f"Processing: {line.get('title', 'Unknown')}")
         print(f"URL: {line.get('url', 'Unknown')}")
         
+        # the keywords the article was scraped for are its topics; articles from custom datasets may have none
+        metadata = {"source": line['url'], "title": line['title'], **topic_metadata(line['keywords'])}
+
         texts = []
-        texts = text_splitter.create_documents(
-            [line['raw_text']], 
-            metadatas=[{"source": line['url'], "title": line['title']}]
-        )
+        with stage("split", stage_timings, pipeline="ingestion"):
+            if TEXT_SPLITTER == "offsets":
+                texts = offset_splitter.create_chunks(line['raw_text'], metadata)
+            else:
+                texts = text_splitter.create_documents(
+                    [line['raw_text']], 
+                    metadatas=[metadata]
+                )
         
-        uuids = [str(uuid4()) for _ in range(len(texts))]
+        ids = chunk_ids(line['url'], (text.page_content for text in texts))
+
+        # drop chunks of the previous version of this article that no longer exist
+        previous_ids = manifest.chunk_ids(line['url'])
+        if previous_ids:
+            changed += 1
+            current_ids = set(ids)
+            ingestion_engine.delete([chunk_id for chunk_id in previous_ids if chunk_id not in current_ids])
+        else:
+            added += 1
         
-        vector_store.add_documents(documents=texts, ids=uuids)
-        print(f"Added {len(texts)} chunks to vector store")
+        # chunks are embedded and written in batches across articles
+        ingestion_engine.add_documents(texts, ids)
+        manifest.update(line['url'], content_hash, ids)
+        print(f"Queued {len(texts)} chunks for embedding")
         print()
-    
-    print(f"\nSuccessfully ingested {len(file_content)} articles into the vector store")
+
+    if skipped_records:
+        print(f"Skipped {len(skipped_records)} malformed records in {data_file}:")
+        for record in skipped_records[:10]:
+            print(f"  {record}")
+        if len(skipped_records) > 10:
+            print(f"  ... and {len(skipped_records) - 10} more")
+
+    if not seen_sources:
+        # never treat an empty dataset as "every article was removed"
+        ingestion_engine.finish()
+        print("No articles found to ingest. Please run the scraping script first.")
+
+    else:
+        # delete chunks of articles that are no longer in the dataset
+        removed_sources = [source for source in manifest.articles if source not in seen_sources]
+        for source in removed_sources:
+            print(f"Removing: {source}")
+            ingestion_engine.delete(manifest.remove(source))
+
+        stats = ingestion_engine.finish()
+        print(f"Added {stats['chunks']} chunks to vector store in {stats['seconds']:.1f}s ({stats['chunks_per_second']:.1f} chunks/sec)")
+        print(f"Parse time: {stage_timings.get('parse', 0.0):.1f}s, split time: {stage_timings.get('split', 0.0):.1f}s")
+        print(f"Embedding time: {stats['embed_seconds']:.1f}s across {INGEST_WORKERS} workers, write time: {stats['write_seconds']:.1f}s")
+        if stats['embedding_cache']:
+            print(f"Embedding cache hit rate: {stats['embedding_cache']['hit_rate']:.1%} ({stats['embedding_cache']['hits']} hits, {stats['embedding_cache']['misses']} misses)")
+
+        # only save the manifest once every chunk is written, so an interrupted run is redone next time
+        manifest.save()
+
+        # the BM25 index is rebuilt from the collection, so it always covers the same chunk IDs
+        if BM25_INDEX and (added or changed or removed_sources or not os.path.isdir(bm25_index_path)):
+            bm25_started_at = time.perf_counter()
+            bm25_index = build_collection_index(vector_store, bm25_index_path)
+            print(f"Built BM25 index over {len(bm25_index.doc_ids)} chunks in {time.perf_counter() - bm25_started_at:.1f}s")
+
+        # the NumPy index is rebuilt from the collection as well, then checked against Chroma's results
+        if VECTOR_BACKEND == "numpy" and (added or changed or removed_sources or not os.path.isdir(vector_index_path)):
+            index_started_at = time.perf_counter()
+            vector_index = build_collection_vector_index(vector_store, vector_index_path, dtype=VECTOR_INDEX_DTYPE)
+            print(f"Built {VECTOR_INDEX_DTYPE} vector index over {len(vector_index)} chunks in {time.perf_counter() - index_started_at:.1f}s")
+
+            sample = vector_store._collection.get(limit=VECTOR_INDEX_RECALL_QUERIES, include=["embeddings"])["embeddings"]
+            recall = recall_against_chroma(vector_index, vector_store, list(sample), k=10)
+            print(f"Vector index recall@10 against Chroma: {recall:.1%}")
+
+        # the topic router (and the topic shards) are rebuilt from the collection as well
+        if added or changed or removed_sources or not os.path.isdir(topic_router_path):
+            topics_started_at = time.perf_counter()
+            shards = build_topic_shards(vector_store, os.getenv("COLLECTION_NAME")) if TOPIC_SHARDS else None
+            router = build_collection_router(vector_store, topic_router_path, shards=shards)
+            print(f"Built topic router over {len(router)} topics{f' and {len(shards)} shards' if shards else ''} in {time.perf_counter() - topics_started_at:.1f}s")
+
+        if added or changed or removed_sources:
+            # let the chatbot know the collection changed, so it drops answers cached from the old data
+            bump_collection_version(os.getenv("DATABASE_LOCATION"), os.getenv("COLLECTION_NAME"))
+
+        print(f"\nArticles added: {added}, changed: {changed}, unchanged: {unchanged}, removed: {len(removed_sources)}")
+        print(f"Successfully ingested {len(seen_sources)} articles into the vector store")
 else:
-    print("No articles found to ingest. Please run the scraping script first.")
\ No newline at end of file
+    print("No articles found to ingest. Please run the scraping script first.")
+
+# export the spans and histograms still buffered before the script exits
+shutdown_telemetry()
@@ -1,105 +1,211 @@
 # import basics
 import os
+import time
 from dotenv import load_dotenv
 
 # import streamlit
 import streamlit as st
 
+# import project modules
+from answer_cache import SemanticAnswerCache
+from rag_pipeline import QUERY_EMBEDDING_CACHE, SINGLE_FLIGHT, RAGPipeline
+from single_flight import SharedStreamError, SingleFlight
+from telemetry import record_stage, setup_telemetry, stage
+
 # import langchain
-from langchain_chroma import Chroma
-from langchain_ollama import OllamaEmbeddings
-from langchain.chat_models import init_chat_model
 from langchain_core.messages import AIMessage, HumanMessage
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
 
 # load environment variables
 load_dotenv()  
 
-###############################   INITIALIZE EMBEDDINGS MODEL  #################################################################################################
-
-embeddings = OllamaEmbeddings(
-    model=os.getenv("EMBEDDING_MODEL"),
-)
+# The pipeline (models, vector store, retrievers and chains, see rag_pipeline.py) is created once per server
+# process with st.cache_resource and shared by all sessions, instead of being rebuilt on every Streamlit rerun.
 
-###############################   INITIALIZE CHROMA VECTOR STORE   #############################################################################################
+# load the models and touch the collection when the server starts, so the first question is not slowed down
+WARM_START = os.getenv("WARM_START", "false").lower() == "true"
 
-vector_store = Chroma(
-    collection_name=os.getenv("COLLECTION_NAME"),
-    embedding_function=embeddings,
-    persist_directory=os.getenv("DATABASE_LOCATION"), 
-)
+# show how long each stage of the last answer took in the sidebar
+LATENCY_BREAKDOWN = os.getenv("LATENCY_BREAKDOWN", "true").lower() == "true"
 
-retriever = vector_store.as_retriever(search_kwargs={"k": 2})
+@st.cache_resource(show_spinner=False)
+def load_telemetry():
+    """Set up the OpenTelemetry exporter (TELEMETRY_EXPORTER) once per server process."""
+    return setup_telemetry("rag-chatbot")
 
+load_telemetry()
 
-###############################   INITIALIZE CHAT MODEL   #######################################################################################################
+###############################   INITIALIZE RAG PIPELINE   ###################################################################################################
 
-llm = init_chat_model(
-    os.getenv("CHAT_MODEL"),
-    model_provider=os.getenv("MODEL_PROVIDER"),
-    temperature=0
-)
+@st.cache_resource(show_spinner=False)
+def load_pipeline():
+    """Create the embeddings model, chat model and chains once per server process."""
+    return RAGPipeline()
 
+pipeline = load_pipeline()
 
-###############################   CREATE RAG CHAIN   ###########################################################################################################
 
-def format_docs(docs):
-    """Format retrieved documents for display."""
-    serialized = ""
-    for doc in docs:
-        serialized += f"Source: {doc.metadata['source']}\nContent: {doc.page_content}\n\n"
-    return serialized
+###############################   SEMANTIC ANSWER CACHE   ######################################################################################################
 
-# Create the RAG prompt template (for when context is available)
-rag_template = """You are a helpful assistant. You will be provided with a query and retrieved context.
-Your task is to provide a response based on the retrieved information.
+# answers are reused for questions whose embedding is at least this similar (cosine) to a cached question
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "true").lower() == "true"
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
 
-The query is as follows:
-{query}
+def answer_cache_namespace(model):
+    """Cached answers are stored under the chat model that generated them and the collection, and only reused for those."""
+    return (model, os.getenv("COLLECTION_NAME"))
 
-The retrieved context is as follows:
-{context}
+@st.cache_resource(show_spinner=False)
+def load_answer_cache():
+    """Create the answer cache once per server process, so all sessions share it."""
+    return SemanticAnswerCache(
+        max_entries=ANSWER_CACHE_SIZE,
+        ttl_seconds=ANSWER_CACHE_TTL,
+        similarity_threshold=ANSWER_CACHE_SIMILARITY,
+    )
 
-Please provide a concise and informative response based on the retrieved information.
+answer_cache = load_answer_cache()
 
-For every piece of information you provide, also provide the source.
 
-Return text as follows:
+###############################   REQUEST COALESCING   #########################################################################################################
 
-<Answer to the question>
-Source: source_url
-"""
+@st.cache_resource(show_spinner=False)
+def load_single_flight():
+    """Track the answers in flight once per server process, so identical questions from other sessions can share them."""
+    return SingleFlight()
 
-rag_prompt = ChatPromptTemplate.from_template(rag_template)
+single_flight = load_single_flight()
 
-# Create the general knowledge prompt template (for when no context is available)
-general_template = """You are a helpful assistant. Answer the user's question to the best of your ability.
 
-The query is as follows:
-{query}
+###############################   WARM START   #################################################################################################################
 
-Provide a clear and informative response. Since this is a general knowledge question (not from your knowledge base), you don't need to provide a source.
-"""
+@st.cache_resource(show_spinner="Warming up models...")
+def warm_up():
+    """Load the models into Ollama and open the vector store, once per server process."""
+    return pipeline.warm_up()
+
+
+###############################   STREAM ANSWERS   ##############################################################################################################
+
+def stream_answer(tokens, placeholder, timings=None):
+    """Render an answer token by token and return it with its latency metrics.
+
+    The prompt, model and parser stages are timed by the pipeline; rendering is recorded as its own stage.
+    """
+    answer = ""
+    token_count = 0
+    first_token_at = None
+    render_seconds = 0.0
+    started_at = time.perf_counter()
+
+    for token in tokens:
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+        token_count += 1
+        answer += token
+
+        step_started_at = time.perf_counter()
+        placeholder.markdown(answer + "▌")
+        render_seconds += time.perf_counter() - step_started_at
 
-general_prompt = ChatPromptTemplate.from_template(general_template)
+    finished_at = time.perf_counter()
+    placeholder.markdown(answer)
+    record_stage("render", render_seconds, timings, pipeline="chat")
 
-# Create the RAG chain
-rag_chain = (
-    {"context": retriever | format_docs, "query": RunnablePassthrough()}
-    | rag_prompt
-    | llm
-    | StrOutputParser()
-)
-
-# Create the general knowledge chain
-general_chain = (
-    {"query": RunnablePassthrough()}
-    | general_prompt
-    | llm
-    | StrOutputParser()
-)
+    # each streamed chunk from the chat model counts as one token
+    generation_time = finished_at - (first_token_at or finished_at)
+    metrics = {
+        "time_to_first_token": (first_token_at or finished_at) - started_at,
+        "total_time": finished_at - started_at,
+        "tokens": token_count,
+        "tokens_per_second": token_count / generation_time if generation_time > 0 else 0.0,
+    }
+    return answer, metrics
+
+
+def format_metrics(metrics):
+    """Format latency metrics as a short caption."""
+    caption = f"⏱️ first token {metrics['time_to_first_token']:.2f}s · {metrics['tokens_per_second']:.1f} tokens/s · total {metrics['total_time']:.2f}s"
+    if "retrieval" in metrics:
+        caption += f" · retrieval {metrics['retrieval']['total'] * 1000:.0f}ms"
+    if metrics.get("context"):
+        caption += f" · context {metrics['context']['tokens']} tokens ({metrics['context']['tokens_saved']} saved)"
+    if metrics.get("prefill"):
+        caption += f" · prefill {metrics['prefill']['prefill_seconds'] * 1000:.0f}ms ({metrics['prefill']['prompt_tokens']} tokens evaluated)"
+    if metrics.get("model_route"):
+        caption += f" · {metrics['model_route']['route']} model {metrics['model_route']['model']} ({metrics['model_route']['reason']})"
+    return caption
+
+
+###############################   ANSWER QUESTIONS   ###########################################################################################################
+
+def answer_question(user_question, placeholder, shared_answer=None):
+    """Answer a question from the answer cache or the pipeline, render it and return it as an AIMessage.
+
+    With a shared_answer stream, every token is also published to it for the sessions asking the same question.
+    """
+    timings = {}
+
+    # Embed the question once; the embedding is used for the answer cache and for retrieval
+    with stage("embed_query", timings, pipeline="chat"):
+        query_embedding = pipeline.embeddings.embed_query(user_question)
+
+    cached_answer = None
+    if ANSWER_CACHE_ENABLED:
+        # drop cached answers if the collection has been re-ingested
+        answer_cache.check_version(pipeline.collection_version())
+        # with model routing, an answer of either model may be reused, and is shown and counted as that model's
+        cached_answer = answer_cache.lookup(query_embedding, [answer_cache_namespace(model) for model in pipeline.chat_models()])
+
+    if cached_answer is not None:
+        cached_answer, (cached_model, _) = cached_answer
+        if pipeline.model_router is not None:
+            pipeline.model_router.record_cached(cached_model)
+        if shared_answer is not None:
+            shared_answer.publish(cached_answer)
+        placeholder.markdown(cached_answer)
+        st.caption(f"⚡ answered from cache · model {cached_model}")
+        return AIMessage(cached_answer, response_metadata={"cached": True, "model": cached_model})
+
+    # Retrieve documents once, together with their relevance scores
+    with stage("retrieve", timings, pipeline="chat") as span:
+        retrieved_docs, retrieval_timings = pipeline.retrieve(user_question, query_embedding)
+        for name, value in retrieval_timings.items():
+            span.set_attribute(f"retrieval.{name}", value)
+
+    # Use the RAG chain if at least one chunk scores above the threshold, the general chain otherwise;
+    # with model routing, the chain uses the fast or the full chat model
+    context_stats, model_route = {}, {}
+    chain, chain_input, _ = pipeline.route(user_question, retrieved_docs, timings, context_stats, model_route)
+
+    # stream the answer into the chat bubble as it is generated
+    prefill = {}
+    tokens = pipeline.stream_tokens(chain, chain_input, timings, prefill, model_route)
+    if shared_answer is not None:
+        tokens = shared_answer.tee(tokens)
+    ai_message, metrics = stream_answer(tokens, placeholder, timings)
+    metrics["retrieval"] = retrieval_timings
+    metrics["stages"] = timings
+    metrics["context"] = context_stats
+    metrics["prefill"] = prefill
+    metrics["model_route"] = model_route
+    st.caption(format_metrics(metrics))
+
+    if ANSWER_CACHE_ENABLED and ai_message:
+        # under the model that generated the answer: the fast one, or the full one when it was routed (or fell back) there
+        answer_model = model_route.get("model") or os.getenv("CHAT_MODEL")
+        answer_cache.store(user_question, query_embedding, ai_message, answer_cache_namespace(answer_model))
+
+    st.session_state.latency_metrics.append(metrics)
+    return AIMessage(ai_message, response_metadata={"latency": metrics})
+
+
+def render_shared_answer(shared_answer, placeholder):
+    """Render the answer another session is generating for the same question, as it streams."""
+    ai_message, metrics = stream_answer(shared_answer, placeholder)
+    st.caption(f"🔗 shared with the same question from another session · {format_metrics(metrics)}")
+    return AIMessage(ai_message, response_metadata={"coalesced": True, "latency": metrics})
 
 
 ###############################   INITIATE STREAMLIT APP   ####################################################################################################
@@ -107,10 +213,17 @@ general_chain = (
 st.set_page_config(page_title="RAG Chatbot", page_icon="🦜")
 st.title("🦜 RAG Chatbot")
 
+if WARM_START:
+    warm_up()
+
 # initialize chat history
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+# latency metrics of every answer in this session
+if "latency_metrics" not in st.session_state:
+    st.session_state.latency_metrics = []
+
 # display chat messages from history on app rerun
 for message in st.session_state.messages:
     if isinstance(message, HumanMessage):
@@ -119,7 +232,31 @@ for message in st.session_state.messages:
     elif isinstance(message, AIMessage):
         with st.chat_message("assistant"):
             st.markdown(message.content)
-
+            if message.response_metadata.get("cached"):
+                st.caption(f"⚡ answered from cache · model {message.response_metadata['model']}")
+            elif message.response_metadata.get("coalesced"):
+                st.caption(f"🔗 shared with the same question from another session · {format_metrics(message.response_metadata['latency'])}")
+            elif "latency" in message.response_metadata:
+                st.caption(format_metrics(message.response_metadata["latency"]))
+
+# answer cache counters, to tune ANSWER_CACHE_SIMILARITY
+if ANSWER_CACHE_ENABLED:
+    with st.sidebar.expander("Answer cache"):
+        st.json(answer_cache.stats())
+
+if QUERY_EMBEDDING_CACHE:
+    with st.sidebar.expander("Query embedding cache"):
+        st.json(pipeline.embeddings.stats())
+
+# how many answers were shared with the same question from another session instead of being generated again
+if SINGLE_FLIGHT:
+    with st.sidebar.expander("Request coalescing"):
+        st.json(single_flight.stats())
+
+# answers and latency per chat model, to tune the MODEL_ROUTING_* settings
+if pipeline.model_router is not None:
+    with st.sidebar.expander("Model routing"):
+        st.json(pipeline.model_router.stats())
 
 # create the bar where we can type messages
 user_question = st.chat_input("How are you?")
@@ -135,28 +272,47 @@ if user_question:
         st.session_state.messages.append(HumanMessage(user_question))
 
     # invoking the chain
-    with st.chat_message("assistant"):
+    with st.chat_message("assistant"), stage("answer", pipeline="chat"):
         response_placeholder = st.empty()
-        
-        # First, retrieve documents to check if relevant context exists
-        retrieved_docs = retriever.invoke(user_question)
-        
-        # Check if we have relevant context
-        # We consider context relevant if we have documents with meaningful content
-        has_relevant_context = False
-        context_text = ""
-        
-        if retrieved_docs:
-            context_text = format_docs(retrieved_docs)
-            # Check if context has meaningful content (not just empty or very short)
-            if context_text and len(context_text.strip()) > 50:
-                has_relevant_context = True
-        
-        # Use appropriate chain based on whether we have relevant context
-        if has_relevant_context:
-            ai_message = rag_chain.invoke(user_question)
+
+        # the same question asked in other sessions while this one is being answered shares its answer
+        if SINGLE_FLIGHT:
+            request_key = pipeline.request_key(user_question)
+            shared_answer, is_leader = single_flight.join(request_key)
         else:
-            ai_message = general_chain.invoke(user_question)
-        
-        response_placeholder.markdown(ai_message)
-        st.session_state.messages.append(AIMessage(ai_message))
+            shared_answer, is_leader = None, True
+
+        message = None
+        if not is_leader:
+            try:
+                message = render_shared_answer(shared_answer, response_placeholder)
+            except SharedStreamError:
+                # the session answering it failed or was stopped, so answer the question here instead
+                pass
+
+        if message is None and is_leader and shared_answer is not None:
+            with single_flight.leading(request_key, shared_answer):
+                message = answer_question(user_question, response_placeholder, shared_answer)
+        elif message is None:
+            message = answer_question(user_question, response_placeholder)
+
+        st.session_state.messages.append(message)
+
+# time spent in each stage of the last answer, in milliseconds (rendered last, so it includes the answer above)
+if LATENCY_BREAKDOWN and st.session_state.latency_metrics:
+    with st.sidebar.expander("Latency breakdown"):
+        last_metrics = st.session_state.latency_metrics[-1]
+        st.json({
+            "stages": {name: round(seconds * 1000, 2) for name, seconds in last_metrics["stages"].items()},
+            # the steps of the retrieve stage, to tune MMR_FETCH_K and MMR_LATENCY_BUDGET_MS
+            "retrieval": {
+                name: round(value * 1000, 2) if isinstance(value, float) else value
+                for name, value in last_metrics["retrieval"].items()
+            },
+            # estimated size of the packed context, to tune CONTEXT_TOKEN_BUDGET
+            "context": last_metrics.get("context", {}),
+            # prompt tokens the chat model evaluated and how long it took, to check the KV cache is reused (PROMPT_LAYOUT)
+            "prefill": last_metrics.get("prefill", {}),
+            # the chat model that answered and why the router chose it (MODEL_ROUTING)
+            "model": last_metrics.get("model_route", {}),
+        })
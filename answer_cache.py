@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """Bounded LRU/TTL cache that returns a stored answer for semantically similar questions.
+
+    Entries are keyed by a namespace (the chat model that generated the answer + collection name), so
+    answers from one model or collection are never served for another. The whole cache is cleared when the collection version
+    changes, i.e. after the collection has been re-ingested.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=3600, similarity_threshold=0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._version = None
+        self._clear()
+
+    def _clear(self):
+        # normalized question embeddings live in one preallocated matrix, one row per slot
+        self._vectors = None
+        self._free_slots = list(range(self.max_entries))
+        # slot -> (namespace, question, answer, stored_at), ordered from least to most recently used
+        self._entries = OrderedDict()
+
+    def check_version(self, version):
+        """Clear the cache if the collection has been re-ingested since the last call."""
+        with self._lock:
+            if version != self._version:
+                if self._version is not None:
+                    self._clear()
+                self._version = version
+
+    def lookup(self, query_embedding, namespaces):
+        """Return (answer, namespace) for the most similar cached question in any of the namespaces, or None."""
+        query = self._normalize(query_embedding)
+
+        with self._lock:
+            self._expire()
+
+            slots = [slot for slot, entry in self._entries.items() if entry[0] in namespaces]
+            if not slots or self._vectors is None or self._vectors.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+
+            # cosine similarity against every cached question of these namespaces in one matrix product
+            similarities = self._vectors[slots] @ query
+            best = int(np.argmax(similarities))
+
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+
+            slot = slots[best]
+            self._entries.move_to_end(slot)
+            self.hits += 1
+            return self._entries[slot][2], self._entries[slot][0]
+
+    def store(self, question, query_embedding, answer, namespace):
+        """Cache an answer, evicting the least recently used entry when the cache is full."""
+        vector = self._normalize(query_embedding)
+
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                self._clear()
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+
+            self._expire()
+            if not self._free_slots:
+                slot, _ = self._entries.popitem(last=False)
+                self._free_slots.append(slot)
+                self.evictions += 1
+
+            slot = self._free_slots.pop()
+            self._vectors[slot] = vector
+            self._entries[slot] = (namespace, question, answer, time.monotonic())
+
+    def stats(self):
+        """Return hit/miss counters to tune the similarity threshold."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _expire(self):
+        if not self.ttl_seconds:
+            return
+        cutoff = time.monotonic() - self.ttl_seconds
+        # entries are in LRU order, but a recently used entry may still be old, so check them all
+        expired = [slot for slot, entry in self._entries.items() if entry[3] < cutoff]
+        for slot in expired:
+            del self._entries[slot]
+            self._free_slots.append(slot)
+            self.evictions += 1
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
@@ -0,0 +1,314 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+import ollama
+from dotenv import load_dotenv
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+from model_routing import FAST_ROUTE, ollama_model_name
+from rag_pipeline import SINGLE_FLIGHT, RAGPipeline
+from single_flight import SharedStream, SharedStreamError, SingleFlight
+from telemetry import setup_telemetry, stage
+
+# Headless HTTP API over the same pipeline as 3_chatbot.py. Start it with:
+#
+#     uvicorn api_server:app --host 0.0.0.0 --port 8000
+#
+# Requests are handled on the event loop; chat models stream asynchronously, and embedding and
+# retrieval run in worker threads, so one process serves many clients at once.
+
+load_dotenv()
+
+setup_telemetry("rag-api")
+
+logger = logging.getLogger(__name__)
+
+# at most this many questions are embedded and retrieved at the same time; more wait for a free slot
+API_MAX_CONCURRENT_RETRIEVALS = int(os.getenv("API_MAX_CONCURRENT_RETRIEVALS", "16"))
+
+
+class Question(BaseModel):
+    question: str
+
+
+class ServerState:
+    """The pipeline and warm-up state, filled in by the lifespan handler."""
+
+    def __init__(self):
+        self.pipeline = None
+        self.warm_up_error = None
+        self.retrieval_slots = None
+        # answers in flight, shared by identical questions
+        self.single_flight = SingleFlight()
+        # tasks generating answers, referenced until they finish and cancelled at shutdown
+        self.answer_tasks = set()
+
+
+state = ServerState()
+
+
+async def warm_up():
+    try:
+        await asyncio.to_thread(state.pipeline.warm_up)
+    except Exception as e:
+        # the API stays up (and reports not ready) if Ollama or the collection are unavailable
+        state.warm_up_error = repr(e)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    state.pipeline = await asyncio.to_thread(RAGPipeline)
+    state.retrieval_slots = asyncio.Semaphore(API_MAX_CONCURRENT_RETRIEVALS)
+    # warm up in the background, so the liveness check answers right away
+    warm_up_task = asyncio.create_task(warm_up())
+    yield
+    # answers still being generated at shutdown are cancelled, which fails their streams for the requests reading them
+    tasks = [warm_up_task, *state.answer_tasks]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+app = FastAPI(title="RAG Chatbot API", lifespan=lifespan)
+
+
+def serialize_chunks(docs_with_scores):
+    return [
+        {
+            "source": doc.metadata.get("source"),
+            "title": doc.metadata.get("title"),
+            "relevance": score,
+            "content": doc.page_content,
+        }
+        for doc, score in docs_with_scores
+    ]
+
+
+def answer_error(error):
+    """Status code and JSON body for an answer that failed: 503 when Ollama can't be reached, 502 when a model failed.
+
+    Answers are read from their shared stream, so the exception the answer failed with is the cause of the SharedStreamError.
+    """
+    if isinstance(error, SharedStreamError) and error.__cause__ is not None:
+        error = error.__cause__
+    if isinstance(error, (ConnectionError, httpx.TransportError)):
+        return 503, {"error": "The model server is unavailable", "detail": str(error)}
+    return 502, {"error": "The answer could not be generated", "detail": str(error)}
+
+
+def sse_event(event, data):
+    """Format one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def retrieve(question, timings):
+    """Embed the question and retrieve its chunks in a worker thread."""
+    async with state.retrieval_slots:
+        with stage("embed_query", timings, pipeline="chat"):
+            query_embedding = await asyncio.to_thread(state.pipeline.embeddings.embed_query, question)
+        with stage("retrieve", timings, pipeline="chat"):
+            retrieved_docs, retrieval_timings = await asyncio.to_thread(state.pipeline.retrieve, question, query_embedding)
+    return retrieved_docs, retrieval_timings
+
+
+async def generate_answer(question, answer_stream):
+    """Answer a question and publish its events to the stream.
+
+    The events are ("sources", chunks), ("context", packing statistics), one ("token", text) per token and ("timings", stage timings).
+    The timings include the chat model's prompt evaluation statistics under "prefill", and with model routing
+    the route, model and reason it was chosen for under "model".
+    """
+    with stage("answer", pipeline="chat"):
+        timings, context_stats, prefill, model_route = {}, {}, {}, {}
+        retrieved_docs, retrieval_timings = await retrieve(question, timings)
+        # in a worker thread too: packing the context and checking which models Ollama has loaded block
+        chain, chain_input, relevant_docs = await asyncio.to_thread(
+            state.pipeline.route, question, retrieved_docs, timings, context_stats, model_route
+        )
+        answer_stream.publish(("sources", serialize_chunks(relevant_docs)))
+        answer_stream.publish(("context", context_stats))
+
+        async for token in state.pipeline.astream_tokens(chain, chain_input, timings, prefill, model_route):
+            answer_stream.publish(("token", token))
+        answer_stream.publish(("timings", {**timings, "retrieval": retrieval_timings, "prefill": prefill, "model": model_route}))
+
+
+async def run_answer(request_key, question, answer_stream):
+    try:
+        with state.single_flight.leading(request_key, answer_stream):
+            await generate_answer(question, answer_stream)
+    except Exception:
+        # logged once here; the requests reading the stream get it as a SharedStreamError and answer with answer_error
+        logger.exception("Answering %r failed", question)
+
+
+async def answer_events(question):
+    """Return the event stream of the answer to a question, and whether it was shared with the same question in flight.
+
+    The answer is generated by a task of its own rather than by the request that asked first, so the
+    requests sharing it are not affected when that client disconnects.
+    """
+    if SINGLE_FLIGHT:
+        # the key includes the collection version, read from disk, so in a worker thread
+        request_key = await asyncio.to_thread(state.pipeline.request_key, question)
+        answer_stream, is_leader = state.single_flight.join(request_key)
+    else:
+        request_key, answer_stream, is_leader = None, SharedStream(), True
+
+    if is_leader:
+        task = asyncio.create_task(run_answer(request_key, question, answer_stream))
+        state.answer_tasks.add(task)
+        task.add_done_callback(state.answer_tasks.discard)
+    return answer_stream, not is_leader
+
+
+###############################   ENDPOINTS   ##################################################################################################################
+
+@app.get("/health")
+async def health():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness: the models and vector store are warmed up. Also reports which models Ollama has loaded."""
+    pipeline = state.pipeline
+    warm = pipeline is not None and pipeline.warm_up_seconds is not None
+
+    models = {}
+    if os.getenv("MODEL_PROVIDER") == "ollama":
+        try:
+            # models currently loaded in Ollama's memory
+            loaded = {ollama_model_name(model.model) for model in (await ollama.AsyncClient().ps()).models}
+            models = {
+                model: ollama_model_name(model) in loaded
+                for model in (os.getenv("EMBEDDING_MODEL"), os.getenv("CHAT_MODEL"))
+            }
+            if pipeline is not None and pipeline.model_router is not None:
+                fast_model = pipeline.model_router.models[FAST_ROUTE]
+                models[fast_model] = ollama_model_name(fast_model) in loaded
+        except Exception as e:
+            models = {"error": repr(e)}
+
+    body = {
+        "ready": warm,
+        "warm_up_seconds": pipeline.warm_up_seconds if pipeline is not None else None,
+        "warm_up_error": state.warm_up_error,
+        "models_loaded": models,
+        "collection_version": await asyncio.to_thread(pipeline.collection_version) if pipeline is not None else None,
+    }
+    return JSONResponse(body, status_code=200 if warm else 503)
+
+
+@app.get("/stats")
+async def stats():
+    """Request coalescing counters: answers generated, and answers shared with the same question instead of generated again.
+
+    With model routing, also the answers and latency of each chat model.
+    """
+    body = {"single_flight": state.single_flight.stats()}
+    if state.pipeline is not None and state.pipeline.model_router is not None:
+        body["model_routing"] = state.pipeline.model_router.stats()
+    return body
+
+
+@app.post("/retrieve")
+async def retrieve_chunks(request: Question):
+    """Retrieval only: the chunks the chatbot would use as context, with their relevance scores."""
+    timings = {}
+    retrieved_docs, retrieval_timings = await retrieve(request.question, timings)
+    return {
+        "chunks": serialize_chunks(retrieved_docs),
+        "timings": {**timings, "retrieval": retrieval_timings},
+    }
+
+
+@app.post("/chat")
+async def chat(request: Question):
+    """Answer a question in one response, or return an error (see answer_error) if the answer fails."""
+    started_at = time.perf_counter()
+    answer_stream, coalesced = await answer_events(request.question)
+
+    answer, sources, context, timings = "", [], {}, {}
+    try:
+        async for event, data in answer_stream:
+            if event == "sources":
+                sources = data
+            elif event == "context":
+                context = data
+            elif event == "token":
+                answer += data
+            elif event == "timings":
+                timings = data
+    except Exception as e:
+        status_code, body = answer_error(e)
+        return JSONResponse(body, status_code=status_code)
+
+    return {
+        "answer": answer,
+        "sources": sources,
+        "context": context,
+        "coalesced": coalesced,
+        "timings": {**timings, "total": time.perf_counter() - started_at},
+    }
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: Question):
+    """Answer a question as server-sent events: one "sources" event, "token" events, then a "done" event.
+
+    The response has already started when an answer fails, so the failure is sent as an "error" event (see answer_error) instead of "done".
+    """
+
+    async def events():
+        started_at = time.perf_counter()
+        first_token_at = None
+        answer_stream, coalesced = await answer_events(request.question)
+
+        context, timings = {}, {}
+        try:
+            async for event, data in answer_stream:
+                if event == "sources":
+                    yield sse_event("sources", data)
+                elif event == "context":
+                    context = data
+                elif event == "token":
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    yield sse_event("token", {"text": data})
+                elif event == "timings":
+                    timings = data
+        except Exception as e:
+            status_code, body = answer_error(e)
+            yield sse_event("error", {**body, "status": status_code})
+            return
+
+        finished_at = time.perf_counter()
+        yield sse_event("done", {
+            "time_to_first_token": (first_token_at or finished_at) - started_at,
+            "total_time": finished_at - started_at,
+            "context": context,
+            "coalesced": coalesced,
+            "timings": timings,
+        })
+
+    # no-cache and no proxy buffering, so every token reaches the client right away
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.getenv("API_HOST", "127.0.0.1"), port=int(os.getenv("API_PORT", "8000")))
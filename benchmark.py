@@ -0,0 +1,504 @@
+#################################################################################################################################################################
+###############################   1.  IMPORTING MODULES AND INITIALIZING VARIABLES   ############################################################################
+#################################################################################################################################################################
+
+from dotenv import load_dotenv
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_ollama import OllamaEmbeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from bm25_index import BM25Index
+from chunking import OffsetTextSplitter
+from dataset_format import SEPARATOR, iter_articles, parse_custom_format, write_parquet_dataset
+from fake_ollama import server_from_env
+from fake_wikipedia import FakeWikipediaServer
+from retrieval import HybridRetriever, MMRRetriever, vector_search
+from vector_index import NumpyVectorIndex
+from wikipedia_client import WikipediaClient
+
+# The benchmark runs the real ingestion script, retrieval code and Streamlit chatbot against a local
+# stand-in for Ollama (fake_ollama.py), so it needs no models and measures only the pipeline itself. The Wikipedia
+# client of the alternative scraper runs against a stand-in too (fake_wikipedia.py).
+# Configure the stand-in with the FAKE_OLLAMA_* variables and the workload with the BENCHMARK_* variables.
+
+load_dotenv()
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# size of the synthetic dataset and of the query workload
+BENCHMARK_ARTICLES = int(os.getenv("BENCHMARK_ARTICLES", "200"))
+BENCHMARK_ARTICLE_WORDS = int(os.getenv("BENCHMARK_ARTICLE_WORDS", "800"))
+BENCHMARK_QUERIES = int(os.getenv("BENCHMARK_QUERIES", "200"))
+BENCHMARK_CHAT_QUESTIONS = int(os.getenv("BENCHMARK_CHAT_QUESTIONS", "10"))
+
+# how much faster the stand-in runs the fast chat model of the model routing benchmark than the full one
+BENCHMARK_FAST_MODEL_SPEED = float(os.getenv("BENCHMARK_FAST_MODEL_SPEED", "3"))
+FAST_CHAT_MODEL = "benchmark-chat-fast"
+
+# keywords and search results per keyword of the scraping benchmark, and the client's limits it checks
+BENCHMARK_SCRAPE_KEYWORDS = int(os.getenv("BENCHMARK_SCRAPE_KEYWORDS", "10"))
+BENCHMARK_SCRAPE_PAGES = int(os.getenv("BENCHMARK_SCRAPE_PAGES", "5"))
+BENCHMARK_SCRAPE_RATE_LIMIT = float(os.getenv("BENCHMARK_SCRAPE_RATE_LIMIT", "20"))
+SCRAPE_CONCURRENCY = int(os.getenv("SCRAPE_CONCURRENCY", "4"))
+
+# results are written as JSON, one file per run, so runs can be compared over time
+BENCHMARK_OUTPUT = os.getenv(
+    "BENCHMARK_OUTPUT",
+    os.path.join("benchmark_results", f"benchmark-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.json"),
+)
+
+# words of the synthetic articles, drawn with a Zipf-like distribution like natural text
+rng = random.Random(42)
+VOCABULARY = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 10))) for _ in range(2000)]
+WORD_WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+
+
+def summarize(latencies):
+    """Percentiles of a list of latencies in seconds, in milliseconds."""
+    latencies_ms = np.asarray(latencies, dtype=np.float64) * 1000
+    if not len(latencies_ms):
+        return {"count": 0}
+    return {
+        "count": len(latencies_ms),
+        "mean_ms": float(latencies_ms.mean()),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "max_ms": float(latencies_ms.max()),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+#################################################################################################################################################################
+###############################   2.  START THE FAKE OLLAMA SERVER AND WRITE THE SYNTHETIC DATASET   ###########################################################
+#################################################################################################################################################################
+
+work_dir = tempfile.mkdtemp(prefix="rag-benchmark-")
+fake_server = server_from_env(port=0).start()
+fake_server.model_speeds.setdefault(FAST_CHAT_MODEL, BENCHMARK_FAST_MODEL_SPEED)
+
+# point the scripts at the fake server and at throwaway storage; the retrieval settings from .env are kept
+os.environ.update({
+    "OLLAMA_HOST": fake_server.url,
+    "EMBEDDING_MODEL": "benchmark-embedding",
+    "CHAT_MODEL": "benchmark-chat",
+    "MODEL_PROVIDER": "ollama",
+    "DATASET_STORAGE_FOLDER": os.path.join(work_dir, "datasets") + os.sep,
+    "DATABASE_LOCATION": os.path.join(work_dir, "chroma_db"),
+    "COLLECTION_NAME": "benchmark",
+    "EMBEDDING_CACHE_LOCATION": os.path.join(work_dir, "embedding_cache"),
+    "INGEST_MODE": "full",
+    "VECTOR_BACKEND": "numpy",
+    "ANSWER_CACHE": "false",
+    "WARM_START": "false",
+    # a context window of its own, so the prefill section checks the warm-up loads the chat model with it
+    "OLLAMA_NUM_CTX": os.getenv("OLLAMA_NUM_CTX", "4096"),
+    "ANONYMIZED_TELEMETRY": "False",
+})
+
+os.makedirs(os.environ["DATASET_STORAGE_FOLDER"])
+data_file = os.environ["DATASET_STORAGE_FOLDER"] + "data.txt"
+
+articles = []
+# the same articles as a Parquet dataset, outside the dataset folder so the ingestion reads data.txt
+parquet_rows = []
+parquet_dataset = os.path.join(work_dir, "articles")
+with open(data_file, "w", encoding="utf-8") as f:
+    for i in range(BENCHMARK_ARTICLES):
+        words = rng.choices(VOCABULARY, weights=WORD_WEIGHTS, k=BENCHMARK_ARTICLE_WORDS)
+        # paragraphs of 60 words, so the splitter has separators to work with
+        content = "\n\n".join(" ".join(words[start:start + 60]) + "." for start in range(0, len(words), 60))
+        articles.append(words)
+        f.write(f"=== Article {i} ===\n")
+        f.write(f"Keyword: topic {i % 10}\n")
+        f.write(f"URL: https://en.wikipedia.org/wiki/Article_{i}\n")
+        f.write(f"\n{content}\n")
+        f.write("\n" + SEPARATOR + "\n\n")
+        parquet_rows.append({
+            "title": f"Article {i}",
+            "url": f"https://en.wikipedia.org/wiki/Article_{i}",
+            "keyword": f"topic {i % 10}",
+            "revision": i,
+            "content": content,
+        })
+write_parquet_dataset(parquet_rows, parquet_dataset)
+del parquet_rows
+
+# questions made of a few words from one article, so most of them have a relevant chunk
+questions = []
+for _ in range(max(BENCHMARK_QUERIES, BENCHMARK_CHAT_QUESTIONS)):
+    words = rng.choice(articles)
+    start = rng.randrange(len(words) - 8)
+    questions.append("what is " + " ".join(words[start:start + rng.randint(3, 8)]))
+
+results = {
+    "timestamp": datetime.now(timezone.utc).isoformat(),
+    "git_revision": git_revision(),
+    "python": platform.python_version(),
+    "config": {
+        "articles": BENCHMARK_ARTICLES,
+        "article_words": BENCHMARK_ARTICLE_WORDS,
+        "queries": BENCHMARK_QUERIES,
+        "chat_questions": BENCHMARK_CHAT_QUESTIONS,
+        "embedding_dim": fake_server.dim,
+        "embed_latency_ms": fake_server.embed_latency_ms,
+        "ttft_ms": fake_server.ttft_ms,
+        "tokens_per_second": fake_server.tokens_per_second,
+        "answer_tokens": fake_server.answer_tokens,
+        "prefill_ms_per_token": fake_server.prefill_ms_per_token,
+        "fast_model_speed": fake_server.model_speeds[FAST_CHAT_MODEL],
+        "dataset_bytes": os.path.getsize(data_file),
+        "parquet_dataset_bytes": sum(
+            os.path.getsize(os.path.join(folder, name)) for folder, _, names in os.walk(parquet_dataset) for name in names
+        ),
+    },
+}
+
+#################################################################################################################################################################
+###############################   3.  PARSING AND INGESTION THROUGHPUT   ########################################################################################
+#################################################################################################################################################################
+
+print(f"Parsing {BENCHMARK_ARTICLES} articles ({results['config']['dataset_bytes'] / 1e6:.1f} MB, {results['config']['parquet_dataset_bytes'] / 1e6:.1f} MB as Parquet)")
+started_at = time.perf_counter()
+with open(data_file, encoding="utf-8") as f:
+    parsed = sum(1 for _ in parse_custom_format(f))
+parse_seconds = time.perf_counter() - started_at
+
+# the same scan over the Parquet dataset, reading only the columns the ingestion needs
+started_at = time.perf_counter()
+parquet_parsed = sum(1 for _ in iter_articles(parquet_dataset))
+parquet_scan_seconds = time.perf_counter() - started_at
+
+# the LangChain splitter and the offset-based splitter over the same articles, with the ingestion's settings
+print("Splitting the articles with both text splitters")
+text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, add_start_index=True)
+offset_splitter = OffsetTextSplitter.from_splitter(text_splitter)
+splitters = {
+    "langchain": lambda article: text_splitter.create_documents([article["raw_text"]], metadatas=[{"source": article["url"]}]),
+    "offsets": lambda article: offset_splitter.create_chunks(article["raw_text"], {"source": article["url"]}),
+}
+with open(data_file, encoding="utf-8") as f:
+    parsed_articles = list(parse_custom_format(f))
+split_chunks_per_second = {}
+for name, split in splitters.items():
+    started_at = time.perf_counter()
+    split_chunks = sum(len(split(article)) for article in parsed_articles)
+    split_chunks_per_second[name] = split_chunks / (time.perf_counter() - started_at)
+del parsed_articles
+
+print("Running 2_chunking_embedding_ingestion.py")
+started_at = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    ingestion = runpy.run_path(os.path.join(REPO_DIR, "2_chunking_embedding_ingestion.py"), run_name="__main__")
+ingest_seconds = time.perf_counter() - started_at
+
+ingest_stats = ingestion["stats"]
+results["ingestion"] = {
+    "parse_articles_per_second": parsed / parse_seconds if parse_seconds > 0 else 0.0,
+    "parse_mb_per_second": results["config"]["dataset_bytes"] / 1e6 / parse_seconds if parse_seconds > 0 else 0.0,
+    "parquet_scan_articles_per_second": parquet_parsed / parquet_scan_seconds if parquet_scan_seconds > 0 else 0.0,
+    "split_chunks_per_second": split_chunks_per_second,
+    # time the ingestion spent splitting, with its TEXT_SPLITTER
+    "split_seconds": ingestion["stage_timings"].get("split", 0.0),
+    "articles": len(ingestion["seen_sources"]),
+    "chunks": ingest_stats["chunks"],
+    # the whole script, including the BM25 and vector index builds
+    "seconds": ingest_seconds,
+    "articles_per_second": len(ingestion["seen_sources"]) / ingest_seconds,
+    "chunks_per_second": ingest_stats["chunks"] / ingest_seconds,
+    # the embedding and writing phase only
+    "engine_chunks_per_second": ingest_stats["chunks_per_second"],
+    "embed_seconds": ingest_stats["embed_seconds"],
+    "write_seconds": ingest_stats["write_seconds"],
+    "embedding_requests": fake_server.embed_requests,
+}
+
+#################################################################################################################################################################
+###############################   4.  RETRIEVAL LATENCY   #######################################################################################################
+#################################################################################################################################################################
+
+RETRIEVER_K = int(os.getenv("RETRIEVER_K", "2"))
+
+vector_store = Chroma(
+    collection_name=os.environ["COLLECTION_NAME"],
+    embedding_function=OllamaEmbeddings(model=os.environ["EMBEDDING_MODEL"]),
+    persist_directory=os.environ["DATABASE_LOCATION"],
+)
+
+print(f"Embedding {BENCHMARK_QUERIES} queries")
+query_embeddings = []
+embed_latencies = []
+for question in questions[:BENCHMARK_QUERIES]:
+    started_at = time.perf_counter()
+    query_embeddings.append(vector_store.embeddings.embed_query(question))
+    embed_latencies.append(time.perf_counter() - started_at)
+
+database_location = os.environ["DATABASE_LOCATION"]
+vector_index = NumpyVectorIndex.load(os.path.join(database_location, "benchmark.vectors"))
+bm25_index = BM25Index.load(os.path.join(database_location, "benchmark.bm25"))
+hybrid_retriever = HybridRetriever(
+    vector_store=vector_store, bm25_index=bm25_index, k=RETRIEVER_K, fetch_k=int(os.getenv("HYBRID_FETCH_K", "10"))
+)
+mmr_retriever = MMRRetriever(
+    vector_store=vector_store,
+    hybrid_retriever=hybrid_retriever,
+    k=RETRIEVER_K,
+    fetch_k=int(os.getenv("MMR_FETCH_K", "20")),
+    lambda_mult=float(os.getenv("MMR_LAMBDA", "0.7")),
+    # the benchmark measures the full rerank, never the fallback
+    latency_budget_ms=float("inf"),
+)
+
+retrieval_stages = {
+    "chroma": lambda question, embedding: vector_search(vector_store, embedding, RETRIEVER_K),
+    "numpy_index": lambda question, embedding: vector_search(vector_index, embedding, RETRIEVER_K),
+    "hybrid": hybrid_retriever.retrieve_with_scores,
+    "hybrid_mmr": mmr_retriever.retrieve_with_scores,
+}
+
+results["retrieval"] = {"embed_query": summarize(embed_latencies)}
+for name, retrieve in retrieval_stages.items():
+    print(f"Timing {name} retrieval")
+    # one untimed query first, so opening files and loading indexes is not counted
+    retrieve(questions[0], query_embeddings[0])
+    latencies = []
+    for question, query_embedding in zip(questions, query_embeddings):
+        started_at = time.perf_counter()
+        retrieve(question, query_embedding)
+        latencies.append(time.perf_counter() - started_at)
+    results["retrieval"][name] = summarize(latencies)
+
+#################################################################################################################################################################
+###############################   5.  CHATBOT LATENCY   #########################################################################################################
+#################################################################################################################################################################
+
+# the chatbot runs in-process through Streamlit's test harness, and records the latency of every answer itself
+from streamlit.testing.v1 import AppTest
+
+print(f"Asking the chatbot {BENCHMARK_CHAT_QUESTIONS} questions")
+app = AppTest.from_file(os.path.join(REPO_DIR, "3_chatbot.py"), default_timeout=600)
+app.run()
+
+time_to_first_token, total_time, retrieval_time, rerun_time = [], [], [], []
+stage_times = {}
+context_tokens, context_tokens_saved = [], []
+for question in questions[:BENCHMARK_CHAT_QUESTIONS]:
+    started_at = time.perf_counter()
+    app.chat_input[0].set_value(question).run()
+    rerun_time.append(time.perf_counter() - started_at)
+
+    metrics = app.session_state.latency_metrics[-1]
+    time_to_first_token.append(metrics["time_to_first_token"])
+    total_time.append(metrics["total_time"])
+    retrieval_time.append(metrics["retrieval"]["total"])
+    for name, seconds in metrics["stages"].items():
+        stage_times.setdefault(name, []).append(seconds)
+    if metrics.get("context"):
+        context_tokens.append(metrics["context"]["tokens"])
+        context_tokens_saved.append(metrics["context"]["tokens_saved"])
+
+results["chatbot"] = {
+    "time_to_first_token": summarize(time_to_first_token),
+    "answer_time": summarize(total_time),
+    "retrieval_time": summarize(retrieval_time),
+    # the whole Streamlit rerun: embedding the question, retrieval, streaming and rendering
+    "rerun_time": summarize(rerun_time),
+    "stages": {name: summarize(seconds) for name, seconds in stage_times.items()},
+    # estimated prompt context size per answer, and the tokens context packing removed from it
+    "context_tokens_mean": float(np.mean(context_tokens)) if context_tokens else None,
+    "context_tokens_saved_mean": float(np.mean(context_tokens_saved)) if context_tokens_saved else None,
+    "chat_requests": fake_server.chat_requests,
+}
+
+#################################################################################################################################################################
+###############################   6.  PROMPT PREFILL   ##########################################################################################################
+#################################################################################################################################################################
+
+# the same questions with both prompt layouts, against the stand-in's KV cache (FAKE_OLLAMA_PREFILL_MS_PER_TOKEN per
+# evaluated prompt token); the chat model gets the OLLAMA_KEEP_ALIVE and OLLAMA_NUM_CTX options, as in the chatbot
+from rag_pipeline import RAGPipeline
+
+results["prefill"] = {}
+for layout in ("legacy", "cached"):
+    print(f"Timing prompt prefill with the {layout} prompt layout")
+    pipeline = RAGPipeline(prompt_layout=layout)
+    pipeline.warm_up()
+    # the warm-up must load the chat model with the options of the answers, or the first question reloads it
+    loads_after_warm_up = fake_server.model_loads.get("benchmark-chat", 0)
+
+    prefill_seconds, prompt_tokens, layout_time_to_first_token = [], [], []
+    for question in questions[:BENCHMARK_CHAT_QUESTIONS]:
+        query_embedding = pipeline.embeddings.embed_query(question)
+        retrieved_docs, _ = pipeline.retrieve(question, query_embedding)
+        chain, chain_input, _ = pipeline.route(question, retrieved_docs)
+
+        prefill = {}
+        started_at = time.perf_counter()
+        tokens = pipeline.stream_tokens(chain, chain_input, prefill=prefill)
+        next(tokens)
+        layout_time_to_first_token.append(time.perf_counter() - started_at)
+        for _ in tokens:
+            pass
+        prefill_seconds.append(prefill["prefill_seconds"])
+        prompt_tokens.append(prefill["prompt_tokens"])
+
+    results["prefill"][layout] = {
+        "prefill": summarize(prefill_seconds),
+        "time_to_first_token": summarize(layout_time_to_first_token),
+        # prompt tokens the model had to evaluate per answer, the rest came from the KV cache
+        "prompt_tokens_evaluated_mean": float(np.mean(prompt_tokens)) if prompt_tokens else None,
+        "chat_model_reloads_after_warm_up": fake_server.model_loads.get("benchmark-chat", 0) - loads_after_warm_up,
+    }
+
+#################################################################################################################################################################
+###############################   7.  MODEL ROUTING   ###########################################################################################################
+#################################################################################################################################################################
+
+# the chat questions mixed with greetings (general knowledge answers), with the full chat model only and with model
+# routing to a model BENCHMARK_FAST_MODEL_SPEED times faster, using the MODEL_ROUTING_* settings
+greetings = ["hello", "hi, how are you?", "thanks a lot", "good morning"]
+routing_questions = [
+    question for i, question in enumerate(questions[:BENCHMARK_CHAT_QUESTIONS]) for question in (question, greetings[i % len(greetings)])
+]
+
+results["model_routing"] = {}
+for name, fast_model in (("full_only", None), ("routed", FAST_CHAT_MODEL)):
+    print(f"Timing {len(routing_questions)} answers with {'model routing' if fast_model else 'the full chat model only'}")
+    pipeline = RAGPipeline(fast_model=fast_model)
+    pipeline.warm_up()
+
+    routing_time_to_first_token, routing_answer_time = [], []
+    for question in routing_questions:
+        timings, model_route = {}, {}
+        started_at = time.perf_counter()
+        query_embedding = pipeline.embeddings.embed_query(question)
+        retrieved_docs, _ = pipeline.retrieve(question, query_embedding)
+        chain, chain_input, _ = pipeline.route(question, retrieved_docs, timings, model_route=model_route)
+
+        tokens = pipeline.stream_tokens(chain, chain_input, timings, model_route=model_route)
+        next(tokens)
+        routing_time_to_first_token.append(time.perf_counter() - started_at)
+        for _ in tokens:
+            pass
+        routing_answer_time.append(time.perf_counter() - started_at)
+
+    results["model_routing"][name] = {
+        "time_to_first_token": summarize(routing_time_to_first_token),
+        "answer_time": summarize(routing_answer_time),
+        # answers, reasons and latency per route
+        "routes": pipeline.model_router.stats() if pipeline.model_router is not None else None,
+    }
+
+fake_server.stop()
+shutil.rmtree(work_dir, ignore_errors=True)
+
+#################################################################################################################################################################
+###############################   8.  SCRAPING   ################################################################################################################
+#################################################################################################################################################################
+
+# the real Wikipedia client against fake_wikipedia.py, which answers every 7th request with a 429 and every 11th with
+# a 503: every page must still be downloaded, with retries, within the client's concurrency and rate limits. At 200ms
+# per request, the default 20 requests/sec would need 4 in flight, so both limits are in play
+print(f"Scraping {BENCHMARK_SCRAPE_KEYWORDS} keywords from the fake Wikipedia API")
+wikipedia_server = FakeWikipediaServer(port=0, latency_ms=200, throttle_every=7, fail_every=11).start()
+
+
+async def scrape():
+    async with WikipediaClient(
+        api_url=wikipedia_server.url,
+        concurrency=SCRAPE_CONCURRENCY,
+        requests_per_second=BENCHMARK_SCRAPE_RATE_LIMIT,
+        backoff_seconds=0.05,
+    ) as client:
+        searches = await asyncio.gather(*(client.search_revisions(f"keyword {i}", BENCHMARK_SCRAPE_PAGES) for i in range(BENCHMARK_SCRAPE_KEYWORDS)))
+        titles = [result["title"] for results in searches for result in results]
+        errors = {}
+        extracts = await client.fetch_extracts(titles, errors=errors)
+    return titles, extracts, errors, client
+
+
+started_at = time.perf_counter()
+scraped_titles, extracts, scrape_errors, wikipedia_client = asyncio.run(scrape())
+scrape_seconds = time.perf_counter() - started_at
+wikipedia_server.stop()
+
+results["scraping"] = {
+    "pages": len(scraped_titles),
+    "pages_downloaded": len(extracts),
+    "pages_failed": len(scrape_errors),
+    "seconds": scrape_seconds,
+    "pages_per_second": len(extracts) / scrape_seconds,
+    "requests": wikipedia_client.requests_made,
+    "retries": wikipedia_client.retries,
+    "throttled_responses": wikipedia_server.throttled,
+    "server_errors": wikipedia_server.failed,
+    "concurrency": SCRAPE_CONCURRENCY,
+    "max_concurrent_requests": wikipedia_server.max_concurrent,
+    "rate_limit": BENCHMARK_SCRAPE_RATE_LIMIT,
+    "peak_requests_per_second": wikipedia_server.peak_requests_per_second(),
+}
+
+#################################################################################################################################################################
+###############################   9.  WRITE THE RESULTS   #######################################################################################################
+#################################################################################################################################################################
+
+if os.path.dirname(BENCHMARK_OUTPUT):
+    os.makedirs(os.path.dirname(BENCHMARK_OUTPUT), exist_ok=True)
+with open(BENCHMARK_OUTPUT, "w", encoding="utf-8") as f:
+    json.dump(results, f, indent=2)
+
+print()
+print(f"Ingestion: {results['ingestion']['articles_per_second']:.1f} articles/sec, {results['ingestion']['chunks_per_second']:.1f} chunks/sec")
+for name, summary in results["retrieval"].items():
+    print(f"Retrieval {name}: p50 {summary['p50_ms']:.2f}ms, p95 {summary['p95_ms']:.2f}ms, p99 {summary['p99_ms']:.2f}ms")
+print(f"Chatbot: time to first token p50 {results['chatbot']['time_to_first_token']['p50_ms']:.0f}ms, answer p50 {results['chatbot']['answer_time']['p50_ms']:.0f}ms")
+for layout in ("legacy", "cached"):
+    summary = results["prefill"][layout]
+    print(f"Prefill ({layout} prompts): p50 {summary['prefill']['p50_ms']:.0f}ms, {summary['prompt_tokens_evaluated_mean']:.0f} tokens evaluated, time to first token p50 {summary['time_to_first_token']['p50_ms']:.0f}ms, chat model reloads after warm-up: {summary['chat_model_reloads_after_warm_up']}")
+for name, summary in results["model_routing"].items():
+    print(f"Model routing ({name}): time to first token p50 {summary['time_to_first_token']['p50_ms']:.0f}ms, answer p50 {summary['answer_time']['p50_ms']:.0f}ms, answer p95 {summary['answer_time']['p95_ms']:.0f}ms")
+if results["model_routing"]["routed"]["routes"]:
+    for route, summary in results["model_routing"]["routed"]["routes"]["routes"].items():
+        print(f"  {route} route ({summary['model']}): {summary['answers']} answers {summary['reasons']}")
+summary = results["scraping"]
+print(f"Scraping: {summary['pages_downloaded']}/{summary['pages']} pages in {summary['seconds']:.1f}s ({summary['pages_per_second']:.1f} pages/sec), {summary['requests']} requests ({summary['retries']} retries), at most {summary['max_concurrent_requests']} at once (limit {summary['concurrency']}), peak {summary['peak_requests_per_second']} requests/sec (limit {summary['rate_limit']:g})")
+print(f"Results written to {BENCHMARK_OUTPUT}")
+
+failed_checks = []
+# a warm-up that loads the chat model with other options than the answers makes every first question reload it
+if any(results["prefill"][layout]["chat_model_reloads_after_warm_up"] for layout in ("legacy", "cached")):
+    failed_checks.append("the first question after the warm-up reloaded the chat model")
+if summary["pages_downloaded"] < summary["pages"]:
+    failed_checks.append("the scraper lost pages to throttled or failed requests")
+if summary["max_concurrent_requests"] > summary["concurrency"]:
+    failed_checks.append("the scraper sent more concurrent requests than SCRAPE_CONCURRENCY")
+# one request of slack: a window can start right on a request and end right on the next-but-rate one
+if summary["peak_requests_per_second"] > summary["rate_limit"] + 1:
+    failed_checks.append("the scraper exceeded its rate limit")
+for check in failed_checks:
+    print(f"Check failed: {check}")
+if failed_checks:
+    sys.exit(1)
@@ -0,0 +1,177 @@
+import json
+import math
+import os
+import re
+import shutil
+from collections import Counter
+
+import numpy as np
+
+from topics import chunk_topics
+
+# words, numbers and codes; case-insensitive
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """Lexical BM25 index over the chunks of a collection, stored as flat NumPy arrays.
+
+    The index is an inverted file in CSR form: the postings of term i are the slice
+    term_offsets[i]:term_offsets[i + 1] of postings_doc/postings_tf. All arrays are saved as .npy
+    files and loaded memory-mapped, so opening even a large index is cheap.
+
+    The chunks of topic i in `topics` are topic_docs[topic_offsets[i]:topic_offsets[i + 1]] (a chunk of
+    several topics is listed under each), so searches can be restricted to topics.
+    """
+
+    def __init__(self, terms, term_offsets, postings_doc, postings_tf, doc_lengths, doc_ids, k1=1.5, b=0.75,
+                 topics=None, topic_docs=None, topic_offsets=None):
+        self.terms = terms
+        self.term_offsets = term_offsets
+        self.postings_doc = postings_doc
+        self.postings_tf = postings_tf
+        self.doc_lengths = doc_lengths
+        self.doc_ids = doc_ids
+        self.k1 = k1
+        self.b = b
+        self.avg_doc_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        self.topics = topics
+        self.topic_docs = topic_docs
+        self.topic_offsets = topic_offsets
+
+    @classmethod
+    def build(cls, documents, k1=1.5, b=0.75):
+        """Build the index from (chunk ID, text) or (chunk ID, text, topics) tuples."""
+        doc_ids = []
+        doc_lengths = []
+        doc_topic_names = []
+        triples = []
+
+        for doc_index, (doc_id, text, *names) in enumerate(documents):
+            tokens = tokenize(text)
+            doc_ids.append(doc_id)
+            doc_lengths.append(len(tokens))
+            doc_topic_names.append(names[0] if names else [])
+            triples.extend((term, doc_index, count) for term, count in Counter(tokens).items())
+
+        terms = sorted({term for term, _, _ in triples})
+        term_index = {term: i for i, term in enumerate(terms)}
+
+        term_ids = np.fromiter((term_index[term] for term, _, _ in triples), dtype=np.int64, count=len(triples))
+        order = np.argsort(term_ids, kind="stable")
+
+        postings_doc = np.fromiter((doc for _, doc, _ in triples), dtype=np.int32, count=len(triples))[order]
+        postings_tf = np.fromiter((min(count, 65535) for _, _, count in triples), dtype=np.uint16, count=len(triples))[order]
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        term_offsets[1:] = np.cumsum(np.bincount(term_ids, minlength=len(terms)))
+
+        # the chunks of every topic, in CSR form like the postings
+        topics = sorted({topic for names in doc_topic_names for topic in names})
+        topic_index = {topic: i for i, topic in enumerate(topics)}
+        pair_codes = np.array([topic_index[topic] for names in doc_topic_names for topic in names], dtype=np.int64)
+        pair_docs = np.array([doc for doc, names in enumerate(doc_topic_names) for _ in names], dtype=np.int32)
+        topic_offsets = np.zeros(len(topics) + 1, dtype=np.int64)
+        topic_offsets[1:] = np.cumsum(np.bincount(pair_codes, minlength=len(topics)))
+
+        return cls(
+            np.array(terms, dtype=str),
+            term_offsets,
+            postings_doc,
+            postings_tf,
+            np.array(doc_lengths, dtype=np.int32),
+            np.array(doc_ids, dtype=str),
+            k1=k1,
+            b=b,
+            topics=topics,
+            topic_docs=pair_docs[np.argsort(pair_codes, kind="stable")],
+            topic_offsets=topic_offsets,
+        )
+
+    def save(self, path):
+        """Save the index to a directory, replacing any previous index only once it is fully written."""
+        temp_path = path + ".tmp"
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+
+        for name in ("terms", "term_offsets", "postings_doc", "postings_tf", "doc_lengths", "doc_ids"):
+            np.save(os.path.join(temp_path, f"{name}.npy"), getattr(self, name))
+        meta = {"k1": self.k1, "b": self.b}
+        if self.topic_docs is not None:
+            np.save(os.path.join(temp_path, "topic_docs.npy"), self.topic_docs)
+            np.save(os.path.join(temp_path, "topic_offsets.npy"), self.topic_offsets)
+            meta["topics"] = self.topics
+        with open(os.path.join(temp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved index with every array memory-mapped."""
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in ("terms", "term_offsets", "postings_doc", "postings_tf", "doc_lengths", "doc_ids")
+        }
+        if "topics" in meta:
+            for name in ("topic_docs", "topic_offsets"):
+                arrays[name] = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        return cls(**arrays, k1=meta["k1"], b=meta["b"], topics=meta.get("topics"))
+
+    def search(self, query, k=10, topics=None):
+        """Return up to k (chunk ID, BM25 score) pairs, best first.
+
+        With topics, only chunks of those topics are returned; None or an empty list returns any chunk.
+        """
+        num_docs = len(self.doc_ids)
+        if not num_docs or not len(self.terms):
+            return []
+
+        scores = np.zeros(num_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            i = int(np.searchsorted(self.terms, term))
+            if i >= len(self.terms) or self.terms[i] != term:
+                continue
+
+            start, end = self.term_offsets[i], self.term_offsets[i + 1]
+            docs = self.postings_doc[start:end]
+            tf = self.postings_tf[start:end].astype(np.float32)
+
+            idf = math.log(1 + (num_docs - (end - start) + 0.5) / ((end - start) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / self.avg_doc_length)
+            # a term occurs at most once per document in the postings, so plain fancy indexing is safe
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        if topics and self.topic_docs is not None:
+            in_topics = np.zeros(num_docs, dtype=bool)
+            for i, topic in enumerate(self.topics):
+                if topic in topics:
+                    in_topics[self.topic_docs[self.topic_offsets[i]:self.topic_offsets[i + 1]]] = True
+            scores[~in_topics] = 0
+
+        k = min(k, num_docs)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(str(self.doc_ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+
+def build_collection_index(vector_store, path, batch_size=1000):
+    """Build the BM25 index over every chunk of a Chroma collection and save it."""
+    def iter_chunks():
+        offset = 0
+        while True:
+            batch = vector_store._collection.get(limit=batch_size, offset=offset, include=["documents", "metadatas"])
+            if not batch["ids"]:
+                return
+            yield from zip(batch["ids"], batch["documents"], map(chunk_topics, batch["metadatas"]))
+            offset += len(batch["ids"])
+
+    index = BM25Index.build(iter_chunks())
+    index.save(path)
+    return index
@@ -0,0 +1,152 @@
+from array import array
+
+
+class Article:
+    """Text and metadata of one article, shared by all of its chunks."""
+
+    __slots__ = ("text", "metadata")
+
+    def __init__(self, text, metadata):
+        self.text = text
+        self.metadata = metadata
+
+
+class Chunk:
+    """A chunk stored as offsets into its article, used where a LangChain Document is expected.
+
+    The text and metadata are built when they are read, e.g. when the chunk is embedded or written
+    to the collection, instead of being copied for every chunk when the article is split.
+    """
+
+    __slots__ = ("article", "start", "end")
+
+    def __init__(self, article, start, end):
+        self.article = article
+        self.start = start
+        self.end = end
+
+    @property
+    def page_content(self):
+        return self.article.text[self.start:self.end]
+
+    @property
+    def metadata(self):
+        return {**self.article.metadata, "start_index": self.start}
+
+    def __len__(self):
+        return self.end - self.start
+
+
+class OffsetTextSplitter:
+    """Split text into the same chunks as RecursiveCharacterTextSplitter, as (start, end) offsets.
+
+    The recursion works on offsets into the original text instead of substrings, separators are
+    found with str.find instead of regular expressions, and pieces are merged into chunks with a
+    sliding window instead of re-slicing a list, so no text is copied while splitting.
+
+    Only the settings the ingestion uses are supported: plain (non-regex) separators kept at the
+    start of the next piece, `len` as the length function and whitespace stripped from every chunk.
+    """
+
+    def __init__(self, chunk_size=4000, chunk_overlap=200, separators=None):
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) is larger than chunk_size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = separators or ["\n\n", "\n", " ", ""]
+
+    @classmethod
+    def from_splitter(cls, text_splitter):
+        """Create an OffsetTextSplitter with the settings of a RecursiveCharacterTextSplitter."""
+        if (
+            text_splitter._is_separator_regex
+            or text_splitter._keep_separator not in (True, "start")
+            or text_splitter._length_function is not len
+            or not text_splitter._strip_whitespace
+        ):
+            raise ValueError("OffsetTextSplitter only supports plain separators kept at the start, len and stripped whitespace")
+        return cls(text_splitter._chunk_size, text_splitter._chunk_overlap, text_splitter._separators)
+
+    def split_offsets(self, text):
+        """Return the start and end offsets of the chunks of a text, as two arrays."""
+        starts, ends = array("q"), array("q")
+        self._split(text, 0, len(text), self.separators, starts, ends)
+        return starts, ends
+
+    def create_chunks(self, text, metadata=None):
+        """Split a text into Chunks that share one Article with the text and metadata."""
+        article = Article(text, metadata or {})
+        starts, ends = self.split_offsets(text)
+        return [Chunk(article, start, end) for start, end in zip(starts, ends)]
+
+    def _split(self, text, start, end, separators, starts, ends):
+        # the first separator found in the text, as RecursiveCharacterTextSplitter picks it
+        separator = separators[-1]
+        remaining_separators = []
+        for i, candidate in enumerate(separators):
+            if candidate == "":
+                separator = candidate
+                break
+            if text.find(candidate, start, end) != -1:
+                separator = candidate
+                remaining_separators = separators[i + 1:]
+                break
+
+        # pieces run from one separator to the next, each starting with its separator
+        if separator:
+            pieces = []
+            piece_start = start
+            position = text.find(separator, start, end)
+            while position != -1:
+                if position > piece_start:
+                    pieces.append((piece_start, position))
+                piece_start = position
+                position = text.find(separator, position + len(separator), end)
+            if end > piece_start:
+                pieces.append((piece_start, end))
+        else:
+            pieces = [(position, position + 1) for position in range(start, end)]
+
+        # runs of pieces shorter than chunk_size are merged into chunks, longer pieces are split further
+        run_start = 0
+        long_pieces = [i for i, (piece_start, piece_end) in enumerate(pieces) if piece_end - piece_start >= self.chunk_size]
+        for i in long_pieces:
+            if i > run_start:
+                self._merge(text, pieces[run_start:i], starts, ends)
+            run_start = i + 1
+
+            piece_start, piece_end = pieces[i]
+            if not remaining_separators:
+                # too long, but nothing left to split it with: kept as it is, like the LangChain splitter does
+                starts.append(piece_start)
+                ends.append(piece_end)
+            else:
+                self._split(text, piece_start, piece_end, remaining_separators, starts, ends)
+
+        if run_start < len(pieces):
+            self._merge(text, pieces[run_start:], starts, ends)
+
+    def _merge(self, text, pieces, starts, ends):
+        """Merge consecutive pieces into chunks of at most chunk_size, overlapping by up to chunk_overlap."""
+        total = 0
+        # the current chunk is pieces[first:i]
+        first = 0
+        for i, (piece_start, piece_end) in enumerate(pieces):
+            length = piece_end - piece_start
+            if total + length > self.chunk_size and i > first:
+                self._add_stripped(text, pieces[first][0], pieces[i - 1][1], starts, ends)
+                while total > self.chunk_overlap or (total + length > self.chunk_size and total > 0):
+                    total -= pieces[first][1] - pieces[first][0]
+                    first += 1
+            total += length
+        self._add_stripped(text, pieces[first][0], pieces[-1][1], starts, ends)
+
+    @staticmethod
+    def _add_stripped(text, start, end, starts, ends):
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start < end:
+            starts.append(start)
+            ends.append(end)
@@ -0,0 +1,24 @@
+import os
+from uuid import uuid4
+
+
+def _version_file(database_location, collection_name):
+    return os.path.join(database_location, f"{collection_name}.version")
+
+
+def read_collection_version(database_location, collection_name):
+    """Return the current version marker of a collection ("" if it was never ingested)."""
+    try:
+        with open(_version_file(database_location, collection_name), encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
+
+
+def bump_collection_version(database_location, collection_name):
+    """Write a new version marker after the collection has been (re-)ingested."""
+    os.makedirs(database_location, exist_ok=True)
+    version = uuid4().hex
+    with open(_version_file(database_location, collection_name), "w", encoding="utf-8") as f:
+        f.write(version)
+    return version
@@ -0,0 +1,130 @@
+import math
+
+# rough token count of English text for Llama-style tokenizers; the chat model's tokenizer is not available locally
+CHARS_PER_TOKEN = 4
+
+# placed between non-adjacent passages of the same source
+PASSAGE_SEPARATOR = "\n[...]\n"
+
+# consecutive chunks that don't overlap are split at a separator, whose whitespace the splitter strips;
+# chunks at most this many characters apart are treated as adjacent and joined with a newline
+ADJACENT_GAP = 8
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def format_source(source, relevance, content):
+    """Format the content of one source for the prompt; without a relevance score when relevance is None."""
+    if relevance is None:
+        return f"Source: {source}\nContent: {content}\n\n"
+    return f"Source: {source}\nRelevance: {relevance:.2f}\nContent: {content}\n\n"
+
+
+def merge_passages(docs_with_scores):
+    """Group chunks by source and stitch the ones that overlap or are adjacent into single passages.
+
+    Chunks carry their offset in the article in the `start_index` metadata, written by the ingestion,
+    so the overlap two neighbouring chunks share is only kept once. Chunks without an offset (from
+    collections ingested before it was stored) are kept as passages of their own.
+
+    Returns a list of passages: dicts with source, start, end, text and relevance (the best score of their chunks).
+    """
+    by_source = {}
+    for doc, score in docs_with_scores:
+        by_source.setdefault(doc.metadata.get("source"), []).append((doc, score))
+
+    passages = []
+    for source, chunks in by_source.items():
+        with_offsets = sorted(
+            (chunk for chunk in chunks if chunk[0].metadata.get("start_index") is not None),
+            key=lambda chunk: chunk[0].metadata["start_index"],
+        )
+
+        current = None
+        for doc, score in with_offsets:
+            start = doc.metadata["start_index"]
+            end = start + len(doc.page_content)
+            if current is not None and start <= current["end"]:
+                # keep only the part of this chunk that is not already in the passage
+                if end > current["end"]:
+                    current["text"] += doc.page_content[current["end"] - start:]
+                    current["end"] = end
+                current["relevance"] = max(current["relevance"], score)
+            elif current is not None and start - current["end"] <= ADJACENT_GAP:
+                current["text"] += "\n" + doc.page_content
+                current["end"] = end
+                current["relevance"] = max(current["relevance"], score)
+            else:
+                current = {"source": source, "start": start, "end": end, "text": doc.page_content, "relevance": score}
+                passages.append(current)
+
+        passages.extend(
+            {"source": source, "start": None, "end": None, "text": doc.page_content, "relevance": score}
+            for doc, score in chunks
+            if doc.metadata.get("start_index") is None
+        )
+
+    return passages
+
+
+def pack_context(docs_with_scores, token_budget, stable_order=False):
+    """Format retrieved chunks for the prompt in at most `token_budget` (estimated) tokens.
+
+    Overlapping chunks of the same article are merged into passages, passages are added in order of
+    relevance while they fit, and the first one that does not fit is cut at a word boundary. The
+    selected passages are grouped under one header per source, most relevant source first and
+    passages in article order.
+
+    With stable_order, sources are listed by URL and without their relevance scores instead, so the
+    same chunks always give a byte-identical context, whichever question retrieved them.
+
+    Returns (context, statistics). The statistics compare the packed context with formatting every chunk as-is.
+    """
+    passages = sorted(merge_passages(docs_with_scores), key=lambda passage: passage["relevance"], reverse=True)
+
+    selected = []
+    selected_sources = set()
+    remaining = token_budget
+    truncated = False
+    for passage in passages:
+        # the header of a source is only paid for once
+        header = 0 if passage["source"] in selected_sources else estimate_tokens(format_source(passage["source"], 0.0, ""))
+        cost = header + estimate_tokens(passage["text"] + PASSAGE_SEPARATOR)
+        if cost <= remaining:
+            selected.append(passage)
+            selected_sources.add(passage["source"])
+            remaining -= cost
+            continue
+
+        truncated = True
+        characters = (remaining - header) * CHARS_PER_TOKEN - len(PASSAGE_SEPARATOR)
+        if characters > 0:
+            text = passage["text"][:characters]
+            # don't end in the middle of a word
+            text = text[:text.rfind(" ")] if " " in text else text
+            selected.append({**passage, "text": text})
+        break
+
+    context = ""
+    sources = {}
+    for passage in selected:
+        sources.setdefault(passage["source"], []).append(passage)
+    for source, source_passages in sorted(sources.items(), key=lambda item: str(item[0])) if stable_order else sources.items():
+        source_passages.sort(key=lambda passage: passage["start"] if passage["start"] is not None else math.inf)
+        content = PASSAGE_SEPARATOR.join(passage["text"] for passage in source_passages)
+        relevance = None if stable_order else max(passage["relevance"] for passage in source_passages)
+        context += format_source(source, relevance, content)
+
+    unpacked_tokens = sum(estimate_tokens(format_source(doc.metadata.get("source"), score, doc.page_content)) for doc, score in docs_with_scores)
+    context_tokens = estimate_tokens(context)
+    statistics = {
+        "chunks": len(docs_with_scores),
+        "passages": len(selected),
+        "sources": len(sources),
+        "tokens": context_tokens,
+        "tokens_saved": max(unpacked_tokens - context_tokens, 0),
+        "truncated": truncated,
+    }
+    return context, statistics
@@ -0,0 +1,268 @@
+import json
+import os
+import re
+import shutil
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# separator line between articles in the custom text format
+SEPARATOR = "=" * 80
+
+# bytes read at a time when streaming a JSON array
+_READ_SIZE = 1 << 16
+
+# directory of the Parquet dataset in DATASET_STORAGE_FOLDER, next to (or instead of) data.txt
+PARQUET_DATASET = "articles"
+
+ARTICLE_SCHEMA = pa.schema([
+    ("title", pa.string()),
+    ("url", pa.string()),
+    ("keyword", pa.string()),
+    # Wikipedia revision ID of the page, None when the source doesn't have one
+    ("revision", pa.int64()),
+    ("content", pa.large_string()),
+])
+
+# the columns the ingestion needs; the other columns are never read from disk
+INGEST_COLUMNS = ["title", "url", "keyword", "content"]
+
+# one directory per keyword (keyword=<keyword>/), so a topic can be read without scanning the others
+_KEYWORD_PARTITIONING = ds.partitioning(pa.schema([("keyword", pa.string())]), flavor="hive")
+
+
+def detect_format(stream):
+    """Detect the dataset format from the first non-blank character of a seekable text stream.
+
+    Returns "custom" for the text format of the alternative scraper, "jsonl" for JSON lines and
+    "json" for a JSON array. The stream is rewound to where it was.
+    """
+    start = stream.tell()
+    first = ""
+    while True:
+        line = stream.readline()
+        if not line:
+            break
+        first = line.lstrip()
+        if first:
+            break
+    stream.seek(start)
+
+    if first.startswith("["):
+        return "json"
+    if first.startswith("{"):
+        return "jsonl"
+    if first.startswith("==="):
+        return "custom"
+    raise ValueError("Unknown dataset format")
+
+
+def parse_custom_format(stream):
+    """Yield articles one at a time from the custom text format of the alternative scraper."""
+    lines = []
+    for line in stream:
+        if line.strip() == SEPARATOR:
+            article = _parse_custom_section(lines)
+            if article:
+                yield article
+            lines = []
+        else:
+            lines.append(line)
+
+    article = _parse_custom_section(lines)
+    if article:
+        yield article
+
+
+def _parse_custom_section(lines):
+    title, keyword, url = None, "", ""
+    content_start = None
+
+    for i, line in enumerate(lines):
+        if title is None:
+            title_match = re.match(r'\s*===\s*(.+?)\s*===', line)
+            if title_match:
+                title = title_match.group(1)
+        if line.startswith("Keyword:") and not keyword:
+            keyword = line[len("Keyword:"):].strip()
+        if line.startswith("URL:"):
+            url = line[len("URL:"):].strip()
+            # the content is everything after the URL line
+            content_start = i + 1
+            break
+
+    if title is None or content_start is None:
+        return None
+
+    raw_text = "".join(lines[content_start:]).strip()
+    if not raw_text:
+        return None
+
+    return {
+        "url": url,
+        "raw_text": raw_text,
+        "title": title,
+        "keyword": keyword,
+    }
+
+
+def parse_json_format(stream, skipped=None):
+    """Yield articles one at a time from a JSON lines stream (e.g. a BrightData snapshot).
+
+    A malformed line raises, or with a `skipped` list is skipped and described in it.
+    """
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            article = json.loads(line)
+        except json.JSONDecodeError as e:
+            if skipped is None:
+                raise
+            skipped.append(f"line {number}: {e}")
+            continue
+        yield article
+
+
+def parse_json_array(stream):
+    """Yield the items of a JSON array one at a time, without loading the whole array."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    eof = False
+    started = False
+
+    while True:
+        # skip whitespace, the opening bracket and the commas between items
+        position = 0
+        while position < len(buffer) and (buffer[position].isspace() or buffer[position] == "," or (buffer[position] == "[" and not started)):
+            started = started or buffer[position] == "["
+            position += 1
+        buffer = buffer[position:]
+
+        if buffer.startswith("]"):
+            return
+
+        if buffer:
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield item
+                buffer = buffer[end:]
+                continue
+
+        if eof:
+            return
+        chunk = stream.read(_READ_SIZE)
+        eof = not chunk
+        buffer += chunk
+
+
+def write_parquet_dataset(articles, path, compression="zstd", rows_per_group=256):
+    """Write articles (dicts with the ARTICLE_SCHEMA fields) as a zstd-compressed Parquet dataset partitioned by keyword.
+
+    The dataset is written next to `path` and only replaces the previous one once it is complete.
+    """
+    table = pa.Table.from_pylist(
+        [{field: article.get(field) for field in ARTICLE_SCHEMA.names} for article in articles],
+        schema=ARTICLE_SCHEMA,
+    )
+
+    temp_path = path + ".tmp"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    ds.write_dataset(
+        table,
+        temp_path,
+        format="parquet",
+        partitioning=_KEYWORD_PARTITIONING,
+        file_options=ds.ParquetFileFormat().make_write_options(compression=compression),
+        basename_template="part-{i}.parquet",
+        # small row groups, so a reader only holds a few articles in memory at a time
+        max_rows_per_group=rows_per_group,
+        # a single thread keeps the articles in their order within each keyword
+        use_threads=False,
+    )
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(temp_path, path)
+
+
+def parse_parquet_dataset(path, columns=None, batch_size=64):
+    """Yield articles one at a time from a Parquet dataset, reading record batches of only the given columns."""
+    dataset = ds.dataset(path, format="parquet", partitioning=_KEYWORD_PARTITIONING)
+    for batch in dataset.to_batches(columns=columns, batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+def find_dataset(folder):
+    """Path of the dataset to ingest in a folder: the Parquet dataset or data.txt, whichever was written last."""
+    candidates = [os.path.join(folder, PARQUET_DATASET), os.path.join(folder, "data.txt")]
+    existing = [path for path in candidates if os.path.exists(path)]
+    if not existing:
+        # reading it fails with a clear "file not found"
+        return candidates[-1]
+    return max(existing, key=os.path.getmtime)
+
+
+def detect_dataset_format(path):
+    """Like detect_format, for a path: "parquet" for a Parquet dataset directory."""
+    if os.path.isdir(path):
+        return "parquet"
+    with open(path, encoding="utf-8") as f:
+        return detect_format(f)
+
+
+def iter_articles(file_path, columns=INGEST_COLUMNS, skipped=None):
+    """Open a dataset file (or Parquet dataset directory), detect its format and yield its articles one at a time.
+
+    Only the given columns are read from a Parquet dataset; the other formats always yield every field.
+    With a `skipped` list, records that can't be parsed or aren't objects are skipped and described in it
+    instead of raising. A file that breaks off in the middle (e.g. a truncated JSON array) still raises.
+    """
+    if os.path.isdir(file_path):
+        articles = parse_parquet_dataset(file_path, columns)
+    else:
+        articles = _iter_file_articles(file_path, skipped)
+
+    for article in articles:
+        if not isinstance(article, dict):
+            if skipped is None:
+                raise ValueError(f"Expected an article object, got {type(article).__name__}")
+            skipped.append(f"not an article object: {json.dumps(article, ensure_ascii=False)[:80]}")
+            continue
+        # data.json and the Parquet dataset of the alternative scraper store the text under "content"
+        if "raw_text" not in article and "content" in article:
+            article["raw_text"] = article.pop("content")
+        yield article
+
+
+def article_keywords(file_path):
+    """Return {url: keywords} for a dataset, every keyword an article was scraped for in the order they first appear.
+
+    The scrapers save an article once per keyword it was found for; the ingestion only ingests its first
+    copy, so it collects the keywords of every URL beforehand. Only the url and keyword columns are read from Parquet.
+    """
+    keywords = {}
+    # malformed records are skipped here and reported by the pass that ingests the articles
+    for article in iter_articles(file_path, columns=["url", "keyword"], skipped=[]):
+        url_keywords = keywords.setdefault(article.get("url"), [])
+        if article.get("keyword") and article["keyword"] not in url_keywords:
+            url_keywords.append(article["keyword"])
+    return keywords
+
+
+def _iter_file_articles(file_path, skipped=None):
+    with open(file_path, encoding="utf-8") as f:
+        file_format = detect_format(f)
+        if file_format == "jsonl":
+            # every line is a record of its own, so a malformed one can be skipped
+            yield from parse_json_format(f, skipped)
+        else:
+            parser = {
+                "custom": parse_custom_format,
+                "json": parse_json_array,
+            }[file_format]
+            yield from parser(f)
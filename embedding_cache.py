@@ -0,0 +1,220 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def normalize_text(text):
+    """Normalize text for cache keys (unicode form and whitespace), keeping its case."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def embedding_key(text, model):
+    """Cache key of a text for a given embedding model."""
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Drop-in embeddings wrapper that caches query vectors in memory (LRU) and on disk (SQLite).
+
+    Vectors are kept as float32 NumPy arrays in memory and stored as raw float32 or float16 bytes
+    on disk, so cached queries survive restarts without calling the embedding model again.
+    """
+
+    def __init__(self, embeddings, model, cache_path, max_memory_entries=1024, dtype="float32"):
+        self.embeddings = embeddings
+        self.model = model
+        self.max_memory_entries = max_memory_entries
+        self.dtype = np.dtype(dtype)
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        if os.path.dirname(cache_path):
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        self._db = sqlite3.connect(cache_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS query_embeddings (key TEXT PRIMARY KEY, dtype TEXT NOT NULL, vector BLOB NOT NULL)"
+        )
+        self._db.commit()
+
+    def embed_query(self, text):
+        key = embedding_key(text, self.model)
+
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return vector.tolist()
+
+            row = self._db.execute("SELECT dtype, vector FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                vector = np.frombuffer(row[1], dtype=row[0]).astype(np.float32)
+                self._remember(key, vector)
+                self.disk_hits += 1
+                return vector.tolist()
+
+        # call the model outside the lock, so concurrent sessions don't wait on each other
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+
+        with self._lock:
+            self.misses += 1
+            self._remember(key, vector)
+            self._db.execute(
+                "INSERT OR REPLACE INTO query_embeddings (key, dtype, vector) VALUES (?, ?, ?)",
+                (key, self.dtype.name, vector.astype(self.dtype).tobytes()),
+            )
+            self._db.commit()
+
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        # documents are embedded during ingestion and are not cached here
+        return self.embeddings.embed_documents(texts)
+
+    def stats(self):
+        """Return hit/miss counters of both cache tiers."""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+
+def chunk_key(text, model):
+    """Cache key of a chunk for a given embedding model; chunks must be byte-identical to match."""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class ChunkEmbeddingStore:
+    """Content-addressed store of chunk embeddings, keyed by (chunk text hash, embedding model).
+
+    Vectors are appended to a raw float32/float16 file per model and read back through a NumPy
+    memory map; a SQLite index maps each key to its row. Rebuilding a collection from chunks that
+    were embedded before then only costs disk reads instead of calls to the embedding model.
+    """
+
+    def __init__(self, location, model, dtype="float32"):
+        self.model = model
+        self.dtype = np.dtype(dtype)
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._map = None
+
+        os.makedirs(location, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(location, "chunks.sqlite3"), check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS chunk_embeddings (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS vector_files (model TEXT PRIMARY KEY, dtype TEXT NOT NULL, dim INTEGER NOT NULL)")
+        self._db.commit()
+
+        row = self._db.execute("SELECT dtype, dim FROM vector_files WHERE model = ?", (model,)).fetchone()
+        if row is not None:
+            # vectors already stored for this model keep their original dtype
+            self.dtype = np.dtype(row[0])
+        self.dim = row[1] if row is not None else None
+
+        model_id = hashlib.sha256(model.encode("utf-8")).hexdigest()[:16]
+        self._vectors_path = os.path.join(location, f"vectors-{model_id}.{self.dtype.name}")
+        self._rows = self._count_rows()
+
+    def get_many(self, texts):
+        """Return the stored vector of each text, or None for texts that were never embedded."""
+        keys = [chunk_key(text, self.model) for text in texts]
+
+        with self._lock:
+            found = {}
+            # stay well below SQLite's limit of variables per statement
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                found.update(self._db.execute(
+                    f"SELECT key, row FROM chunk_embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall())
+
+            vectors = self._read_rows([found.get(key) for key in keys])
+            hits = sum(vector is not None for vector in vectors)
+            self.hits += hits
+            self.misses += len(keys) - hits
+            return vectors
+
+    def put_many(self, texts, vectors):
+        """Append new vectors to the store."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            return
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._db.execute(
+                    "INSERT OR REPLACE INTO vector_files (model, dtype, dim) VALUES (?, ?, ?)",
+                    (self.model, self.dtype.name, self.dim),
+                )
+                # commit right away, the row count of the vector file depends on the dimension
+                self._db.commit()
+
+            # append the vectors first, so an index row never points past the end of the file
+            with open(self._vectors_path, "ab") as f:
+                f.write(vectors.astype(self.dtype).tobytes())
+
+            first_row = self._rows
+            self._rows += len(vectors)
+            self._db.executemany(
+                "INSERT OR REPLACE INTO chunk_embeddings (key, row) VALUES (?, ?)",
+                [(chunk_key(text, self.model), first_row + i) for i, text in enumerate(texts)],
+            )
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _count_rows(self):
+        if self.dim is None or not os.path.exists(self._vectors_path):
+            return 0
+        row_size = self.dim * self.dtype.itemsize
+        size = os.path.getsize(self._vectors_path)
+        if size % row_size:
+            # drop a partially written row left by an interrupted run
+            with open(self._vectors_path, "r+b") as f:
+                f.truncate(size - size % row_size)
+        return size // row_size
+
+    def _read_rows(self, rows):
+        wanted = [row for row in rows if row is not None]
+        if not wanted:
+            return [None] * len(rows)
+
+        # remap only when the file grew past the current memory map
+        if self._map is None or max(wanted) >= len(self._map):
+            self._map = np.memmap(self._vectors_path, dtype=self.dtype, mode="r", shape=(self._rows, self.dim))
+
+        return [None if row is None else self._map[row].astype(np.float32) for row in rows]
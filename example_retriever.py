@@ -7,6 +7,9 @@ import os
 import pandas as pd
 from langchain_chroma import Chroma
 from langchain_ollama import OllamaEmbeddings
+from embedding_cache import CachedQueryEmbeddings
+from retrieval import vector_search
+from vector_index import NumpyVectorIndex
 
 
 pd.options.mode.chained_assignment = None
@@ -19,17 +22,29 @@ embeddings = OllamaEmbeddings(
     model=os.getenv("EMBEDDING_MODEL"),
 )
 
-###############################   INITIALIZE CHROMA VECTOR STORE   #############################################################################################
-
-vector_store = Chroma(
-    collection_name=os.getenv("COLLECTION_NAME"),
-    embedding_function=embeddings,
-    persist_directory=os.getenv("DATABASE_LOCATION"), 
+# cache query vectors in memory and on disk, so repeated queries skip the embedding model
+embeddings = CachedQueryEmbeddings(
+    embeddings,
+    model=os.getenv("EMBEDDING_MODEL"),
+    cache_path=os.path.join(os.getenv("EMBEDDING_CACHE_LOCATION", "embedding_cache"), "queries.sqlite3"),
+    dtype=os.getenv("EMBEDDING_CACHE_DTYPE", "float32"),
 )
 
-results = vector_store.similarity_search_by_vector(
-    embedding=embeddings.embed_query("what is langchain"), k=5
-)
+###############################   INITIALIZE VECTOR STORE   #####################################################################################################
+
+# "numpy" searches the memory-mapped index written by the ingestion instead of Chroma
+vector_index_path = os.path.join(os.getenv("DATABASE_LOCATION"), f"{os.getenv('COLLECTION_NAME')}.vectors")
+
+if os.getenv("VECTOR_BACKEND", "chroma") == "numpy":
+    vector_store = NumpyVectorIndex.load(vector_index_path, embeddings=embeddings)
+else:
+    vector_store = Chroma(
+        collection_name=os.getenv("COLLECTION_NAME"),
+        embedding_function=embeddings,
+        persist_directory=os.getenv("DATABASE_LOCATION"), 
+    )
+
+results = vector_search(vector_store, embeddings.embed_query("what is langchain"), k=5)
 
-for doc in results:
+for doc, _ in results:
     print(f"* {doc.page_content} [{doc.metadata}]")
\ No newline at end of file
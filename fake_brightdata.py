@@ -0,0 +1,213 @@
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+_PATH_PATTERN = re.compile(r"/(trigger|progress|snapshot)(?:/([^/]+))?$")
+
+
+class FakeBrightDataServer:
+    """Local stand-in for the BrightData dataset API, to run 1_scraping_wikipedia.py without an account.
+
+    POST /trigger creates a snapshot with `pages_load` synthetic articles per keyword and returns its ID.
+    GET /progress/<ID> reports "running" for the first polls_until_ready polls of a snapshot, then "ready"
+    (or "failed" with fail=True). GET /snapshot/<ID> sends the snapshot as JSON lines and honours Range
+    requests: 206 with the rest of the snapshot, or 416 when the range starts at or past its end.
+
+    To exercise resuming, the first interrupt_downloads downloads close the connection after
+    interrupt_after_bytes; with ranges=False the Range header is ignored and the whole snapshot is sent
+    again. stall_seconds delays every snapshot download, to exercise the request timeout.
+    Requests without the api_key bearer token get a 401 (any token is accepted without api_key), unknown
+    snapshots a 404. The paths are matched at the end of the URL, so any prefix such as /datasets/v3 works.
+
+    Start it on port 0 to get a free port:
+
+        with FakeBrightDataServer(port=0) as server:
+            os.environ["BRIGHTDATA_API_URL"] = server.url
+    """
+
+    def __init__(self, host="127.0.0.1", port=8090, api_key=None, polls_until_ready=1, fail=False,
+                 interrupt_downloads=0, interrupt_after_bytes=4096, ranges=True, stall_seconds=0.0):
+        self.api_key = api_key
+        self.polls_until_ready = polls_until_ready
+        self.fail = fail
+        self.interrupt_downloads = interrupt_downloads
+        self.interrupt_after_bytes = interrupt_after_bytes
+        self.ranges = ranges
+        self.stall_seconds = stall_seconds
+
+        self.downloads = 0
+        self.range_requests = 0
+
+        # snapshot ID -> JSON lines, and the progress polls of every snapshot
+        self.snapshots = {}
+        self._polls = {}
+        self._lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def create_snapshot(self, keywords):
+        """Create a snapshot from [{"keyword": ..., "pages_load": ...}] and return its ID."""
+        lines = []
+        for item in keywords:
+            keyword = item["keyword"]
+            for i in range(int(item.get("pages_load") or 1)):
+                title = f"{keyword} article {i}"
+                lines.append(json.dumps({
+                    "url": f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}",
+                    "title": title,
+                    "keyword": keyword,
+                    "raw_text": f"{title} is one of the synthetic articles about {keyword}. " * 40,
+                }, ensure_ascii=False))
+
+        with self._lock:
+            snapshot_id = f"s_fake{len(self.snapshots) + 1:04d}"
+            self.snapshots[snapshot_id] = ("\n".join(lines) + "\n").encode("utf-8")
+            self._polls[snapshot_id] = 0
+        return snapshot_id
+
+    def progress(self, snapshot_id):
+        """Status of a snapshot for one more progress poll."""
+        with self._lock:
+            self._polls[snapshot_id] += 1
+            if self._polls[snapshot_id] <= self.polls_until_ready:
+                return "running"
+        return "failed" if self.fail else "ready"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"[]")
+                match = self._route()
+                if match is None:
+                    return
+                if match.group(1) != "trigger":
+                    self._send_json({"error": "not found"}, status=404)
+                    return
+                self._send_json({"snapshot_id": server.create_snapshot(body)})
+
+            def do_GET(self):
+                match = self._route()
+                if match is None:
+                    return
+                endpoint, snapshot_id = match.groups()
+                if endpoint == "trigger" or snapshot_id not in server.snapshots:
+                    self._send_json({"error": "snapshot not found"}, status=404)
+                    return
+
+                if endpoint == "progress":
+                    self._send_json({"snapshot_id": snapshot_id, "status": server.progress(snapshot_id)})
+                else:
+                    time.sleep(server.stall_seconds)
+                    self._send_snapshot(server.snapshots[snapshot_id])
+
+            def _route(self):
+                """Match the request path, or answer 401/404 and return None."""
+                if server.api_key is not None and self.headers.get("Authorization") != f"Bearer {server.api_key}":
+                    self._send_json({"error": "invalid API key"}, status=401)
+                    return None
+                match = _PATH_PATTERN.search(urlparse(self.path).path)
+                if match is None:
+                    self._send_json({"error": "not found"}, status=404)
+                return match
+
+            def _send_snapshot(self, data):
+                with server._lock:
+                    server.downloads += 1
+                    interrupt = server.downloads <= server.interrupt_downloads
+
+                start = 0
+                range_match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+                if range_match and server.ranges:
+                    server.range_requests += 1
+                    start = int(range_match.group(1))
+                    if start >= len(data):
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{len(data)}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+
+                self.send_response(206 if start else 200)
+                self.send_header("Content-Type", "application/jsonl")
+                self.send_header("Content-Length", str(len(data) - start))
+                if start:
+                    self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+                self.end_headers()
+
+                if interrupt:
+                    # the connection drops in the middle of the body
+                    self.wfile.write(data[start:start + server.interrupt_after_bytes])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.wfile.write(data[start:])
+
+            def _send_json(self, data, status=200):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def server_from_env(port=None):
+    """Create a FakeBrightDataServer configured with the FAKE_BRIGHTDATA_* environment variables."""
+    return FakeBrightDataServer(
+        port=int(os.getenv("FAKE_BRIGHTDATA_PORT", "8090")) if port is None else port,
+        api_key=os.getenv("BRIGHTDATA_API_KEY"),
+        polls_until_ready=int(os.getenv("FAKE_BRIGHTDATA_POLLS_UNTIL_READY", "1")),
+        fail=os.getenv("FAKE_BRIGHTDATA_FAIL", "false").lower() == "true",
+        interrupt_downloads=int(os.getenv("FAKE_BRIGHTDATA_INTERRUPT_DOWNLOADS", "0")),
+        interrupt_after_bytes=int(os.getenv("FAKE_BRIGHTDATA_INTERRUPT_AFTER_BYTES", "4096")),
+        ranges=os.getenv("FAKE_BRIGHTDATA_RANGES", "true").lower() == "true",
+        stall_seconds=float(os.getenv("FAKE_BRIGHTDATA_STALL_SECONDS", "0")),
+    )
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    fake_server = server_from_env()
+    print(f"Fake BrightData server listening on {fake_server.url} (Ctrl+C to stop)")
+    try:
+        fake_server.start()._thread.join()
+    except KeyboardInterrupt:
+        fake_server.stop()
@@ -0,0 +1,257 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def fake_embedding(text, dim):
+    """Deterministic unit vector hashed from the words of a text, so similar texts get similar vectors."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in _WORD_PATTERN.findall(text.lower()):
+        vector[int.from_bytes(hashlib.md5(word.encode("utf-8")).digest()[:8], "little") % dim] += 1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm > 0 else vector).tolist()
+
+
+class FakeOllamaServer:
+    """Local stand-in for the Ollama HTTP API, to measure the pipeline without real models.
+
+    Serves /api/embed, /api/chat, /api/generate and /api/tags. Embedding requests take
+    embed_latency_ms, chat requests wait ttft_ms before the first token and then stream
+    answer_tokens tokens at tokens_per_second.
+
+    Prompt evaluation (prefill) takes prefill_ms_per_token for every prompt token (4 characters) that
+    is not in the KV cache. Like Ollama, the cache holds the last prompt of each model: the part a new
+    prompt shares with it from the start is not evaluated again. It is dropped when a request has
+    keep_alive 0 (the model is unloaded) or another num_ctx (the model is reloaded).
+
+    A model is loaded (listed by /api/ps) from its first request until a request with keep_alive 0, and
+    reloaded by a request with another num_ctx; model_loads counts the loads of every model.
+    model_speeds makes some models faster, e.g. {"llama3.2:1b": 3} divides the time to first token and
+    prefill by 3 and streams 3 times as many tokens per second. Requests for missing_models fail with a
+    404, like models that are not pulled.
+
+    Start it on port 0 to get a free port:
+
+        with FakeOllamaServer(port=0) as server:
+            os.environ["OLLAMA_HOST"] = server.url
+    """
+
+    def __init__(self, host="127.0.0.1", port=11434, dim=768, embed_latency_ms=0.0, ttft_ms=0.0,
+                 tokens_per_second=50.0, answer_tokens=50, prefill_ms_per_token=0.0, model_speeds=None, missing_models=()):
+        self.dim = dim
+        self.embed_latency_ms = embed_latency_ms
+        self.ttft_ms = ttft_ms
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.prefill_ms_per_token = prefill_ms_per_token
+        self.model_speeds = model_speeds or {}
+        self.missing_models = set(missing_models)
+
+        self.embed_requests = 0
+        self.chat_requests = 0
+        self.loaded_models = set()
+        # model -> times it was loaded, and the num_ctx it is loaded with
+        self.model_loads = {}
+        self._loaded_num_ctx = {}
+        # prompt tokens evaluated, and prompt tokens reused from the KV cache
+        self.prompt_tokens_evaluated = 0
+        self.prompt_tokens_cached = 0
+
+        # model -> (last prompt, num_ctx it was evaluated with)
+        self._kv_cache = {}
+        self._kv_cache_lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def load_model(self, model, num_ctx=None):
+        """Mark a model as loaded, counting a load when it wasn't loaded or was loaded with another num_ctx."""
+        with self._kv_cache_lock:
+            if model not in self.loaded_models or self._loaded_num_ctx.get(model) != num_ctx:
+                self.model_loads[model] = self.model_loads.get(model, 0) + 1
+            self.loaded_models.add(model)
+            self._loaded_num_ctx[model] = num_ctx
+
+    def evaluate_prompt(self, model, prompt, num_ctx=None, keep_alive=None):
+        """Return (prompt tokens evaluated, prompt tokens reused from the KV cache) for a request, and update the cache."""
+        with self._kv_cache_lock:
+            cached_prompt, cached_num_ctx = self._kv_cache.get(model, ("", None))
+            cached_characters = len(os.path.commonprefix([cached_prompt, prompt])) if cached_num_ctx == num_ctx else 0
+            if keep_alive in (0, "0", "0s"):
+                self._kv_cache.pop(model, None)
+            else:
+                self._kv_cache[model] = (prompt, num_ctx)
+
+            prompt_tokens = -(-len(prompt) // 4)
+            # the last prompt token is always evaluated, to produce the first answer token
+            cached_tokens = min(cached_characters // 4, prompt_tokens - 1) if prompt_tokens else 0
+            self.prompt_tokens_evaluated += prompt_tokens - cached_tokens
+            self.prompt_tokens_cached += cached_tokens
+            return prompt_tokens - cached_tokens, cached_tokens
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately, Nagle's algorithm would delay every response by ~40ms
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._send_json({"models": []})
+                elif self.path == "/api/ps":
+                    self._send_json({"models": [{"name": model, "model": model} for model in sorted(server.loaded_models)]})
+                else:
+                    self._send_json({"error": "not found"}, status=404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+
+                if request.get("model") in server.missing_models:
+                    self._send_json({"error": f"model '{request['model']}' not found"}, status=404)
+                    return
+                if request.get("keep_alive") in (0, "0", "0s"):
+                    server.loaded_models.discard(request.get("model"))
+                elif request.get("model"):
+                    server.load_model(request["model"], (request.get("options") or {}).get("num_ctx"))
+
+                if self.path == "/api/embed":
+                    server.embed_requests += 1
+                    texts = [request["input"]] if isinstance(request["input"], str) else request["input"]
+                    time.sleep(server.embed_latency_ms / 1000)
+                    self._send_json({"model": request["model"], "embeddings": [fake_embedding(text, server.dim) for text in texts]})
+                elif self.path in ("/api/chat", "/api/generate"):
+                    server.chat_requests += 1
+                    self._send_answer(request, chat=self.path == "/api/chat")
+                else:
+                    self._send_json({"error": "not found"}, status=404)
+
+            def _send_json(self, data, status=200):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_answer(self, request, chat):
+                options = request.get("options") or {}
+                num_predict = options.get("num_predict")
+                token_count = min(server.answer_tokens, num_predict) if num_predict else server.answer_tokens
+                tokens = [f" token{i}" for i in range(token_count)]
+
+                # the prompt as the model sees it, roughly like a chat template renders the messages
+                if chat:
+                    prompt = "".join(f"<|{message['role']}|>\n{message.get('content', '')}\n" for message in request.get("messages", []))
+                else:
+                    prompt = request.get("system", "") + request.get("prompt", "")
+                evaluated_tokens, _ = server.evaluate_prompt(request["model"], prompt, options.get("num_ctx"), request.get("keep_alive"))
+                speed = server.model_speeds.get(request["model"], 1.0)
+                prefill_seconds = evaluated_tokens * server.prefill_ms_per_token / 1000 / speed
+
+                def message(content, done):
+                    data = {"model": request["model"], "created_at": "1970-01-01T00:00:00Z", "done": done}
+                    if chat:
+                        data["message"] = {"role": "assistant", "content": content}
+                    else:
+                        data["response"] = content
+                    if done:
+                        data.update(
+                            done_reason="stop",
+                            eval_count=token_count,
+                            prompt_eval_count=evaluated_tokens,
+                            prompt_eval_duration=int(prefill_seconds * 1e9),
+                            load_duration=0,
+                        )
+                    return data
+
+                # the prompt is "evaluated" before the first token
+                time.sleep(server.ttft_ms / 1000 / speed + prefill_seconds)
+
+                if not request.get("stream", True):
+                    time.sleep(token_count / server.tokens_per_second / speed)
+                    self._send_json(message("".join(tokens), done=True))
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for i, token in enumerate(tokens):
+                    if i:
+                        time.sleep(1 / server.tokens_per_second / speed)
+                    self._write_chunk(message(token, done=False))
+                self._write_chunk(message("", done=True))
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _write_chunk(self, data):
+                line = (json.dumps(data) + "\n").encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+
+        return Handler
+
+
+def server_from_env(port=None):
+    """Create a FakeOllamaServer configured with the FAKE_OLLAMA_* environment variables."""
+    return FakeOllamaServer(
+        port=int(os.getenv("FAKE_OLLAMA_PORT", "11434")) if port is None else port,
+        dim=int(os.getenv("FAKE_OLLAMA_DIM", "768")),
+        embed_latency_ms=float(os.getenv("FAKE_OLLAMA_EMBED_LATENCY_MS", "5")),
+        ttft_ms=float(os.getenv("FAKE_OLLAMA_TTFT_MS", "200")),
+        tokens_per_second=float(os.getenv("FAKE_OLLAMA_TOKENS_PER_SECOND", "50")),
+        answer_tokens=int(os.getenv("FAKE_OLLAMA_ANSWER_TOKENS", "50")),
+        prefill_ms_per_token=float(os.getenv("FAKE_OLLAMA_PREFILL_MS_PER_TOKEN", "0.5")),
+        # "model=speed,model=speed", e.g. "llama3.2:1b=3"
+        model_speeds={
+            model.strip(): float(speed)
+            for model, speed in (item.rsplit("=", 1) for item in os.getenv("FAKE_OLLAMA_MODEL_SPEEDS", "").split(",") if item.strip())
+        },
+        missing_models=[model.strip() for model in os.getenv("FAKE_OLLAMA_MISSING_MODELS", "").split(",") if model.strip()],
+    )
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    fake_server = server_from_env()
+    print(f"Fake Ollama server listening on {fake_server.url} (Ctrl+C to stop)")
+    try:
+        fake_server.start()._thread.join()
+    except KeyboardInterrupt:
+        fake_server.stop()
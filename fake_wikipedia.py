@@ -0,0 +1,172 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeWikipediaServer:
+    """Local stand-in for the MediaWiki API the alternative scraper uses, to scrape without hitting Wikipedia.
+
+    Answers the two queries of WikipediaClient: a search (generator=search) returning `gsrlimit` synthetic
+    titles with their revision IDs, and a page query (titles=...) returning the plain-text extract and
+    revision ID of a title. Every response takes latency_ms.
+
+    To exercise the retries, every throttle_every-th request gets a 429 with Retry-After: 0 and every
+    fail_every-th a 503; titles in fail_titles always get a 503. revise(title) bumps the revision of a page,
+    like an edit on Wikipedia.
+
+    requests counts the requests served, max_concurrent the most requests in flight at once and
+    request_times their arrival times (time.monotonic()), to check the client's concurrency and rate limits.
+
+    Start it on port 0 to get a free port:
+
+        with FakeWikipediaServer(port=0) as server:
+            os.environ["WIKIPEDIA_API_URL"] = server.url
+    """
+
+    def __init__(self, host="127.0.0.1", port=8091, latency_ms=0.0, throttle_every=0, fail_every=0, fail_titles=()):
+        self.latency_ms = latency_ms
+        self.throttle_every = throttle_every
+        self.fail_every = fail_every
+        self.fail_titles = set(fail_titles)
+
+        self.requests = 0
+        self.throttled = 0
+        self.failed = 0
+        self.max_concurrent = 0
+        self.request_times = []
+
+        # title -> revision ID, 1 until revised
+        self.revisions = {}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def revise(self, title):
+        """Bump the revision of a page, so the scraper sees it changed."""
+        with self._lock:
+            self.revisions[title] = self.revisions.get(title, 1) + 1
+
+    def peak_requests_per_second(self):
+        """Most requests that arrived within any one second."""
+        times = sorted(self.request_times)
+        peak, start = 0, 0
+        for end in range(len(times)):
+            while times[end] - times[start] >= 1.0:
+                start += 1
+            peak = max(peak, end - start + 1)
+        return peak
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _page(self, title, index=None, extract=False):
+        page = {"pageid": abs(hash(title)) % 10 ** 8, "ns": 0, "title": title, "revisions": [{"revid": self.revisions.get(title, 1)}]}
+        if index is not None:
+            page["index"] = index
+        if extract:
+            page["extract"] = f"{title} is a synthetic article served by the fake Wikipedia API. " * 40
+        return page
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                    number = server.requests
+                    server.request_times.append(time.monotonic())
+                    server._in_flight += 1
+                    server.max_concurrent = max(server.max_concurrent, server._in_flight)
+                try:
+                    time.sleep(server.latency_ms / 1000)
+                    self._answer(number, {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()})
+                finally:
+                    with server._lock:
+                        server._in_flight -= 1
+
+            def _answer(self, number, params):
+                if server.throttle_every and number % server.throttle_every == 0:
+                    server.throttled += 1
+                    self._send_json({"error": {"code": "ratelimited"}}, status=429, headers={"Retry-After": "0"})
+                    return
+                if (server.fail_every and number % server.fail_every == 0) or params.get("titles") in server.fail_titles:
+                    server.failed += 1
+                    self._send_json({"error": {"code": "internal_api_error"}}, status=503)
+                    return
+
+                if params.get("generator") == "search":
+                    keyword = params.get("gsrsearch", "")
+                    pages = [server._page(f"{keyword} {i}", index=i + 1) for i in range(int(params.get("gsrlimit", 10)))]
+                elif "titles" in params:
+                    pages = [server._page(params["titles"], extract="extracts" in params.get("prop", ""))]
+                else:
+                    self._send_json({"error": {"code": "badquery"}}, status=400)
+                    return
+                self._send_json({"batchcomplete": True, "query": {"pages": pages}})
+
+            def _send_json(self, data, status=200, headers=None):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def server_from_env(port=None):
+    """Create a FakeWikipediaServer configured with the FAKE_WIKIPEDIA_* environment variables."""
+    return FakeWikipediaServer(
+        port=int(os.getenv("FAKE_WIKIPEDIA_PORT", "8091")) if port is None else port,
+        latency_ms=float(os.getenv("FAKE_WIKIPEDIA_LATENCY_MS", "20")),
+        throttle_every=int(os.getenv("FAKE_WIKIPEDIA_THROTTLE_EVERY", "0")),
+        fail_every=int(os.getenv("FAKE_WIKIPEDIA_FAIL_EVERY", "0")),
+        # "title,title", pages that always fail
+        fail_titles=[title.strip() for title in os.getenv("FAKE_WIKIPEDIA_FAIL_TITLES", "").split(",") if title.strip()],
+    )
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    fake_server = server_from_env()
+    print(f"Fake Wikipedia API listening on {fake_server.url} (Ctrl+C to stop)")
+    try:
+        fake_server.start()._thread.join()
+    except KeyboardInterrupt:
+        fake_server.stop()
+        print(f"{fake_server.requests} requests ({fake_server.throttled} throttled, {fake_server.failed} failed), "
+              f"at most {fake_server.max_concurrent} at once and {fake_server.peak_requests_per_second()} in one second")
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from telemetry import stage
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def article_hash(article):
+    """Hash of everything in an article that ends up in the collection."""
+    return _sha256(json.dumps([article["url"], article["title"], article["raw_text"], article.get("keywords") or None], ensure_ascii=False))
+
+
+def chunk_ids(source, texts):
+    """Deterministic chunk IDs derived from the source URL and the chunk content.
+
+    Re-ingesting the same chunk always produces the same ID, so upserts replace it instead of
+    duplicating it. Repeated chunks within one article get an occurrence counter.
+    """
+    ids = []
+    seen = {}
+    for text in texts:
+        content_hash = _sha256(text)
+        occurrence = seen.get(content_hash, 0)
+        seen[content_hash] = occurrence + 1
+        ids.append(_sha256(f"{source}\0{content_hash}\0{occurrence}")[:32])
+    return ids
+
+
+class IngestManifest:
+    """Per-article content hashes and chunk IDs of everything ingested into a collection.
+
+    The manifest lets a re-ingestion skip unchanged articles, replace the chunks of changed ones and
+    delete the chunks of articles that are no longer in the dataset.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.settings = {}
+        self.articles = {}
+
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.settings = data.get("settings", {})
+            self.articles = data.get("articles", {})
+
+    def clear(self, settings):
+        self.settings = settings
+        self.articles = {}
+
+    def is_unchanged(self, source, content_hash):
+        return self.articles.get(source, {}).get("hash") == content_hash
+
+    def chunk_ids(self, source):
+        return self.articles.get(source, {}).get("chunk_ids", [])
+
+    def update(self, source, content_hash, ids):
+        self.articles[source] = {"hash": content_hash, "chunk_ids": ids}
+
+    def remove(self, source):
+        return self.articles.pop(source, {}).get("chunk_ids", [])
+
+    def save(self):
+        """Write the manifest atomically, so an interrupted run never leaves a broken file."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"settings": self.settings, "articles": self.articles}, f)
+        os.replace(temp_path, self.path)
+
+
+class IngestionEngine:
+    """Embed chunks in fixed-size batches on a pool of workers and write them to Chroma in bulk.
+
+    Chunks from all articles are collected into batches of `batch_size` texts, embedded with at
+    most `workers` concurrent requests to the embedding model and upserted into the collection
+    `write_batch_size` chunks at a time. Chunks found in the `embedding_store` skip the model.
+    """
+
+    def __init__(self, embeddings, vector_store, batch_size=64, workers=4, write_batch_size=1024, embedding_store=None):
+        self.embeddings = embeddings
+        self.vector_store = vector_store
+        # optional ChunkEmbeddingStore consulted before calling the embedding model
+        self.embedding_store = embedding_store
+        self.batch_size = batch_size
+        self.workers = workers
+        # Chroma rejects writes above its maximum batch size
+        self.write_batch_size = min(write_batch_size, vector_store._client.get_max_batch_size())
+
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._pending = []
+        self._in_flight = set()
+        self._to_write = []
+
+        self.chunks_written = 0
+        self.embed_time = 0.0
+        self.write_time = 0.0
+        self._started_at = time.perf_counter()
+
+    def add_documents(self, documents, ids):
+        """Queue chunks (Documents or offset-based Chunks) for embedding; full batches are sent to the workers right away."""
+        for chunk_id, document in zip(ids, documents):
+            self._pending.append((chunk_id, document))
+            if len(self._pending) >= self.batch_size:
+                self._submit_pending()
+
+    def delete(self, ids):
+        """Delete chunks from the collection, in batches Chroma accepts."""
+        for start in range(0, len(ids), self.write_batch_size):
+            self.vector_store.delete(ids=ids[start:start + self.write_batch_size])
+
+    def finish(self):
+        """Embed and write everything still queued, then return the ingestion statistics."""
+        if self._pending:
+            self._submit_pending()
+        while self._in_flight:
+            self._collect(block=True)
+        if self._to_write:
+            self._write()
+        self._executor.shutdown()
+        return self.stats()
+
+    def stats(self):
+        elapsed = time.perf_counter() - self._started_at
+        return {
+            "chunks": self.chunks_written,
+            "seconds": elapsed,
+            "chunks_per_second": self.chunks_written / elapsed if elapsed > 0 else 0.0,
+            # time spent inside embedding requests, summed over all workers
+            "embed_seconds": self.embed_time,
+            "write_seconds": self.write_time,
+            "embedding_cache": self.embedding_store.stats() if self.embedding_store is not None else None,
+        }
+
+    def _submit_pending(self):
+        batch, self._pending = self._pending, []
+
+        # keep a bounded number of batches in flight, so memory stays flat on large corpora
+        while len(self._in_flight) >= self.workers * 2:
+            self._collect(block=True)
+
+        self._in_flight.add(self._executor.submit(self._embed_batch, batch))
+        self._collect(block=False)
+
+    def _embed_batch(self, batch):
+        started_at = time.perf_counter()
+        texts = [document.page_content for _, document in batch]
+
+        with stage("embed", pipeline="ingestion", chunks=len(texts)):
+            if self.embedding_store is None:
+                vectors = self.embeddings.embed_documents(texts)
+            else:
+                # only send chunks the store has never seen to the embedding model
+                vectors = self.embedding_store.get_many(texts)
+                missing = [i for i, vector in enumerate(vectors) if vector is None]
+                if missing:
+                    new_vectors = self.embeddings.embed_documents([texts[i] for i in missing])
+                    self.embedding_store.put_many([texts[i] for i in missing], new_vectors)
+                    for i, vector in zip(missing, new_vectors):
+                        vectors[i] = vector
+                vectors = [list(map(float, vector)) for vector in vectors]
+
+        return batch, vectors, time.perf_counter() - started_at
+
+    def _collect(self, block):
+        done, _ = wait(self._in_flight, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            self._in_flight.remove(future)
+            batch, vectors, seconds = future.result()
+            self.embed_time += seconds
+            self._to_write.extend(
+                (chunk_id, document, vector) for (chunk_id, document), vector in zip(batch, vectors)
+            )
+
+        while len(self._to_write) >= self.write_batch_size:
+            self._write()
+
+    def _write(self):
+        rows, self._to_write = self._to_write[:self.write_batch_size], self._to_write[self.write_batch_size:]
+
+        started_at = time.perf_counter()
+        # the embeddings are already computed, so write straight to the collection instead of add_documents
+        with stage("write", pipeline="ingestion", chunks=len(rows)):
+            self.vector_store._collection.upsert(
+                ids=[chunk_id for chunk_id, _, _ in rows],
+                embeddings=[vector for _, _, vector in rows],
+                metadatas=[document.metadata for _, document, _ in rows],
+                documents=[document.page_content for _, document, _ in rows],
+            )
+        self.write_time += time.perf_counter() - started_at
+        self.chunks_written += len(rows)
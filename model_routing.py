@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from context_packing import estimate_tokens
+
+FAST_ROUTE = "fast"
+FULL_ROUTE = "full"
+
+
+def ollama_model_name(model):
+    """Name of a model as Ollama lists it: models without a tag are the "latest" tag."""
+    return model if ":" in model else f"{model}:latest"
+
+
+class ModelRouter:
+    """Choose between a fast (small or quantized) chat model and the full chat model for every answer.
+
+    General knowledge answers go to the fast model. RAG answers go to the full model, unless the question
+    is short, its best chunk is very relevant and the context is small, or the full model is not expected
+    to start answering within the latency budget. A model Ollama has not loaded is avoided while the other
+    one is loaded, since loading it costs more than any difference between the models.
+
+    The latency of every answer is recorded per route, and the recent median time to first token of the
+    full model is what the latency budget is checked against. Every `probe_every`th answer over the budget
+    still goes to the full model, so its median keeps following the model's current latency instead of
+    staying at the value that put it over the budget.
+    """
+
+    def __init__(self, models, max_query_words=12, min_relevance=0.6, max_context_tokens=400, latency_budget_ms=None,
+                 loaded_models=None, loaded_models_ttl=5.0, window=200, probe_every=10):
+        # route -> model name
+        self.models = models
+        self.max_query_words = max_query_words
+        self.min_relevance = min_relevance
+        self.max_context_tokens = max_context_tokens
+        self.latency_budget_ms = latency_budget_ms
+        self.probe_every = probe_every
+        # callable returning the names of the models Ollama has loaded, or None when it can't tell
+        self._loaded_models = loaded_models
+        self.loaded_models_ttl = loaded_models_ttl
+        self._loaded = (None, None)
+
+        self._lock = threading.Lock()
+        # seconds to the first token and to the whole answer of the last `window` answers of each route
+        self._first_token = {route: deque(maxlen=window) for route in models}
+        self._answer = {route: deque(maxlen=window) for route in models}
+        self._reasons = {route: {} for route in models}
+        # answers of each route served again from the answer cache
+        self._cached = {route: 0 for route in models}
+        self.fallbacks = 0
+        # answers the full model was expected to start too late for
+        self._over_budget = 0
+
+    def choose(self, question, relevant_docs, context="", elapsed_seconds=0.0):
+        """Return (route, reason) for an answer; relevant_docs are (doc, relevance) pairs, empty for general knowledge.
+
+        elapsed_seconds is the time the question has already spent in the pipeline (embedding, retrieval, ...).
+        """
+        if not relevant_docs:
+            route, reason = FAST_ROUTE, "general"
+        elif (
+            len(question.split()) <= self.max_query_words
+            and max(score for _, score in relevant_docs) >= self.min_relevance
+            and estimate_tokens(context) <= self.max_context_tokens
+        ):
+            route, reason = FAST_ROUTE, "short_answer"
+        else:
+            route, reason = FULL_ROUTE, "context"
+            expected = self.expected_first_token(FULL_ROUTE)
+            if self.latency_budget_ms is not None and expected is not None and (elapsed_seconds + expected) * 1000 > self.latency_budget_ms:
+                with self._lock:
+                    self._over_budget += 1
+                    probe = self.probe_every > 0 and self._over_budget % self.probe_every == 0
+                route, reason = (FULL_ROUTE, "latency_probe") if probe else (FAST_ROUTE, "latency_budget")
+
+        other = FULL_ROUTE if route == FAST_ROUTE else FAST_ROUTE
+        loaded = self.loaded_models()
+        if loaded is not None and ollama_model_name(self.models[route]) not in loaded and ollama_model_name(self.models[other]) in loaded:
+            route, reason = other, "not_loaded"
+        return route, reason
+
+    def loaded_models(self):
+        """Names of the models Ollama has loaded, refreshed at most every loaded_models_ttl seconds, or None when unknown."""
+        if self._loaded_models is None:
+            return None
+        checked_at, loaded = self._loaded
+        if checked_at is None or time.monotonic() - checked_at > self.loaded_models_ttl:
+            try:
+                loaded = {ollama_model_name(model) for model in self._loaded_models()}
+            except Exception:
+                # Ollama is unreachable; the request itself will fail or fall back
+                loaded = None
+            self._loaded = (time.monotonic(), loaded)
+        return loaded
+
+    def expected_first_token(self, route):
+        """Median seconds to the first token of the recent answers of a route, or None before its first answer."""
+        with self._lock:
+            samples = list(self._first_token[route])
+        return float(np.median(samples)) if samples else None
+
+    def record(self, route, reason, first_token_seconds, answer_seconds):
+        """Record the latency of an answer generated on a route, and why it was routed there."""
+        with self._lock:
+            self._reasons[route][reason] = self._reasons[route].get(reason, 0) + 1
+            self._first_token[route].append(first_token_seconds)
+            self._answer[route].append(answer_seconds)
+
+    def record_cached(self, model):
+        """Count an answer of a model that was served from the answer cache instead of being generated again."""
+        with self._lock:
+            for route, route_model in self.models.items():
+                if route_model == model:
+                    self._cached[route] += 1
+                    return
+
+    def record_fallback(self):
+        """Count an answer moved from the fast to the full model because the fast model failed (e.g. it is not pulled)."""
+        with self._lock:
+            self.fallbacks += 1
+
+    def stats(self):
+        """Answers per route and reason, and the recent latency percentiles of each route in milliseconds."""
+        with self._lock:
+            routes = {}
+            for route, model in self.models.items():
+                routes[route] = {"model": model, "answers": sum(self._reasons[route].values()), "reasons": dict(self._reasons[route]),
+                                  "cached_answers": self._cached[route]}
+                for name, samples in (("first_token", self._first_token[route]), ("answer", self._answer[route])):
+                    if samples:
+                        routes[route][f"{name}_p50_ms"] = round(float(np.percentile(samples, 50)) * 1000, 1)
+                        routes[route][f"{name}_p95_ms"] = round(float(np.percentile(samples, 95)) * 1000, 1)
+            return {"routes": routes, "fallbacks": self.fallbacks}
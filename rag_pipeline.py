@@ -0,0 +1,545 @@
+import os
+import threading
+import time
+
+import ollama
+from dotenv import load_dotenv
+from langchain.chat_models import init_chat_model
+from langchain_chroma import Chroma
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_ollama import OllamaEmbeddings
+
+from bm25_index import BM25Index
+from collection_state import read_collection_version
+from context_packing import format_source, pack_context
+from embedding_cache import CachedQueryEmbeddings, normalize_text
+from model_routing import FAST_ROUTE, FULL_ROUTE, ModelRouter
+from retrieval import HybridRetriever, MMRRetriever, vector_search
+from telemetry import record_stage, stage
+from topics import TopicRouter, TopicShards
+from vector_index import NumpyVectorIndex
+
+# The retrieval and generation pipeline shared by the Streamlit chatbot (3_chatbot.py) and the HTTP API (api_server.py).
+
+load_dotenv()
+
+DATABASE_LOCATION = os.getenv("DATABASE_LOCATION")
+COLLECTION_NAME = os.getenv("COLLECTION_NAME")
+
+# seconds Ollama keeps the models loaded after a request (-1 keeps them loaded forever)
+OLLAMA_KEEP_ALIVE = int(os.getenv("OLLAMA_KEEP_ALIVE")) if os.getenv("OLLAMA_KEEP_ALIVE") else None
+# context window of the chat model; keep it fixed, Ollama reloads the model (and drops its KV cache) when it changes
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX")) if os.getenv("OLLAMA_NUM_CTX") else None
+
+# "cached" sends a fixed system message, then the context, then the question, so every prompt starts with the same
+# bytes and Ollama reuses the KV cache of that prefix instead of evaluating it again; "legacy" uses the older templates
+PROMPT_LAYOUT = os.getenv("PROMPT_LAYOUT", "cached")
+
+# query embeddings are cached in memory and on disk, so repeated questions skip the embedding model
+QUERY_EMBEDDING_CACHE = os.getenv("QUERY_EMBEDDING_CACHE", "true").lower() == "true"
+
+# identical questions in flight at the same time share one answer instead of each running the whole pipeline
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() == "true"
+
+# "numpy" searches the memory-mapped index written by the ingestion instead of Chroma, without opening Chroma at all
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+VECTOR_INDEX_PATH = os.path.join(DATABASE_LOCATION, f"{COLLECTION_NAME}.vectors")
+
+# number of chunks retrieved per question
+RETRIEVER_K = int(os.getenv("RETRIEVER_K", "2"))
+
+# minimum relevance score (0 to 1) a chunk needs for the question to be answered from the knowledge base
+RELEVANCE_THRESHOLD = float(os.getenv("RELEVANCE_THRESHOLD", "0.3"))
+
+# fuse BM25 and vector results when the ingestion has built a BM25 index
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "true").lower() == "true"
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "10"))
+BM25_INDEX_PATH = os.path.join(DATABASE_LOCATION, f"{COLLECTION_NAME}.bm25")
+
+# merge overlapping chunks of the same article and keep the context within this many (estimated) tokens
+CONTEXT_PACKING = os.getenv("CONTEXT_PACKING", "true").lower() == "true"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+
+# restrict retrieval to the topics (scraping keywords) whose centroid is closest to the question: the best topic,
+# plus up to TOPIC_ROUTING_MAX_TOPICS - 1 more within TOPIC_ROUTING_MARGIN of its cosine similarity
+TOPIC_ROUTING = os.getenv("TOPIC_ROUTING", "false").lower() == "true"
+TOPIC_ROUTING_MAX_TOPICS = int(os.getenv("TOPIC_ROUTING_MAX_TOPICS", "2"))
+TOPIC_ROUTING_MARGIN = float(os.getenv("TOPIC_ROUTING_MARGIN", "0.05"))
+TOPIC_ROUTER_PATH = os.path.join(DATABASE_LOCATION, f"{COLLECTION_NAME}.topics")
+
+# rerank a wider candidate pool with maximal marginal relevance, so the final chunks are not near-duplicates
+MMR_RERANK = os.getenv("MMR_RERANK", "true").lower() == "true"
+MMR_FETCH_K = int(os.getenv("MMR_FETCH_K", "20"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# reranking is skipped when fetching the candidates alone took longer than this
+MMR_LATENCY_BUDGET_MS = float(os.getenv("MMR_LATENCY_BUDGET_MS", "200"))
+
+# answer general knowledge and short questions with FAST_CHAT_MODEL (a small or quantized model) and keep CHAT_MODEL
+# for RAG answers over a larger context; a RAG answer also goes to the fast model when a question is at most
+# MODEL_ROUTING_MAX_QUERY_WORDS words, its best chunk has a relevance of at least MODEL_ROUTING_MIN_RELEVANCE and its
+# context is at most MODEL_ROUTING_MAX_CONTEXT_TOKENS (estimated) tokens
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "false").lower() == "true"
+FAST_CHAT_MODEL = os.getenv("FAST_CHAT_MODEL")
+MODEL_ROUTING_MAX_QUERY_WORDS = int(os.getenv("MODEL_ROUTING_MAX_QUERY_WORDS", "12"))
+MODEL_ROUTING_MIN_RELEVANCE = float(os.getenv("MODEL_ROUTING_MIN_RELEVANCE", "0.6"))
+MODEL_ROUTING_MAX_CONTEXT_TOKENS = int(os.getenv("MODEL_ROUTING_MAX_CONTEXT_TOKENS", "400"))
+# the fast model also answers when the time already spent on a question plus the recent median time to first token
+# of the full model would exceed this
+MODEL_ROUTING_LATENCY_BUDGET_MS = float(os.getenv("MODEL_ROUTING_LATENCY_BUDGET_MS", "3000"))
+# every this many answers over the budget, the full model answers anyway, so its latency is measured again
+MODEL_ROUTING_PROBE_EVERY = int(os.getenv("MODEL_ROUTING_PROBE_EVERY", "10"))
+
+
+###############################   PROMPTS   ####################################################################################################################
+
+def format_docs(docs_with_scores, stable_order=False):
+    """Format retrieved documents and their relevance scores for the prompt.
+
+    With stable_order, the documents are listed by source and offset and without their scores, like pack_context does.
+    """
+    if stable_order:
+        docs_with_scores = sorted(docs_with_scores, key=lambda item: (str(item[0].metadata["source"]), item[0].metadata.get("start_index") or 0))
+    serialized = ""
+    for doc, score in docs_with_scores:
+        serialized += format_source(doc.metadata['source'], None if stable_order else score, doc.page_content)
+    return serialized
+
+# Create the RAG prompt template (for when context is available)
+rag_template = """You are a helpful assistant. You will be provided with a query and retrieved context.
+Your task is to provide a response based on the retrieved information.
+
+The query is as follows:
+{query}
+
+The retrieved context is as follows:
+{context}
+
+Please provide a concise and informative response based on the retrieved information.
+
+For every piece of information you provide, also provide the source.
+
+Return text as follows:
+
+<Answer to the question>
+Source: source_url
+"""
+
+# Create the general knowledge prompt template (for when no context is available)
+general_template = """You are a helpful assistant. Answer the user's question to the best of your ability.
+
+The query is as follows:
+{query}
+
+Provide a clear and informative response. Since this is a general knowledge question (not from your knowledge base), you don't need to provide a source.
+"""
+
+# The "cached" layout: one system message shared by both chains, so it never changes between calls, followed by a user
+# message with the context first and the question last. Only the end of the prompt differs from one question to the next.
+system_prompt = """You are a helpful assistant. Answer the user's question.
+
+When the user's message contains retrieved context, provide a concise and informative response based on the retrieved information. For every piece of information you provide, also provide the source.
+
+Return text as follows:
+
+<Answer to the question>
+Source: source_url
+
+When there is no retrieved context, the question is a general knowledge question (not from your knowledge base). Provide a clear and informative response to the best of your ability; you don't need to provide a source."""
+
+# the context ends with a blank line
+rag_message_template = """The retrieved context is as follows:
+{context}The query is as follows:
+{query}"""
+
+general_message_template = """The query is as follows:
+{query}"""
+
+
+def build_prompts(layout):
+    """Return the (RAG prompt, general knowledge prompt) of a prompt layout."""
+    if layout == "legacy":
+        return ChatPromptTemplate.from_template(rag_template), ChatPromptTemplate.from_template(general_template)
+    return (
+        ChatPromptTemplate.from_messages([("system", system_prompt), ("human", rag_message_template)]),
+        ChatPromptTemplate.from_messages([("system", system_prompt), ("human", general_message_template)]),
+    )
+
+
+def prefill_stats(response_metadata):
+    """Prompt evaluation statistics Ollama reports with the last chunk of an answer, or None if there are none."""
+    if "prompt_eval_duration" not in response_metadata:
+        return None
+    return {
+        # tokens evaluated for this answer; tokens reused from the KV cache are not evaluated again
+        "prompt_tokens": response_metadata.get("prompt_eval_count", 0),
+        "prefill_seconds": response_metadata["prompt_eval_duration"] / 1e9,
+        "load_seconds": response_metadata.get("load_duration", 0) / 1e9,
+    }
+
+
+###############################   PIPELINE   ###################################################################################################################
+
+class RAGPipeline:
+    """Embeddings, retrievers, prompts and chat model of the RAG chatbot, created once per process.
+
+    The models, the Chroma store and the chains are built in the constructor. The NumPy index, BM25
+    index and retrievers are loaded on first use and reloaded when the ingestion bumps the collection
+    version. Every method is safe to call from several threads.
+    """
+
+    def __init__(self, prompt_layout=PROMPT_LAYOUT, fast_model=FAST_CHAT_MODEL if MODEL_ROUTING else None):
+        self.embeddings = self._load_embeddings()
+        self.llm = self._load_llm()
+
+        self.prompt_layout = prompt_layout
+        rag_prompt, general_prompt = build_prompts(prompt_layout)
+        self.general_prompt = general_prompt
+        # the RAG chain expects {"query": ..., "context": ...} so retrieval only runs once per question
+        self.rag_chain = rag_prompt | self.llm | StrOutputParser()
+        # the general knowledge chain expects {"query": ...}
+        self.general_chain = general_prompt | self.llm | StrOutputParser()
+
+        # the same prompts with the fast chat model, when model routing is on
+        self.fast_llm = None
+        self.model_router = None
+        if fast_model:
+            self.fast_llm = self._load_llm(fast_model)
+            self.fast_rag_chain = rag_prompt | self.fast_llm | StrOutputParser()
+            self.fast_general_chain = general_prompt | self.fast_llm | StrOutputParser()
+            self.model_router = ModelRouter(
+                {FAST_ROUTE: fast_model, FULL_ROUTE: os.getenv("CHAT_MODEL")},
+                max_query_words=MODEL_ROUTING_MAX_QUERY_WORDS,
+                min_relevance=MODEL_ROUTING_MIN_RELEVANCE,
+                max_context_tokens=MODEL_ROUTING_MAX_CONTEXT_TOKENS,
+                latency_budget_ms=MODEL_ROUTING_LATENCY_BUDGET_MS,
+                probe_every=MODEL_ROUTING_PROBE_EVERY,
+                loaded_models=self._ollama_loaded_models if os.getenv("MODEL_PROVIDER") == "ollama" else None,
+            )
+
+        self._vector_store = None
+        self._retrievers = (None, None)
+        self._topic_router = (None, None)
+        self._lock = threading.Lock()
+
+        # seconds the warm-up took, None until warm_up has run
+        self.warm_up_seconds = None
+
+    def _load_embeddings(self):
+        embeddings = OllamaEmbeddings(
+            model=os.getenv("EMBEDDING_MODEL"),
+            keep_alive=OLLAMA_KEEP_ALIVE,
+        )
+
+        if QUERY_EMBEDDING_CACHE:
+            embeddings = CachedQueryEmbeddings(
+                embeddings,
+                model=os.getenv("EMBEDDING_MODEL"),
+                cache_path=os.path.join(os.getenv("EMBEDDING_CACHE_LOCATION", "embedding_cache"), "queries.sqlite3"),
+                dtype=os.getenv("EMBEDDING_CACHE_DTYPE", "float32"),
+            )
+
+        return embeddings
+
+    def _load_llm(self, model=None):
+        model_kwargs = {}
+        if os.getenv("MODEL_PROVIDER") == "ollama" and OLLAMA_KEEP_ALIVE is not None:
+            model_kwargs["keep_alive"] = OLLAMA_KEEP_ALIVE
+        if os.getenv("MODEL_PROVIDER") == "ollama" and OLLAMA_NUM_CTX is not None:
+            model_kwargs["num_ctx"] = OLLAMA_NUM_CTX
+
+        return init_chat_model(
+            model or os.getenv("CHAT_MODEL"),
+            model_provider=os.getenv("MODEL_PROVIDER"),
+            temperature=0,
+            **model_kwargs
+        )
+
+    @staticmethod
+    def _ollama_loaded_models():
+        # a short timeout, the answer is routed without it when Ollama is slow to respond
+        return [model.model for model in ollama.Client(timeout=1).ps().models]
+
+    @property
+    def vector_store(self):
+        """The Chroma collection, opened on first use."""
+        with self._lock:
+            if self._vector_store is None:
+                self._vector_store = Chroma(
+                    collection_name=COLLECTION_NAME,
+                    embedding_function=self.embeddings,
+                    persist_directory=DATABASE_LOCATION,
+                )
+            return self._vector_store
+
+    def collection_version(self):
+        return read_collection_version(DATABASE_LOCATION, COLLECTION_NAME)
+
+    def chat_models(self):
+        """The chat models that may answer a question: the full model, and the fast one with model routing."""
+        if self.model_router is None:
+            return (os.getenv("CHAT_MODEL"),)
+        return tuple(self.model_router.models.values())
+
+    def request_key(self, question):
+        """Key of the answer to a question: the same normalized question, chat models and collection get the same answer."""
+        return (normalize_text(question), self.chat_models(), COLLECTION_NAME, self.collection_version())
+
+    def retrievers(self):
+        """Return (search backend, retriever or None) for the current collection version.
+
+        The search backend is the NumPy index or the Chroma store; the retriever is the MMR stage
+        and/or the hybrid retriever, as configured.
+        """
+        collection_version = self.collection_version()
+        version, retrievers = self._retrievers
+        if version == collection_version:
+            return retrievers
+
+        router = self.topic_router()
+        if VECTOR_BACKEND == "numpy" and os.path.isdir(VECTOR_INDEX_PATH):
+            search_backend = NumpyVectorIndex.load(VECTOR_INDEX_PATH, embeddings=self.embeddings)
+        elif router is not None and router.shards:
+            # searches restricted to topics fan out to the per-topic collections built with TOPIC_SHARDS
+            search_backend = TopicShards.open(self.vector_store, router.shards, DATABASE_LOCATION)
+        else:
+            search_backend = self.vector_store
+
+        retriever = None
+        if HYBRID_RETRIEVAL and os.path.isdir(BM25_INDEX_PATH):
+            retriever = HybridRetriever(
+                vector_store=search_backend,
+                bm25_index=BM25Index.load(BM25_INDEX_PATH),
+                k=RETRIEVER_K,
+                fetch_k=HYBRID_FETCH_K,
+            )
+        if MMR_RERANK:
+            retriever = MMRRetriever(
+                vector_store=search_backend,
+                hybrid_retriever=retriever,
+                k=RETRIEVER_K,
+                fetch_k=MMR_FETCH_K,
+                lambda_mult=MMR_LAMBDA,
+                latency_budget_ms=MMR_LATENCY_BUDGET_MS,
+            )
+
+        # a concurrent reload builds the same objects, whichever is stored last wins
+        self._retrievers = (collection_version, (search_backend, retriever))
+        return search_backend, retriever
+
+    def topic_router(self):
+        """The topic router of the current collection version, or None when topic routing is off or the ingestion built none."""
+        if not TOPIC_ROUTING:
+            return None
+        collection_version = self.collection_version()
+        version, router = self._topic_router
+        if version != collection_version:
+            router = TopicRouter.load(TOPIC_ROUTER_PATH) if os.path.isdir(TOPIC_ROUTER_PATH) else None
+            self._topic_router = (collection_version, router)
+        return router
+
+    def route_topics(self, query_embedding):
+        """Return the topics to restrict retrieval to as (topic, similarity) pairs, or None to search everything."""
+        router = self.topic_router()
+        if router is None or not len(router):
+            return None
+        return router.classify(query_embedding, TOPIC_ROUTING_MAX_TOPICS, TOPIC_ROUTING_MARGIN)
+
+    def retrieve(self, query, query_embedding):
+        """Return the top chunks for an already embedded query with their relevance scores, and the time spent in each stage.
+
+        With topic routing, the timings also hold the time spent classifying the query and the topics the search was restricted to.
+        """
+        search_backend, retriever = self.retrievers()
+        started_at = time.perf_counter()
+
+        routed = self.route_topics(query_embedding)
+        topics = [topic for topic, _ in routed] if routed else None
+        route_seconds = time.perf_counter() - started_at
+
+        if retriever is not None:
+            results, timings = retriever.retrieve_with_timings(query, query_embedding, topics=topics)
+        else:
+            results, timings = vector_search(search_backend, query_embedding, RETRIEVER_K, topics), {}
+
+        if routed is not None:
+            timings["topic_routing"] = route_seconds
+            timings["topics"] = topics
+
+        timings["total"] = time.perf_counter() - started_at
+        return results, timings
+
+    def route(self, question, retrieved_docs, timings=None, context_stats=None, model_route=None):
+        """Choose the chain for a question: RAG when at least one chunk is relevant enough, general knowledge otherwise.
+
+        Returns (chain, chain input, relevant chunks with their scores). With context packing, the
+        size of the context and the tokens saved by packing are written to the `context_stats` dict.
+        With model routing, the chain uses the chat model chosen by the router, and the route, model
+        and reason are written to the `model_route` dict; pass it on to stream_tokens.
+        """
+        relevant_docs = [(doc, score) for doc, score in retrieved_docs if score >= RELEVANCE_THRESHOLD]
+        if not relevant_docs:
+            if self.choose_model(question, [], "", timings, model_route) == FAST_ROUTE:
+                return self.fast_general_chain, {"query": question}, []
+            return self.general_chain, {"query": question}, []
+
+        # the same chunks give the same context whatever their scores, so the prompt prefix can be reused
+        stable_order = self.prompt_layout == "cached"
+        if CONTEXT_PACKING:
+            with stage("pack_context", timings, pipeline="chat") as span:
+                context, statistics = pack_context(relevant_docs, CONTEXT_TOKEN_BUDGET, stable_order)
+                for name, value in statistics.items():
+                    span.set_attribute(f"context.{name}", value)
+            if context_stats is not None:
+                context_stats.update(statistics)
+        else:
+            with stage("format_docs", timings, pipeline="chat"):
+                context = format_docs(relevant_docs, stable_order)
+        if self.choose_model(question, relevant_docs, context, timings, model_route) == FAST_ROUTE:
+            return self.fast_rag_chain, {"query": question, "context": context}, relevant_docs
+        return self.rag_chain, {"query": question, "context": context}, relevant_docs
+
+    def choose_model(self, question, relevant_docs, context, timings=None, model_route=None):
+        """Return the route (fast or full chat model) of an answer; always the full model without model routing."""
+        if self.model_router is None:
+            return FULL_ROUTE
+
+        with stage("route_model", timings, pipeline="chat") as span:
+            # the stages timed so far, i.e. the time the question has already spent in the pipeline
+            elapsed_seconds = sum(seconds for seconds in (timings or {}).values() if isinstance(seconds, float))
+            route, reason = self.model_router.choose(question, relevant_docs, context, elapsed_seconds)
+            span.set_attribute("model.route", route)
+            span.set_attribute("model.reason", reason)
+        if model_route is not None:
+            model_route.update(route=route, model=self.model_router.models[route], reason=reason)
+        return route
+
+    def _fallback_model(self, model_route, error):
+        """The full chat model, for an answer whose fast model failed before its first token; None when it can't fall back."""
+        if self.model_router is None or not model_route or model_route["route"] != FAST_ROUTE:
+            return None
+        self.model_router.record_fallback()
+        model_route.update(route=FULL_ROUTE, model=self.model_router.models[FULL_ROUTE], reason="fallback", error=repr(error))
+        return self.llm
+
+    def _record_route(self, model_route, first_token_seconds, answer_seconds):
+        if self.model_router is not None and model_route and first_token_seconds is not None:
+            self.model_router.record(model_route["route"], model_route["reason"], first_token_seconds, answer_seconds)
+
+    def stream_tokens(self, chain, chain_input, timings=None, prefill=None, model_route=None):
+        """Yield the answer of a chain token by token.
+
+        The prompt, chat model and output parser of the chain are run one by one, so the time spent in
+        each of them is recorded as a separate stage. Time spent by the caller between tokens is not counted.
+        The prompt evaluation statistics of the chat model (see prefill_stats) are written to the `prefill` dict.
+        With the `model_route` of route(), an answer the fast model fails to start is generated by the full
+        model instead, and the latency of the answer is recorded for its route.
+        """
+        prompt, chat_model, output_parser = chain.steps
+
+        prompt_started_at = time.perf_counter()
+        with stage("prompt", timings, pipeline="chat"):
+            prompt_value = prompt.invoke(chain_input)
+        prompt_seconds = time.perf_counter() - prompt_started_at
+
+        # the stages interleave while streaming, so each one is timed piecewise and recorded at the end
+        llm_seconds, parse_seconds = 0.0, 0.0
+        first_token_seconds = None
+        chunks = chat_model.stream(prompt_value)
+        try:
+            while True:
+                step_started_at = time.perf_counter()
+                try:
+                    chunk = next(chunks, None)
+                except Exception as error:
+                    fallback_model = self._fallback_model(model_route, error) if first_token_seconds is None else None
+                    if fallback_model is None:
+                        raise
+                    # the prompt is the same for both models, only the model changes
+                    chunks = fallback_model.stream(prompt_value)
+                    continue
+                finally:
+                    llm_seconds += time.perf_counter() - step_started_at
+                if chunk is None:
+                    self._record_route(model_route, first_token_seconds, prompt_seconds + llm_seconds + parse_seconds)
+                    break
+                if prefill is not None and chunk.response_metadata.get("done"):
+                    prefill.update(prefill_stats(chunk.response_metadata) or {})
+
+                step_started_at = time.perf_counter()
+                token = output_parser.invoke(chunk)
+                parse_seconds += time.perf_counter() - step_started_at
+                if token:
+                    if first_token_seconds is None:
+                        first_token_seconds = prompt_seconds + llm_seconds + parse_seconds
+                    yield token
+        finally:
+            record_stage("llm", llm_seconds, timings, pipeline="chat")
+            record_stage("parse", parse_seconds, timings, pipeline="chat")
+
+    async def astream_tokens(self, chain, chain_input, timings=None, prefill=None, model_route=None):
+        """Async version of stream_tokens, for the HTTP API."""
+        prompt, chat_model, output_parser = chain.steps
+
+        prompt_started_at = time.perf_counter()
+        with stage("prompt", timings, pipeline="chat"):
+            prompt_value = await prompt.ainvoke(chain_input)
+        prompt_seconds = time.perf_counter() - prompt_started_at
+
+        llm_seconds, parse_seconds = 0.0, 0.0
+        first_token_seconds = None
+        chunks = chat_model.astream(prompt_value)
+        try:
+            while True:
+                step_started_at = time.perf_counter()
+                try:
+                    chunk = await anext(chunks, None)
+                except Exception as error:
+                    fallback_model = self._fallback_model(model_route, error) if first_token_seconds is None else None
+                    if fallback_model is None:
+                        raise
+                    chunks = fallback_model.astream(prompt_value)
+                    continue
+                finally:
+                    llm_seconds += time.perf_counter() - step_started_at
+                if chunk is None:
+                    self._record_route(model_route, first_token_seconds, prompt_seconds + llm_seconds + parse_seconds)
+                    break
+                if prefill is not None and chunk.response_metadata.get("done"):
+                    prefill.update(prefill_stats(chunk.response_metadata) or {})
+
+                step_started_at = time.perf_counter()
+                token = output_parser.invoke(chunk)
+                parse_seconds += time.perf_counter() - step_started_at
+                if token:
+                    if first_token_seconds is None:
+                        first_token_seconds = prompt_seconds + llm_seconds + parse_seconds
+                    yield token
+        finally:
+            await chunks.aclose()
+            record_stage("llm", llm_seconds, timings, pipeline="chat")
+            record_stage("parse", parse_seconds, timings, pipeline="chat")
+
+    def warm_up(self):
+        """Load the models into Ollama and open the vector store and indexes, so the first question is not slowed down."""
+        started_at = time.perf_counter()
+
+        query_embedding = self.embeddings.embed_query("warm up")
+        search_backend, _ = self.retrievers()
+        vector_search(search_backend, query_embedding, 1)
+
+        # a one-token generation is enough to load the chat model into memory; it also evaluates the system
+        # prompt of the "cached" layout, so the first question already finds it in the KV cache. num_predict is set
+        # on a copy of the model: options passed to invoke would replace its num_ctx, temperature and the rest, and
+        # Ollama reloads a model (dropping its KV cache) when the first question comes with another num_ctx
+        if os.getenv("MODEL_PROVIDER") == "ollama":
+            self.llm.model_copy(update={"num_predict": 1}).invoke(self.general_prompt.invoke({"query": "Hi"}))
+            if self.fast_llm is not None:
+                try:
+                    self.fast_llm.model_copy(update={"num_predict": 1}).invoke(self.general_prompt.invoke({"query": "Hi"}))
+                except Exception:
+                    # e.g. the fast model is not pulled; its answers fall back to the full model
+                    pass
+
+        self.warm_up_seconds = time.perf_counter() - started_at
+        return self.warm_up_seconds
@@ -0,0 +1,236 @@
+import time
+from typing import Any, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from topics import TopicShards, topic_filter
+from vector_index import NumpyVectorIndex
+
+
+# Every helper below accepts a Chroma vector store, a NumpyVectorIndex or TopicShards. Searches take
+# an optional list of topics to restrict the results to (None or an empty list searches every chunk).
+
+def vector_search(vector_store, query_embedding, k, topics=None):
+    """Return the top k chunks for an already embedded query, with their relevance scores (0-1, higher is better)."""
+    if isinstance(vector_store, TopicShards):
+        return vector_store.fan_out(vector_search, query_embedding, k, topics)
+    if isinstance(vector_store, NumpyVectorIndex):
+        return vector_store.search(query_embedding, k, topics=topics)
+    results = vector_store.similarity_search_by_vector_with_relevance_scores(query_embedding, k=k, filter=topic_filter(topics))
+    # Chroma returns distances here, convert them to relevance scores
+    relevance_score_fn = vector_store._select_relevance_score_fn()
+    return [(doc, relevance_score_fn(distance)) for doc, distance in results]
+
+
+def vector_search_with_embeddings(vector_store, query_embedding, k, topics=None):
+    """Like vector_search, but also return the stored embedding of every chunk, as (doc, relevance, embedding)."""
+    if isinstance(vector_store, TopicShards):
+        return vector_store.fan_out(vector_search_with_embeddings, query_embedding, k, topics)
+    if isinstance(vector_store, NumpyVectorIndex):
+        return vector_store.search(query_embedding, k, include_embeddings=True, topics=topics)
+    results = vector_store._collection.query(
+        query_embeddings=[query_embedding],
+        n_results=k,
+        where=topic_filter(topics),
+        include=["documents", "metadatas", "distances", "embeddings"],
+    )
+    relevance_score_fn = vector_store._select_relevance_score_fn()
+    return [
+        (Document(id=chunk_id, page_content=text, metadata=metadata or {}), relevance_score_fn(distance), embedding)
+        for chunk_id, text, metadata, distance, embedding in zip(
+            results["ids"][0], results["documents"][0], results["metadatas"][0], results["distances"][0], results["embeddings"][0]
+        )
+    ]
+
+
+def relevance_scores(vector_store, query_embedding, embeddings):
+    """Relevance scores of stored chunk embeddings, computed the same way Chroma scores search results."""
+    if isinstance(vector_store, TopicShards):
+        vector_store = vector_store.vector_store
+    if isinstance(vector_store, NumpyVectorIndex):
+        return vector_store.relevance_scores(query_embedding, embeddings)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, len(query))
+
+    space = (vector_store._collection.metadata or {}).get("hnsw:space", "l2")
+    if space == "cosine":
+        norms = np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query)
+        distances = 1 - (embeddings @ query) / np.where(norms > 0, norms, 1)
+    elif space == "ip":
+        distances = 1 - embeddings @ query
+    else:
+        # Chroma's l2 distance is the squared euclidean distance
+        distances = ((embeddings - query) ** 2).sum(axis=1)
+
+    relevance_score_fn = vector_store._select_relevance_score_fn()
+    return [relevance_score_fn(float(distance)) for distance in distances]
+
+
+def get_chunks(vector_store, ids, include_embeddings=False):
+    """Fetch chunks by ID from the collection, as Documents in the order of the IDs."""
+    if isinstance(vector_store, TopicShards):
+        vector_store = vector_store.vector_store
+    if isinstance(vector_store, NumpyVectorIndex):
+        return vector_store.get(ids, include_embeddings)
+    include = ["documents", "metadatas"] + (["embeddings"] if include_embeddings else [])
+    result = vector_store._collection.get(ids=list(ids), include=include)
+
+    chunks = {}
+    for i, chunk_id in enumerate(result["ids"]):
+        document = Document(id=chunk_id, page_content=result["documents"][i], metadata=result["metadatas"][i] or {})
+        chunks[chunk_id] = (document, result["embeddings"][i] if include_embeddings else None)
+    return [chunks[chunk_id] for chunk_id in ids if chunk_id in chunks]
+
+
+class HybridRetriever(BaseRetriever):
+    """Retriever that fuses BM25 and Chroma vector results with reciprocal rank fusion.
+
+    Rare proper nouns, dates and codes are found by the lexical index even when the embedding
+    search misses them, so a small k keeps its precision. Can stand in for vector_store.as_retriever().
+    vector_store is the Chroma store, a NumpyVectorIndex or TopicShards.
+    """
+
+    vector_store: Any
+    bm25_index: Any
+    k: int = 2
+    # candidates taken from each of the two searches before fusion
+    fetch_k: int = 10
+    # the usual RRF constant: a document scores 1 / (rrf_k + rank) in each result list
+    rrf_k: int = 60
+
+    def retrieve_with_scores(self, query, query_embedding):
+        """Return the top k fused chunks with their vector relevance scores."""
+        return self.retrieve_with_timings(query, query_embedding)[0]
+
+    def retrieve_with_timings(self, query, query_embedding, k=None, include_embeddings=False, topics=None):
+        """Return the top k fused chunks with their relevance scores, and the time spent in each search.
+
+        With include_embeddings, every result also carries its stored embedding: (doc, relevance, embedding).
+        With topics, both searches only return chunks of those topics.
+        """
+        k = k or self.k
+        fetch_k = max(self.fetch_k, k)
+        timings = {}
+
+        started_at = time.perf_counter()
+        if include_embeddings:
+            vector_results = vector_search_with_embeddings(self.vector_store, query_embedding, fetch_k, topics)
+        else:
+            vector_results = [(doc, score, None) for doc, score in vector_search(self.vector_store, query_embedding, fetch_k, topics)]
+        timings["vector_search"] = time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        lexical_results = self.bm25_index.search(query, fetch_k, topics=topics)
+        timings["bm25_search"] = time.perf_counter() - started_at
+
+        fused = {}
+        for rank, (doc, _, _) in enumerate(vector_results):
+            fused[doc.id] = fused.get(doc.id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        for rank, (chunk_id, _) in enumerate(lexical_results):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+
+        top_ids = sorted(fused, key=fused.get, reverse=True)[:k]
+
+        # chunks only found by BM25 are fetched from the collection and scored against the query embedding
+        started_at = time.perf_counter()
+        scored = {doc.id: (doc, score, embedding) for doc, score, embedding in vector_results}
+        lexical_only = [chunk_id for chunk_id in top_ids if chunk_id not in scored]
+        if lexical_only:
+            chunks = get_chunks(self.vector_store, lexical_only, include_embeddings=True)
+            scores = relevance_scores(self.vector_store, query_embedding, [embedding for _, embedding in chunks])
+            for (doc, embedding), score in zip(chunks, scores):
+                scored[doc.id] = (doc, score, embedding)
+        timings["fetch_lexical_only"] = time.perf_counter() - started_at
+
+        results = [scored[chunk_id] for chunk_id in top_ids if chunk_id in scored]
+        if not include_embeddings:
+            results = [(doc, score) for doc, score, _ in results]
+        return results, timings
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        query_embedding = self.vector_store.embeddings.embed_query(query)
+        return [doc for doc, _ in self.retrieve_with_scores(query, query_embedding)]
+
+
+def mmr_select(query_embedding, embeddings, k, lambda_mult=0.5):
+    """Pick k indices by maximal marginal relevance, with all similarities computed as matrix products.
+
+    Each step selects the candidate maximizing
+    lambda_mult * sim(query, candidate) - (1 - lambda_mult) * max(sim(candidate, selected)).
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if not len(embeddings):
+        return []
+    query = np.asarray(query_embedding, dtype=np.float32)
+
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    normalized = embeddings / np.where(norms > 0, norms, 1)
+    query = query / (np.linalg.norm(query) or 1)
+
+    query_similarity = normalized @ query
+    pairwise_similarity = normalized @ normalized.T
+
+    selected = []
+    available = np.ones(len(embeddings), dtype=bool)
+    redundancy = np.zeros(len(embeddings), dtype=np.float32)
+
+    for _ in range(min(k, len(embeddings))):
+        scores = lambda_mult * query_similarity - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+
+        selected.append(best)
+        available[best] = False
+        # similarity of every candidate to its closest selected chunk
+        redundancy = pairwise_similarity[best] if len(selected) == 1 else np.maximum(redundancy, pairwise_similarity[best])
+
+    return selected
+
+
+class MMRRetriever(BaseRetriever):
+    """Reranking stage that picks a diverse final k from a wider candidate pool with maximal marginal relevance.
+
+    With chunk overlap, the best chunks are often neighbours that say nearly the same thing. This stage
+    fetches fetch_k candidates with their stored embeddings (from the hybrid retriever when one is given,
+    from Chroma otherwise) and drops near-duplicates. If fetching the candidates already used up the
+    latency budget, the top k candidates are returned as they are.
+    """
+
+    vector_store: Any
+    hybrid_retriever: Optional[Any] = None
+    k: int = 2
+    fetch_k: int = 20
+    # 1 only considers relevance, 0 only diversity
+    lambda_mult: float = 0.5
+    latency_budget_ms: float = 200
+
+    def retrieve_with_scores(self, query, query_embedding):
+        return self.retrieve_with_timings(query, query_embedding)[0]
+
+    def retrieve_with_timings(self, query, query_embedding, topics=None):
+        """Return the selected chunks with their relevance scores, and the time spent in each stage."""
+        started_at = time.perf_counter()
+        if self.hybrid_retriever is not None:
+            candidates, timings = self.hybrid_retriever.retrieve_with_timings(
+                query, query_embedding, k=self.fetch_k, include_embeddings=True, topics=topics
+            )
+        else:
+            candidates = vector_search_with_embeddings(self.vector_store, query_embedding, self.fetch_k, topics)
+            timings = {}
+        timings["candidates"] = time.perf_counter() - started_at
+
+        if timings["candidates"] * 1000 > self.latency_budget_ms:
+            timings["mmr_skipped"] = True
+            selected = list(range(min(self.k, len(candidates))))
+        else:
+            rerank_started_at = time.perf_counter()
+            selected = mmr_select(query_embedding, [embedding for _, _, embedding in candidates], self.k, self.lambda_mult)
+            timings["mmr"] = time.perf_counter() - rerank_started_at
+
+        return [(candidates[i][0], candidates[i][1]) for i in selected], timings
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        query_embedding = self.vector_store.embeddings.embed_query(query)
+        return [doc for doc, _ in self.retrieve_with_scores(query, query_embedding)]
@@ -0,0 +1,44 @@
+import os
+import sqlite3
+
+
+class ScrapeCache:
+    """On-disk cache of scraped Wikipedia pages, keyed by page title.
+
+    Each page is stored with the revision ID its extract was taken from, so a refresh only has to
+    download pages whose current revision differs from the cached one.
+    """
+
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pages (title TEXT PRIMARY KEY, url TEXT NOT NULL, revid INTEGER NOT NULL, extract TEXT NOT NULL)"
+        )
+        self._db.commit()
+
+    def revisions(self):
+        """Return {title: revision ID} of every cached page."""
+        return dict(self._db.execute("SELECT title, revid FROM pages"))
+
+    def get(self, title):
+        row = self._db.execute("SELECT url, revid, extract FROM pages WHERE title = ?", (title,)).fetchone()
+        if row is None:
+            return None
+        return {"title": title, "url": row[0], "revid": row[1], "extract": row[2]}
+
+    def put(self, title, url, revid, extract):
+        self._db.execute(
+            "INSERT OR REPLACE INTO pages (title, url, revid, extract) VALUES (?, ?, ?, ?)",
+            (title, url, revid, extract),
+        )
+
+    def remove(self, titles):
+        self._db.executemany("DELETE FROM pages WHERE title = ?", [(title,) for title in titles])
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,147 @@
+import asyncio
+import threading
+from contextlib import contextmanager
+
+
+class SharedStreamError(Exception):
+    """Raised to the readers of a SharedStream whose producer failed; the producer's exception is the cause."""
+
+
+class SharedStream:
+    """Items (e.g. answer tokens) produced by one request and read by any number of others while it runs.
+
+    Readers iterate with `for` (blocking, from any thread) or `async for` (from any event loop) and
+    get every item from the start, then the new ones as they are published. If the producer fails,
+    readers get a SharedStreamError once they have read everything published before it.
+    """
+
+    def __init__(self):
+        self._items = []
+        self._finished = False
+        self._error = None
+        self._condition = threading.Condition()
+        # (event loop, asyncio.Event) of async readers waiting for the next item
+        self._async_waiters = []
+
+    def publish(self, item):
+        with self._condition:
+            self._items.append(item)
+            self._wake_up()
+
+    def finish(self, error=None):
+        with self._condition:
+            self._finished = True
+            self._error = error
+            self._wake_up()
+
+    def tee(self, iterable):
+        """Publish every item of an iterable while passing it through."""
+        for item in iterable:
+            self.publish(item)
+            yield item
+
+    def __iter__(self):
+        index = 0
+        while True:
+            with self._condition:
+                while index == len(self._items) and not self._finished:
+                    self._condition.wait()
+                items = self._items[index:]
+                error = self._error
+            index += len(items)
+            yield from items
+            if not items:
+                if error is not None:
+                    raise SharedStreamError("the request producing this stream failed") from error
+                return
+
+    async def __aiter__(self):
+        loop = asyncio.get_running_loop()
+        index = 0
+        while True:
+            with self._condition:
+                items = self._items[index:]
+                finished, error = self._finished, self._error
+                if not items and not finished:
+                    event = asyncio.Event()
+                    self._async_waiters.append((loop, event))
+
+            if items:
+                index += len(items)
+                for item in items:
+                    yield item
+            elif finished:
+                if error is not None:
+                    raise SharedStreamError("the request producing this stream failed") from error
+                return
+            else:
+                await event.wait()
+
+    def _wake_up(self):
+        self._condition.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+
+class SingleFlight:
+    """Coalesce identical requests that are in flight at the same time.
+
+    The first caller for a key becomes the leader: it does the work and publishes its results to a
+    SharedStream. Callers with the same key that arrive before the leader finishes get that stream
+    instead of doing the work again. Once the leader finishes, the next caller starts a new flight.
+
+        stream, is_leader = single_flight.join(key)
+        if is_leader:
+            with single_flight.leading(key, stream):
+                tokens = list(stream.tee(generate()))
+        else:
+            tokens = list(stream)
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def join(self, key):
+        """Return (stream, True) for a new flight the caller must produce, or (stream, False) to read one in flight."""
+        with self._lock:
+            stream = self._flights.get(key)
+            if stream is not None:
+                self.coalesced += 1
+                return stream, False
+
+            stream = SharedStream()
+            self._flights[key] = stream
+            self.executed += 1
+            return stream, True
+
+    def finish(self, key, stream, error=None):
+        """End a flight: later callers start a new one, and readers get the end of the stream (or the error)."""
+        with self._lock:
+            if self._flights.get(key) is stream:
+                del self._flights[key]
+        stream.finish(error)
+
+    @contextmanager
+    def leading(self, key, stream):
+        """Finish the flight when the block exits, passing on the exception the leader failed with, if any."""
+        try:
+            yield stream
+        except BaseException as e:
+            self.finish(key, stream, e)
+            raise
+        self.finish(key, stream)
+
+    def stats(self):
+        with self._lock:
+            total = self.executed + self.coalesced
+            return {
+                "executed": self.executed,
+                # each coalesced request saved a query embedding, a retrieval and a full LLM generation
+                "coalesced": self.coalesced,
+                "in_flight": len(self._flights),
+                "coalesced_rate": self.coalesced / total if total else 0.0,
+            }
@@ -0,0 +1,100 @@
+import os
+import time
+from contextlib import contextmanager
+
+from opentelemetry import metrics, trace
+
+# The tracer and histogram are created up front; until setup_telemetry installs the SDK providers,
+# OpenTelemetry's no-op API makes spans and samples free, while stage() still measures the time.
+_tracer = trace.get_tracer("rag-chatbot-ollama-lab")
+_meter = metrics.get_meter("rag-chatbot-ollama-lab")
+_stage_duration = _meter.create_histogram(
+    "rag.stage.duration",
+    unit="s",
+    description="Time spent in each stage of the chat and ingestion pipelines",
+)
+
+
+def setup_telemetry(service_name, exporter=None):
+    """Install the OpenTelemetry SDK with the exporter from TELEMETRY_EXPORTER ("none", "console" or "otlp").
+
+    The OTLP exporter sends to OTEL_EXPORTER_OTLP_ENDPOINT (default localhost:4317) over gRPC.
+    Call it once per process. Returns whether anything is exported.
+    """
+    exporter = exporter or os.getenv("TELEMETRY_EXPORTER", "none")
+    if exporter == "none":
+        return False
+
+    from opentelemetry.sdk.metrics import MeterProvider
+    from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    if exporter == "console":
+        from opentelemetry.sdk.metrics.export import ConsoleMetricExporter
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+        span_exporter, metric_exporter = ConsoleSpanExporter(), ConsoleMetricExporter()
+    elif exporter == "otlp":
+        from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        span_exporter, metric_exporter = OTLPSpanExporter(), OTLPMetricExporter()
+    else:
+        raise ValueError(f"Unknown TELEMETRY_EXPORTER {exporter!r}, expected none, console or otlp")
+
+    resource = Resource.create({"service.name": service_name})
+
+    tracer_provider = TracerProvider(resource=resource)
+    tracer_provider.add_span_processor(BatchSpanProcessor(span_exporter))
+    trace.set_tracer_provider(tracer_provider)
+
+    metric_reader = PeriodicExportingMetricReader(
+        metric_exporter, export_interval_millis=int(os.getenv("TELEMETRY_EXPORT_INTERVAL_MS", "60000"))
+    )
+    metrics.set_meter_provider(MeterProvider(resource=resource, metric_readers=[metric_reader]))
+    return True
+
+
+def shutdown_telemetry():
+    """Export everything still buffered; call it before a script exits."""
+    for provider in (trace.get_tracer_provider(), metrics.get_meter_provider()):
+        if hasattr(provider, "shutdown"):
+            provider.shutdown()
+
+
+@contextmanager
+def stage(name, timings=None, **attributes):
+    """Time a pipeline stage as a span and a histogram sample, and add its seconds to timings[name]."""
+    started_at = time.perf_counter()
+    with _tracer.start_as_current_span(name, attributes=attributes) as span:
+        try:
+            yield span
+        finally:
+            _record(name, time.perf_counter() - started_at, timings, attributes)
+
+
+def record_stage(name, seconds, timings=None, **attributes):
+    """Record a stage whose time was measured piecewise (e.g. interleaved with a stream) and just ended."""
+    end_time = time.time_ns()
+    span = _tracer.start_span(name, attributes=attributes, start_time=end_time - int(seconds * 1e9))
+    span.end(end_time=end_time)
+    _record(name, seconds, timings, attributes)
+
+
+def timed_iter(iterable, name, timings=None, **attributes):
+    """Yield from an iterable, timing every step of it as a stage."""
+    iterator = iter(iterable)
+    while True:
+        started_at = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        record_stage(name, time.perf_counter() - started_at, timings, **attributes)
+        yield item
+
+
+def _record(name, seconds, timings, attributes):
+    _stage_duration.record(seconds, {"stage": name, **attributes})
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
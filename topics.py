@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langchain_chroma import Chroma
+
+# chunk metadata field holding the topic: the (first) keyword the article was scraped for
+TOPIC_FIELD = "keyword"
+# an article can be scraped for several keywords; Chroma metadata can't hold lists, so every topic of a
+# chunk is also stored as a flag "keyword:<topic>": True
+TOPIC_FLAG_PREFIX = f"{TOPIC_FIELD}:"
+
+
+def topic_metadata(topics):
+    """Chunk metadata fields for the topics of an article: the first one under TOPIC_FIELD and a flag for each."""
+    if not topics:
+        return {}
+    return {TOPIC_FIELD: topics[0], **{f"{TOPIC_FLAG_PREFIX}{topic}": True for topic in topics}}
+
+
+def chunk_topics(metadata):
+    """Topics of a chunk, empty for chunks ingested without one."""
+    return [key[len(TOPIC_FLAG_PREFIX):] for key, value in (metadata or {}).items() if key.startswith(TOPIC_FLAG_PREFIX) and value is True]
+
+
+def topic_filter(topics):
+    """Chroma `where` filter restricting a query to chunks of any of the given topics, or None for no restriction.
+
+    None and an empty list are no restriction (Chroma rejects an empty $or).
+    """
+    if not topics:
+        return None
+    conditions = [{f"{TOPIC_FLAG_PREFIX}{topic}": True} for topic in topics]
+    return conditions[0] if len(conditions) == 1 else {"$or": conditions}
+
+
+class TopicRouter:
+    """Nearest-centroid topic classifier for query embeddings.
+
+    The centroid of a topic is the normalized mean of the normalized embeddings of its chunks, so
+    classifying a query is one matrix-vector product over the topics. A query is routed to the
+    best topic and to the next ones whose cosine similarity is within `margin` of it.
+    """
+
+    def __init__(self, topics, centroids, counts, shards=None):
+        self.topics = list(topics)
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        # topic -> name of its shard collection, when the corpus is sharded
+        self.shards = shards or {}
+
+    def __len__(self):
+        return len(self.topics)
+
+    @classmethod
+    def build(cls, rows, shards=None):
+        """Build the router from (topics, embedding) pairs; a chunk counts towards each of its topics."""
+        sums, counts = {}, {}
+        for topics, embedding in rows:
+            if not topics:
+                continue
+            embedding = np.asarray(embedding, dtype=np.float32)
+            embedding = embedding / (np.linalg.norm(embedding) or 1)
+            for topic in topics:
+                if topic not in sums:
+                    sums[topic] = np.zeros(len(embedding), dtype=np.float32)
+                    counts[topic] = 0
+                sums[topic] += embedding
+                counts[topic] += 1
+
+        topics = sorted(sums)
+        if not topics:
+            return cls([], np.zeros((0, 0), dtype=np.float32), [], shards)
+        centroids = np.stack([sums[topic] for topic in topics])
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        return cls(topics, centroids, [counts[topic] for topic in topics], shards)
+
+    def save(self, path):
+        """Save the router to a directory, replacing any previous one only once it is fully written."""
+        temp_path = path + ".tmp"
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+
+        np.save(os.path.join(temp_path, "centroids.npy"), self.centroids)
+        with open(os.path.join(temp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"topics": self.topics, "counts": self.counts.tolist(), "shards": self.shards}, f, ensure_ascii=False)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(meta["topics"], np.load(os.path.join(path, "centroids.npy")), meta["counts"], meta["shards"])
+
+    def classify(self, query_embedding, max_topics=2, margin=0.05):
+        """Return up to max_topics (topic, cosine similarity) pairs for a query, best first."""
+        if not self.topics:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        similarities = self.centroids @ (query / (np.linalg.norm(query) or 1))
+
+        order = np.argsort(-similarities)[:max_topics]
+        best = similarities[order[0]]
+        return [(self.topics[i], float(similarities[i])) for i in order if similarities[i] >= best - margin]
+
+
+def iter_collection(vector_store, include, batch_size=1000):
+    """Yield every chunk of a Chroma collection as a dict of the included fields, one batch at a time."""
+    offset = 0
+    while True:
+        batch = vector_store._collection.get(limit=batch_size, offset=offset, include=include)
+        if not batch["ids"]:
+            return
+        for i, chunk_id in enumerate(batch["ids"]):
+            yield {"id": chunk_id, **{field: batch[field][i] for field in include}}
+        offset += len(batch["ids"])
+
+
+def build_collection_router(vector_store, path, shards=None, batch_size=1000):
+    """Build the topic router from the stored embeddings and topics of a Chroma collection and save it."""
+    router = TopicRouter.build(
+        ((chunk_topics(chunk["metadatas"]), chunk["embeddings"]) for chunk in iter_collection(vector_store, ["metadatas", "embeddings"], batch_size)),
+        shards=shards,
+    )
+    router.save(path)
+    return router
+
+
+###############################   TOPIC SHARDS   ###############################################################################################################
+
+def shard_collection_name(collection_name, topic):
+    """Name of the shard collection of a topic; Chroma only allows letters, digits, '.', '_' and '-' in names."""
+    slug = re.sub(r"[^a-z0-9]+", "-", topic.lower()).strip("-")[:40]
+    digest = hashlib.sha256(topic.encode("utf-8")).hexdigest()[:8]
+    return f"{collection_name}--{slug}-{digest}" if slug else f"{collection_name}--{digest}"
+
+
+def build_topic_shards(vector_store, collection_name, batch_size=1000):
+    """Copy the chunks of a collection into one collection per topic, and delete shards of topics that are gone.
+
+    Returns {topic: shard collection name}. Chunks of several topics are copied into each of their shards,
+    chunks without a topic are only in the main collection.
+    """
+    client = vector_store._client
+    metadata = vector_store._collection.metadata
+    shard_prefix = f"{collection_name}--"
+
+    # shards are rebuilt from scratch, like the BM25 and NumPy indexes
+    for name in client.list_collections():
+        name = getattr(name, "name", name)
+        if name.startswith(shard_prefix):
+            client.delete_collection(name)
+
+    shards = {}
+    collections = {}
+    for chunk in iter_collection(vector_store, ["documents", "metadatas", "embeddings"], batch_size):
+        for topic in chunk_topics(chunk["metadatas"]):
+            if topic not in collections:
+                shards[topic] = shard_collection_name(collection_name, topic)
+                collections[topic] = ([], client.create_collection(shards[topic], metadata=metadata))
+
+            pending, collection = collections[topic]
+            pending.append(chunk)
+            if len(pending) >= batch_size:
+                _write_shard(collection, pending)
+                pending.clear()
+
+    for pending, collection in collections.values():
+        if pending:
+            _write_shard(collection, pending)
+    return shards
+
+
+def _write_shard(collection, chunks):
+    collection.upsert(
+        ids=[chunk["id"] for chunk in chunks],
+        documents=[chunk["documents"] for chunk in chunks],
+        metadatas=[chunk["metadatas"] for chunk in chunks],
+        embeddings=[chunk["embeddings"] for chunk in chunks],
+    )
+
+
+class TopicShards:
+    """The main Chroma collection together with one collection per topic.
+
+    Searches restricted to topics run on the shards of those topics concurrently and the results
+    are merged by relevance, so their cost scales with the topics instead of the whole corpus.
+    Everything else (unrestricted searches, fetching chunks by ID) goes to the main collection.
+    """
+
+    def __init__(self, vector_store, shards, max_workers=4):
+        self.vector_store = vector_store
+        self.shards = shards
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="topic-shard")
+
+    @classmethod
+    def open(cls, vector_store, shard_names, persist_directory, max_workers=4):
+        """Open the shard collections of a router next to the main collection."""
+        shards = {
+            topic: Chroma(collection_name=name, embedding_function=vector_store.embeddings, persist_directory=persist_directory)
+            for topic, name in shard_names.items()
+        }
+        return cls(vector_store, shards, max_workers)
+
+    @property
+    def embeddings(self):
+        return self.vector_store.embeddings
+
+    def fan_out(self, search, query_embedding, k, topics, **kwargs):
+        """Run search(store, query_embedding, k, **kwargs) on the shards of the topics and return the merged top k.
+
+        Without topics, or with topics that have no shard, the main collection is searched (filtered to the topics).
+        """
+        stores = [self.shards[topic] for topic in topics or () if topic in self.shards]
+        if not stores:
+            return search(self.vector_store, query_embedding, k, topics=topics, **kwargs)
+        if len(stores) == 1:
+            return search(stores[0], query_embedding, k, **kwargs)
+
+        results = self._executor.map(lambda store: search(store, query_embedding, k, **kwargs), stores)
+        # every result is (doc, relevance, ...) and relevance scores are comparable across shards
+        merged = {}
+        for result in sorted((result for shard_results in results for result in shard_results), key=lambda result: result[1], reverse=True):
+            # chunks of several topics are in each of their shards
+            merged.setdefault(result[0].id, result)
+        return list(merged.values())[:k]
@@ -0,0 +1,276 @@
+import json
+import os
+import shutil
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from topics import chunk_topics
+
+# the embedding matrix can be stored quantized to save memory and disk bandwidth
+INDEX_DTYPES = ("float32", "float16", "int8")
+
+# rows dequantized at a time when scoring a float16 or int8 matrix
+SCORE_BLOCK_SIZE = 8192
+
+# the same relevance functions LangChain uses for Chroma, so scores and thresholds carry over
+RELEVANCE_SCORE_FNS = {
+    "l2": VectorStore._euclidean_relevance_score_fn,
+    "cosine": VectorStore._cosine_relevance_score_fn,
+    "ip": VectorStore._max_inner_product_relevance_score_fn,
+}
+
+
+class NumpyVectorIndex:
+    """Exact in-process vector index over the chunks of a collection, stored as memory-mapped NumPy arrays.
+
+    The embeddings are one (chunks x dimensions) matrix in float32, float16 or int8 (with a scale
+    per row). Chunk texts and metadata live in a JSON lines side file that is read through byte
+    offsets, so only the chunks that are returned are ever decoded. A query is scored with a single
+    matrix-vector product and the top k are selected with argpartition. Distances are computed in
+    the same space as the Chroma collection, so relevance scores are comparable.
+
+    The rows of every topic are listed in topic_rows (topic i owns topic_rows[topic_offsets[i]:topic_offsets[i + 1]]),
+    so a search restricted to topics only scores their rows. A chunk of several topics is listed under each.
+    """
+
+    def __init__(self, vectors, scales, squared_norms, doc_ids, sorted_ids, sorted_rows, chunk_offsets, chunks,
+                 space="l2", embeddings=None, topics=None, topic_rows=None, topic_offsets=None):
+        self.vectors = vectors
+        self.scales = scales
+        self.squared_norms = squared_norms
+        self.doc_ids = doc_ids
+        self.sorted_ids = sorted_ids
+        self.sorted_rows = sorted_rows
+        self.chunk_offsets = chunk_offsets
+        self.chunks = chunks
+        self.space = space
+        # the query embeddings model, used by retrievers that embed the query themselves
+        self.embeddings = embeddings
+        # None for indexes built before topics were stored
+        self.topic_codes = {topic: code for code, topic in enumerate(topics)} if topics is not None else None
+        self.topic_rows = topic_rows
+        self.topic_offsets = topic_offsets
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    @classmethod
+    def build(cls, rows, count, path, space="l2", dtype="float32"):
+        """Write an index to a directory from (chunk ID, text, metadata, embedding) rows.
+
+        `count` is the number of rows, so the matrix can be written straight into a memory-mapped file.
+        Any previous index is only replaced once the new one is fully written.
+        """
+        if dtype not in INDEX_DTYPES:
+            raise ValueError(f"Unsupported vector index dtype {dtype!r}, expected one of {INDEX_DTYPES}")
+
+        temp_path = path + ".tmp"
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+
+        vectors = None
+        scales = np.ones(count, dtype=np.float32)
+        squared_norms = np.zeros(count, dtype=np.float32)
+        doc_ids = []
+        row_topics = []
+        chunk_offsets = np.zeros(count + 1, dtype=np.int64)
+
+        with open(os.path.join(temp_path, "chunks.jsonl"), "wb") as chunks_file:
+            for row, (chunk_id, text, metadata, embedding) in enumerate(rows):
+                embedding = np.asarray(embedding, dtype=np.float32)
+                if vectors is None:
+                    vectors = np.lib.format.open_memmap(
+                        os.path.join(temp_path, "vectors.npy"), mode="w+", dtype=dtype, shape=(count, len(embedding))
+                    )
+
+                squared_norms[row] = embedding @ embedding
+                if space == "cosine":
+                    embedding = embedding / (np.sqrt(squared_norms[row]) or 1)
+                if dtype == "int8":
+                    # symmetric quantization with one scale per row
+                    scales[row] = np.abs(embedding).max() / 127 or 1
+                    vectors[row] = np.round(embedding / scales[row])
+                else:
+                    vectors[row] = embedding
+
+                doc_ids.append(chunk_id)
+                row_topics.append(chunk_topics(metadata))
+                chunks_file.write(json.dumps({"text": text, "metadata": metadata or {}}, ensure_ascii=False).encode("utf-8") + b"\n")
+                chunk_offsets[row + 1] = chunks_file.tell()
+
+        if vectors is None:
+            np.save(os.path.join(temp_path, "vectors.npy"), np.zeros((0, 0), dtype=dtype))
+        else:
+            vectors.flush()
+            del vectors
+
+        doc_ids = np.array(doc_ids, dtype=str)
+        # chunk IDs sorted once at build time, so looking up chunks by ID is a binary search
+        sorted_rows = np.argsort(doc_ids, kind="stable")
+
+        # rows grouped by topic; a chunk is listed under each of its topics, chunks without a topic under none
+        topics = sorted({topic for names in row_topics for topic in names})
+        topic_codes = {topic: code for code, topic in enumerate(topics)}
+        pair_codes = np.array([topic_codes[topic] for names in row_topics for topic in names], dtype=np.int64)
+        pair_rows = np.array([row for row, names in enumerate(row_topics) for _ in names], dtype=np.int64)
+        topic_offsets = np.zeros(len(topics) + 1, dtype=np.int64)
+        topic_offsets[1:] = np.cumsum(np.bincount(pair_codes, minlength=len(topics)))
+
+        arrays = {
+            "scales": scales,
+            "squared_norms": squared_norms,
+            "doc_ids": doc_ids,
+            "sorted_ids": doc_ids[sorted_rows],
+            "sorted_rows": sorted_rows,
+            "chunk_offsets": chunk_offsets,
+            "topic_rows": pair_rows[np.argsort(pair_codes, kind="stable")],
+            "topic_offsets": topic_offsets,
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(temp_path, f"{name}.npy"), array)
+        with open(os.path.join(temp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"space": space, "dtype": dtype, "topics": topics}, f, ensure_ascii=False)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(temp_path, path)
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path, embeddings=None):
+        """Open a saved index with every array and the chunk side file memory-mapped."""
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in ("vectors", "scales", "squared_norms", "doc_ids", "sorted_ids", "sorted_rows", "chunk_offsets")
+        }
+        if "topics" in meta:
+            for name in ("topic_rows", "topic_offsets"):
+                arrays[name] = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        chunks_path = os.path.join(path, "chunks.jsonl")
+        chunks = np.memmap(chunks_path, dtype=np.uint8, mode="r") if os.path.getsize(chunks_path) else np.zeros(0, dtype=np.uint8)
+        return cls(**arrays, chunks=chunks, space=meta["space"], embeddings=embeddings, topics=meta.get("topics"))
+
+    def search(self, query_embedding, k, include_embeddings=False, topics=None):
+        """Return the top k chunks as (doc, relevance) pairs, or (doc, relevance, embedding) with include_embeddings.
+
+        With topics, only the chunks of those topics are scored (indexes built without topics search every chunk).
+        """
+        rows = self._topic_rows(topics)
+        if not len(self) or (rows is not None and not len(rows)):
+            return []
+        distances = self._distances(query_embedding, rows)
+
+        k = min(k, len(distances))
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+
+        relevance_score_fn = RELEVANCE_SCORE_FNS[self.space]
+        return [
+            (self._document(row), relevance_score_fn(float(distances[i])))
+            + ((self._embedding(row),) if include_embeddings else ())
+            for i, row in zip(top, top if rows is None else rows[top])
+        ]
+
+    def relevance_scores(self, query_embedding, embeddings):
+        """Relevance scores of the given embeddings for a query, as search would compute them."""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, len(query))
+        if self.space == "cosine":
+            norms = np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query)
+            distances = 1 - (embeddings @ query) / np.where(norms > 0, norms, 1)
+        elif self.space == "ip":
+            distances = 1 - embeddings @ query
+        else:
+            distances = ((embeddings - query) ** 2).sum(axis=1)
+        return [RELEVANCE_SCORE_FNS[self.space](float(distance)) for distance in distances]
+
+    def get(self, ids, include_embeddings=False):
+        """Return (doc, embedding or None) for the given chunk IDs, in their order; unknown IDs are skipped."""
+        if not len(self):
+            return []
+        ids = np.asarray(list(ids), dtype=str)
+        positions = np.searchsorted(self.sorted_ids, ids)
+        results = []
+        for chunk_id, position in zip(ids, positions):
+            if position < len(self.sorted_ids) and self.sorted_ids[position] == chunk_id:
+                row = int(self.sorted_rows[position])
+                results.append((self._document(row), self._embedding(row) if include_embeddings else None))
+        return results
+
+    def _topic_rows(self, topics):
+        """Sorted rows of the given topics, or None to search every row."""
+        if not topics or self.topic_codes is None:
+            return None
+        codes = [self.topic_codes[topic] for topic in topics if topic in self.topic_codes]
+        if not codes:
+            return np.zeros(0, dtype=np.int64)
+        # sorted, so the memory-mapped matrix is read front to back; rows of several of the topics are scored once
+        return np.unique(np.concatenate([self.topic_rows[self.topic_offsets[code]:self.topic_offsets[code + 1]] for code in codes]))
+
+    def _distances(self, query_embedding, rows=None):
+        """Distances of the query to every row, or to the given rows only (in their order)."""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        if self.space == "cosine":
+            query = query / (np.linalg.norm(query) or 1)
+
+        count = len(self) if rows is None else len(rows)
+        if self.vectors.dtype == np.float32 and rows is None:
+            dots = self.vectors @ query
+        else:
+            # dequantize (or gather) a block of rows at a time, so memory stays bounded on large matrices
+            dots = np.empty(count, dtype=np.float32)
+            for start in range(0, count, SCORE_BLOCK_SIZE):
+                block_rows = slice(start, start + SCORE_BLOCK_SIZE) if rows is None else rows[start:start + SCORE_BLOCK_SIZE]
+                block = self.vectors[block_rows].astype(np.float32, copy=False)
+                dots[start:start + len(block)] = block @ query
+            if self.vectors.dtype == np.int8:
+                dots *= self.scales if rows is None else self.scales[rows]
+
+        if self.space == "l2":
+            # squared euclidean distance, like Chroma
+            squared_norms = self.squared_norms if rows is None else self.squared_norms[rows]
+            return squared_norms + query @ query - 2 * dots
+        return 1 - dots
+
+    def _embedding(self, row):
+        vector = self.vectors[row].astype(np.float32) * self.scales[row]
+        if self.space == "cosine":
+            vector *= np.sqrt(self.squared_norms[row])
+        return vector.tolist()
+
+    def _document(self, row):
+        start, end = self.chunk_offsets[row], self.chunk_offsets[row + 1]
+        chunk = json.loads(self.chunks[start:end].tobytes())
+        return Document(id=str(self.doc_ids[row]), page_content=chunk["text"], metadata=chunk["metadata"])
+
+
+def build_collection_vector_index(vector_store, path, dtype="float32", batch_size=1000):
+    """Build the NumPy vector index from every chunk and stored embedding of a Chroma collection."""
+    def iter_rows():
+        offset = 0
+        while True:
+            batch = vector_store._collection.get(
+                limit=batch_size, offset=offset, include=["documents", "metadatas", "embeddings"]
+            )
+            if not batch["ids"]:
+                return
+            yield from zip(batch["ids"], batch["documents"], batch["metadatas"], batch["embeddings"])
+            offset += len(batch["ids"])
+
+    space = (vector_store._collection.metadata or {}).get("hnsw:space", "l2")
+    return NumpyVectorIndex.build(iter_rows(), vector_store._collection.count(), path, space=space, dtype=dtype)
+
+
+def recall_against_chroma(index, vector_store, query_embeddings, k=10):
+    """Share of Chroma's top k chunk IDs the index also returns in its top k, averaged over the queries."""
+    if not query_embeddings:
+        return 1.0
+    results = vector_store._collection.query(query_embeddings=list(query_embeddings), n_results=k, include=[])
+    overlaps = []
+    for query_embedding, expected_ids in zip(query_embeddings, results["ids"]):
+        found_ids = {doc.id for doc, _ in index.search(query_embedding, k)}
+        overlaps.append(len(found_ids & set(expected_ids)) / len(expected_ids) if expected_ids else 1.0)
+    return float(np.mean(overlaps))
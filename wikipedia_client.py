@@ -0,0 +1,161 @@
+import asyncio
+import random
+
+import httpx
+
+# Wikipedia API endpoint
+WIKIPEDIA_API_URL = "https://en.wikipedia.org/w/api.php"
+
+# Wikipedia requires a User-Agent header
+WIKIPEDIA_HEADERS = {
+    "User-Agent": "LocalRAGBot/1.0 (https://github.com; educational_purpose@example.com)"
+}
+
+# responses worth retrying: rate limited or a temporary server error
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Space requests at least 1 / requests_per_second apart, across all tasks."""
+
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self._next_request_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            delay = self._next_request_at - now
+            self._next_request_at = max(now, self._next_request_at) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class WikipediaClient:
+    """Async MediaWiki API client with a pooled connection, bounded concurrency, a rate limit and retries.
+
+    Use it as an async context manager:
+
+        async with WikipediaClient() as client:
+            results = await client.search_revisions("Python", pages=2)
+            pages = await client.fetch_extracts([result["title"] for result in results])
+    """
+
+    def __init__(self, api_url=WIKIPEDIA_API_URL, concurrency=4, requests_per_second=5.0,
+                 max_retries=5, backoff_seconds=1.0, timeout=30.0, verify=True):
+        self.api_url = api_url
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+        self.verify = verify
+
+        self.requests_made = 0
+        self.retries = 0
+
+        self._rate_limiter = RateLimiter(requests_per_second)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._client = None
+
+    async def __aenter__(self):
+        self._client = httpx.AsyncClient(
+            headers=WIKIPEDIA_HEADERS,
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            timeout=self.timeout,
+            verify=self.verify,
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._client.aclose()
+
+    async def query(self, params):
+        """Send one API request, retrying with exponential backoff on 429, 5xx and connection errors."""
+        params = {"action": "query", "format": "json", "formatversion": "2", **params}
+
+        for attempt in range(self.max_retries + 1):
+            async with self._semaphore:
+                await self._rate_limiter.wait()
+                self.requests_made += 1
+                try:
+                    response = await self._client.get(self.api_url, params=params)
+                except httpx.TransportError:
+                    if attempt == self.max_retries:
+                        raise
+                    response = None
+
+            if response is not None and response.status_code not in RETRY_STATUS_CODES:
+                response.raise_for_status()
+                return response.json()
+
+            if attempt == self.max_retries:
+                response.raise_for_status()
+
+            self.retries += 1
+            await asyncio.sleep(self._retry_delay(response, attempt))
+
+    async def search_revisions(self, keyword, pages=1):
+        """Return the top search results for a keyword with their current revision ID, in search ranking order.
+
+        Only titles and revision IDs are requested, so checking whether pages changed is cheap.
+        """
+        data = await self.query({
+            "generator": "search",
+            "gsrsearch": keyword,
+            "gsrlimit": int(pages),
+            "prop": "revisions",
+            "rvprop": "ids",
+        })
+
+        results = sorted(data.get("query", {}).get("pages", []), key=lambda page: page.get("index", 0))
+        return [
+            {"title": page["title"], "revid": page["revisions"][0]["revid"]}
+            for page in results if page.get("revisions")
+        ]
+
+    async def fetch_extracts(self, titles, errors=None):
+        """Return {title: {"revid": ..., "extract": ...}} with the full plain-text extract of each title.
+
+        TextExtracts returns only one full-text extract per response, so batching titles would only chain
+        continuation requests one after the other. Each title is requested on its own instead, and the
+        requests run concurrently within the client's concurrency and rate limits.
+
+        A title that still fails after the retries raises, or with an `errors` dict is left out of the
+        results and its exception stored under its title, so the other extracts are kept.
+        """
+        results = {}
+
+        async def fetch_extract(title):
+            try:
+                data = await self.query({
+                    "titles": title,
+                    "prop": "extracts|revisions",
+                    "explaintext": 1,
+                    "rvprop": "ids",
+                })
+            except Exception as e:
+                if errors is None:
+                    raise
+                errors[title] = e
+                return
+
+            for page in data.get("query", {}).get("pages", []):
+                if page.get("missing"):
+                    continue
+                result = results.setdefault(page["title"], {})
+                if page.get("revisions"):
+                    result["revid"] = page["revisions"][0]["revid"]
+                if page.get("extract"):
+                    result["extract"] = page["extract"]
+
+        await asyncio.gather(*(fetch_extract(title) for title in titles))
+
+        return {title: result for title, result in results.items() if "extract" in result and "revid" in result}
+
+    def _retry_delay(self, response, attempt):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        # exponential backoff with jitter, so retrying tasks don't hit the API at the same moment
+        return self.backoff_seconds * (2 ** attempt) * (0.5 + random.random() / 2)